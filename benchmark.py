@@ -0,0 +1,358 @@
+import os
+import json
+import time
+import shutil
+import platform
+import resource
+import statistics
+import multiprocessing
+
+import numpy as np
+
+import cubo_envi
+import dependencias
+
+# Valor gravado nos pixels sem dados, o mesmo dos grânulos EMIT
+VALOR_IGNORADO = -9999
+
+
+def _gaussiana(w, centro, largura):
+    return np.exp(-((w - centro) / largura) ** 2)
+
+
+def _sigmoide(w, centro, largura):
+    return 1 / (1 + np.exp(-(w - centro) / largura))
+
+
+def espectros_base(wavelengths):
+    """
+    Espectros de referência (vegetação, solo, água e anomalia) com as feições que as
+    etapas usam: borda do vermelho e platô no NIR na vegetação, NIR baixo na água
+    (NDWI positivo) e um material claro com absorções no SWIR como anomalia.
+    """
+    w = np.asarray(wavelengths, dtype=np.float32)
+    atmosfera = 1 - 0.7 * _gaussiana(w, 1400, 40) - 0.8 * _gaussiana(w, 1900, 50)
+
+    vegetacao = (0.03 + 0.05 * _gaussiana(w, 550, 35)
+                 + 0.42 * _sigmoide(w, 715, 12) * (1 - 0.6 * _sigmoide(w, 1400, 40))) * atmosfera
+    solo = (0.08 + 0.25 * (w - w.min()) / (w.max() - w.min())) * atmosfera
+    agua = 0.02 + 0.06 * _gaussiana(w, 480, 80)
+    anomalia = (0.5 - 0.25 * _gaussiana(w, 1730, 20) - 0.25 * _gaussiana(w, 2310, 25)) * atmosfera
+
+    return {nome: espectro.astype(np.float32) for nome, espectro in
+            (('vegetacao', vegetacao), ('solo', solo), ('agua', agua), ('anomalia', anomalia))}
+
+
+class CenaSintetica:
+    """
+    Cena EMIT sintética gerada em faixas de linhas, sem montar o cubo inteiro em memória.
+
+    A cobertura mistura vegetação e solo num padrão suave; fracao_agua da área fica em
+    três lagos circulares, fracao_nodata das colunas da borda recebem o valor ignorado
+    e num_anomalias quadrados de 3x3 pixels recebem o espectro anômalo. A mesma
+    semente sempre gera a mesma cena.
+    """
+
+    def __init__(self, linhas, amostras, bandas=285, fracao_nodata=0.02, fracao_agua=0.1, num_anomalias=20,
+                 ruido=0.005, semente=0):
+        self.linhas = linhas
+        self.amostras = amostras
+        self.bandas = bandas
+        self.ruido = ruido
+        self.semente = semente
+        self.wavelengths = np.linspace(381.0, 2493.0, bandas).astype(np.float32)
+        self.espectros = espectros_base(self.wavelengths)
+
+        rng = np.random.default_rng(semente)
+        self.colunas_nodata = int(round(fracao_nodata * amostras))
+
+        num_lagos = 3
+        self.raio_lagos = np.sqrt(fracao_agua * linhas * amostras / (num_lagos * np.pi))
+        self.centros_lagos = np.column_stack([rng.uniform(0, linhas, num_lagos), rng.uniform(0, amostras, num_lagos)])
+
+        self.anomalias = np.column_stack([rng.integers(0, max(1, linhas - 3), num_anomalias),
+                                          rng.integers(self.colunas_nodata, max(self.colunas_nodata + 1, amostras - 3),
+                                                       num_anomalias)])
+
+    @property
+    def bytes_float32(self):
+        return self.linhas * self.amostras * self.bandas * 4
+
+    def faixa(self, inicio, fim):
+        """Reflectância float32 (fim - inicio, amostras, bandas) das linhas [inicio, fim)"""
+        linhas, colunas = np.mgrid[inicio:fim, 0:self.amostras].astype(np.float32)
+
+        fracao_vegetacao = 0.5 + 0.5 * np.sin(colunas / 37) * np.cos(linhas / 53)
+        faixa = (fracao_vegetacao[:, :, None] * self.espectros['vegetacao']
+                 + (1 - fracao_vegetacao[:, :, None]) * self.espectros['solo'])
+
+        rng = np.random.default_rng((self.semente, inicio))
+        faixa += rng.normal(0, self.ruido, faixa.shape).astype(np.float32)
+
+        agua = np.zeros(linhas.shape, dtype=bool)
+        for linha_centro, coluna_centro in self.centros_lagos:
+            agua |= (linhas - linha_centro) ** 2 + (colunas - coluna_centro) ** 2 < self.raio_lagos ** 2
+        faixa[agua] = self.espectros['agua']
+
+        for linha, coluna in self.anomalias:
+            if inicio - 3 < linha < fim:
+                faixa[max(linha, inicio) - inicio:min(linha + 3, fim) - inicio, coluna:coluna + 3] = \
+                    self.espectros['anomalia']
+
+        faixa[:, :self.colunas_nodata] = VALOR_IGNORADO
+        return faixa
+
+    def faixas(self, linhas_por_faixa=64):
+        for inicio in range(0, self.linhas, linhas_por_faixa):
+            fim = min(inicio + linhas_por_faixa, self.linhas)
+            yield inicio, fim, self.faixa(inicio, fim)
+
+
+def gerar_granulo_netcdf(caminho_nc, cena, linhas_por_faixa=64):
+    """
+    Grava a cena como um grânulo NetCDF no formato lido por converter_emit_para_envi:
+    'reflectance' (downtrack, crosstrack, bands) com a coordenada 'wavelengths'.
+    """
+    netCDF4 = dependencias.carregar('netCDF4')
+
+    os.makedirs(os.path.dirname(os.path.abspath(caminho_nc)), exist_ok=True)
+    with netCDF4.Dataset(caminho_nc, 'w') as nc:
+        nc.createDimension('downtrack', cena.linhas)
+        nc.createDimension('crosstrack', cena.amostras)
+        nc.createDimension('bands', cena.bandas)
+
+        wavelengths = nc.createVariable('wavelengths', 'f4', ('bands',))
+        wavelengths[:] = cena.wavelengths
+
+        # Sem _FillValue: o -9999 chega ao conversor como valor, como nos grânulos EMIT
+        reflectancia = nc.createVariable('reflectance', 'f4', ('downtrack', 'crosstrack', 'bands'), fill_value=False)
+        reflectancia.coordinates = 'wavelengths'
+        for inicio, fim, faixa in cena.faixas(linhas_por_faixa):
+            reflectancia[inicio:fim] = faixa
+
+    return caminho_nc
+
+
+def gerar_cubo_envi(caminho_base, cena, linhas_por_faixa=64):
+    """Grava a cena como par ENVI .hdr/.raw em BIP float32 (com o índice de metadados) e retorna o .hdr"""
+    os.makedirs(os.path.dirname(os.path.abspath(caminho_base)), exist_ok=True)
+    caminho_hdr = f"{caminho_base}.hdr"
+    wavelengths_str = ", ".join(map(str, np.round(cena.wavelengths, 2)))
+    with open(caminho_hdr, 'w') as f:
+        f.write("\n".join([
+            "ENVI",
+            "description = {Cena EMIT sintética}",
+            f"samples = {cena.amostras}",
+            f"lines   = {cena.linhas}",
+            f"bands   = {cena.bandas}",
+            "header offset = 0",
+            "file type = ENVI Standard",
+            "data type = 4",
+            "interleave = bip",
+            "byte order = 0",
+            f"data ignore value = {VALOR_IGNORADO}",
+            f"wavelength = {{{wavelengths_str}}}",
+        ]) + "\n")
+
+    raw = np.memmap(f"{caminho_base}.raw", dtype='<f4', mode='w+', shape=(cena.linhas, cena.amostras, cena.bandas))
+    for inicio, fim, faixa in cena.faixas(linhas_por_faixa):
+        raw[inicio:fim] = faixa
+    raw.flush()
+    del raw
+
+    cubo_envi.gravar_indice(caminho_hdr)
+    return caminho_hdr
+
+
+def _executar_etapa(conexao, nome_modulo, nome_funcao, args, kwargs):
+    """Executa uma etapa num processo novo e envia tempo, retorno e memória de pico pela conexão"""
+    try:
+        inicio_importacao = time.perf_counter()
+        modulo = __import__(nome_modulo)
+        funcao = getattr(modulo, nome_funcao)
+        segundos_importacao = time.perf_counter() - inicio_importacao
+
+        # ru_maxrss é o pico do processo inteiro (em KB no Linux): o valor antes da chamada é a base
+        rss_base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        inicio = time.perf_counter()
+        retorno = funcao(*args, **kwargs)
+        segundos = time.perf_counter() - inicio
+        rss_pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        conexao.send({'sucesso': retorno is not False, 'segundos': segundos,
+                      'segundos_importacao': segundos_importacao,
+                      'rss_base_mb': rss_base / 1024, 'rss_pico_mb': rss_pico / 1024})
+    except Exception as e:
+        conexao.send({'sucesso': False, 'erro': str(e)})
+    finally:
+        conexao.close()
+
+
+def medir_etapa(nome, nome_modulo, nome_funcao, args=(), kwargs=None, bytes_processados=0, pixels=0,
+                repeticoes=1):
+    """
+    Mede uma etapa repeticoes vezes, cada uma num processo novo (para que a memória de
+    pico e o custo de importação sejam só dela). Retorna o resultado com a mediana dos tempos.
+    """
+    contexto = multiprocessing.get_context('spawn')
+    execucoes = []
+    for _ in range(repeticoes):
+        receptor, emissor = contexto.Pipe(duplex=False)
+        processo = contexto.Process(target=_executar_etapa,
+                                    args=(emissor, nome_modulo, nome_funcao, tuple(args), kwargs or {}))
+        processo.start()
+        emissor.close()
+        try:
+            execucao = receptor.recv()
+        except EOFError:
+            processo.join()
+            execucao = {'sucesso': False, 'erro': f"Processo encerrado com código {processo.exitcode}"}
+        processo.join()
+        execucoes.append(execucao)
+        if not execucao['sucesso']:
+            break
+
+    resultado = {'etapa': nome, 'sucesso': all(e['sucesso'] for e in execucoes), 'repeticoes': len(execucoes)}
+    if not resultado['sucesso']:
+        resultado['erro'] = next((e['erro'] for e in execucoes if 'erro' in e), 'a etapa retornou False')
+    tempos = [e['segundos'] for e in execucoes if 'segundos' in e]
+    if tempos:
+        segundos = statistics.median(tempos)
+        resultado.update({
+            'segundos': segundos,
+            'segundos_execucoes': tempos,
+            'segundos_importacao': statistics.median(e['segundos_importacao'] for e in execucoes if 'segundos' in e),
+            'mb_por_s': bytes_processados / 1024 ** 2 / segundos,
+            'pixels_por_s': pixels / segundos,
+            'rss_base_mb': max(e['rss_base_mb'] for e in execucoes if 'segundos' in e),
+            'rss_pico_mb': max(e['rss_pico_mb'] for e in execucoes if 'segundos' in e),
+        })
+
+    if resultado['sucesso']:
+        print(f"{nome}: {resultado['segundos']:.2f} s, {resultado['mb_por_s']:.1f} MB/s, "
+              f"{resultado['pixels_por_s']:.0f} px/s, pico {resultado['rss_pico_mb']:.0f} MB")
+    else:
+        print(f"{nome}: FALHOU ({resultado['erro']})")
+    return resultado
+
+
+def executar_benchmark(pasta_trabalho, linhas=512, amostras=512, bandas=285, detectores=('autoencoder', 'zscore'),
+                       opcoes_conversao=None, opcoes_cena=None, repeticoes=1, manter_arquivos=False):
+    """
+    Gera um grânulo de análise e uma cena de treino sintéticos e mede a conversão,
+    a detecção com cada detector (treino incluído), o refinamento e o RGB.
+    Retorna o relatório (dicionário pronto para JSON).
+    """
+    opcoes_conversao = opcoes_conversao or {}
+    opcoes_cena = opcoes_cena or {}
+    pastas = {nome: os.path.join(pasta_trabalho, nome) for nome in ('entrada', 'processados', 'resultados', 'final')}
+    for pasta in pastas.values():
+        os.makedirs(pasta, exist_ok=True)
+
+    try:
+        print(f"Gerando cenas sintéticas de {linhas} x {amostras} x {bandas}...")
+        cena = CenaSintetica(linhas, amostras, bandas, **opcoes_cena)
+        caminho_nc = gerar_granulo_netcdf(os.path.join(pastas['entrada'], 'sintetico.nc'), cena)
+        cena_treino = CenaSintetica(linhas, amostras, bandas, **dict(opcoes_cena, num_anomalias=0, semente=1))
+        caminho_hdr_treino = gerar_cubo_envi(os.path.join(pasta_trabalho, 'treino', 'treino'), cena_treino)
+
+        pixels = linhas * amostras
+        # MB/s em relação ao cubo em float32, a mesma base para todas as etapas
+        medida = {'bytes_processados': cena.bytes_float32, 'pixels': pixels, 'repeticoes': repeticoes}
+        base_saida = os.path.join(pastas['processados'], 'sintetico')
+        caminho_hdr = f"{base_saida}.h5" if opcoes_conversao.get('formato_saida') == 'hdf5' else f"{base_saida}.hdr"
+        caminho_tif = os.path.join(pastas['resultados'], 'sintetico_anomalias.tif')
+
+        resultados = [medir_etapa('conversao', 'converter', 'converter_emit_para_envi',
+                                  (caminho_nc, base_saida), opcoes_conversao, **medida)]
+
+        for detector in detectores:
+            if detector == 'autoencoder' and not dependencias.disponivel('tensorflow'):
+                print("deteccao_autoencoder: ignorada (TensorFlow não instalado)")
+                continue
+            resultados.append(medir_etapa(
+                f'deteccao_{detector}', 'deeplearn', 'treinar_e_detectar_anomalias',
+                (caminho_hdr_treino, caminho_hdr, caminho_tif,
+                 os.path.join(pastas['resultados'], 'sintetico_anomalias.png')),
+                {'modo_tiles': True, 'detector': detector}, **medida))
+
+        caminho_refinado = os.path.join(pastas['final'], 'sintetico_refinado.png')
+        resultados.append(medir_etapa('refinamento', 'refinar', 'refinar_mapa_anomalia',
+                                      (caminho_hdr, caminho_tif, caminho_refinado), **medida))
+        resultados.append(medir_etapa('rgb', 'visualizar', 'converter_raw_para_rgb',
+                                      (caminho_hdr, os.path.join(pastas['final'], 'sintetico_rgb.png')), **medida))
+    finally:
+        if not manter_arquivos:
+            shutil.rmtree(pasta_trabalho, ignore_errors=True)
+
+    versoes = {}
+    for modulo in ('numpy', 'tensorflow', 'sklearn', 'spectral', 'rasterio', 'xarray', 'netCDF4', 'h5py'):
+        if dependencias.disponivel(modulo):
+            versoes[modulo] = getattr(dependencias.carregar(modulo), '__version__', None)
+
+    return {
+        'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'maquina': {'plataforma': platform.platform(), 'processador': platform.machine(), 'cpus': os.cpu_count(),
+                    'python': platform.python_version()},
+        'versoes': versoes,
+        'configuracao': {'linhas': linhas, 'amostras': amostras, 'bandas': bandas, 'detectores': list(detectores),
+                         'opcoes_conversao': opcoes_conversao, 'opcoes_cena': opcoes_cena, 'repeticoes': repeticoes},
+        'resultados': resultados,
+    }
+
+
+def comparar_relatorios(relatorio, caminho_anterior):
+    """Imprime a razão entre os tempos de cada etapa e os de um relatório anterior (>1 = mais lento agora)"""
+    with open(caminho_anterior) as f:
+        anteriores = {r['etapa']: r for r in json.load(f)['resultados'] if r.get('sucesso')}
+
+    print(f"\n=== COMPARAÇÃO COM {os.path.basename(caminho_anterior)} ===")
+    for resultado in relatorio['resultados']:
+        anterior = anteriores.get(resultado['etapa'])
+        if anterior and resultado.get('sucesso'):
+            razao = resultado['segundos'] / anterior['segundos']
+            print(f"{resultado['etapa']}: {anterior['segundos']:.2f} s -> {resultado['segundos']:.2f} s "
+                  f"({razao:.2f}x), pico {anterior['rss_pico_mb']:.0f} -> {resultado['rss_pico_mb']:.0f} MB")
+
+
+# --- EXECUÇÃO PRINCIPAL ---
+if __name__ == '__main__':
+    # CONFIGURAÇÕES
+    PASTA_RELATORIOS = 'benchmarks'  # Um JSON por execução, para comparar ao longo do tempo
+    PASTA_TRABALHO = os.path.join(PASTA_RELATORIOS, 'trabalho')  # Cenas e produtos gerados (apagados no fim)
+    LINHAS = 512  # downtrack (um grânulo EMIT completo tem ~1280)
+    AMOSTRAS = 512  # crosstrack (~1242 no EMIT)
+    BANDAS = 285
+    DETECTORES = ('autoencoder', 'zscore')  # 'rx' também pode ser medido
+    REPETICOES = 1  # Execuções por etapa; o relatório traz a mediana
+    COMPARAR_COM = None  # Caminho de um relatório anterior, ex: 'benchmarks/benchmark_20250101_120000.json'
+    MANTER_ARQUIVOS = False
+
+    OPCOES_CONVERSAO = {
+        'modo_streaming': True,
+        'interleave': 'bip',
+        'tipo_dado': 'float32',
+        'formato_saida': 'envi',
+    }
+    OPCOES_CENA = {
+        'fracao_nodata': 0.02,
+        'fracao_agua': 0.1,
+        'num_anomalias': 20,
+    }
+
+    print("=== BENCHMARK DO PIPELINE ===")
+    dependencias.relatorio_importacoes("Tempo de inicialização")
+    os.makedirs(PASTA_RELATORIOS, exist_ok=True)
+
+    try:
+        relatorio = executar_benchmark(PASTA_TRABALHO, LINHAS, AMOSTRAS, BANDAS, DETECTORES, OPCOES_CONVERSAO,
+                                       OPCOES_CENA, REPETICOES, MANTER_ARQUIVOS)
+        caminho_relatorio = os.path.join(PASTA_RELATORIOS, f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        with open(caminho_relatorio, 'w') as f:
+            json.dump(relatorio, f, indent=2)
+        print(f"\nRelatório salvo em: '{caminho_relatorio}'")
+
+        if COMPARAR_COM:
+            comparar_relatorios(relatorio, COMPARAR_COM)
+    except Exception as e:
+        print(f"Erro no benchmark: {e}")
@@ -0,0 +1,173 @@
+import os
+import json
+
+import numpy as np
+
+import cubo_envi
+
+# Arquivo do índice, gravado dentro da pasta de treino
+ARQUIVO_INDICE = 'biblioteca_treino.json'
+
+# Pixels válidos usados no resumo de cada cena (lidos de linhas espaçadas, sem carregar o cubo).
+# O resumo de treino é feito uma vez; o da cena analisada, a cada seleção, com uma amostra menor.
+PIXELS_AMOSTRA = 10000
+PIXELS_AMOSTRA_ANALISE = 2000
+# Percentis por banda guardados no resumo
+PERCENTIS_RESUMO = (5, 25, 50, 75, 95)
+# Componentes principais da assinatura PCA
+COMPONENTES_PCA = 3
+# Peso da diferença entre os subespaços PCA na distância (a parte espectral é relativa, ~0-1)
+PESO_PCA = 0.5
+
+
+def _pixels_validos(pixels, nodata_val=-9999):
+    # Mesmo critério de deeplearn.mascara_pixels_validos
+    return pixels[(pixels != nodata_val).all(axis=1) & (pixels.sum(axis=1) > 0)]
+
+
+def amostrar_cubo(caminho, pixels_amostra=PIXELS_AMOSTRA, metadados=None):
+    """
+    Amostra de até pixels_amostra pixels válidos do cubo, tirada de linhas igualmente
+    espaçadas (ver cubo_envi.ler_linhas): só essas linhas são lidas do disco.
+    """
+    if metadados is None:
+        metadados = cubo_envi.ler_metadados(caminho)
+    linhas, amostras = metadados['linhas'], metadados['amostras']
+
+    # O dobro do necessário, para compensar os pixels inválidos (bordas, nodata)
+    num_linhas = min(linhas, max(1, -(-2 * pixels_amostra // amostras)))
+    indices = np.linspace(0, linhas - 1, num_linhas).round().astype(int)
+    pixels = _pixels_validos(cubo_envi.ler_linhas(caminho, indices, metadados).reshape((-1, metadados['bandas'])))
+
+    if len(pixels) > pixels_amostra:
+        pixels = pixels[np.linspace(0, len(pixels) - 1, pixels_amostra).round().astype(int)]
+    return pixels
+
+
+def resumir_pixels(pixels):
+    """
+    Resumo espectral compacto de uma cena: espectro médio, percentis por banda e os
+    COMPONENTES_PCA primeiros componentes principais (direções e variâncias).
+    """
+    pixels = np.asarray(pixels, dtype=np.float32)
+    if len(pixels) < 2:
+        raise ValueError("Pixels válidos insuficientes para resumir a cena")
+
+    # Autovetores da covariância (bandas x bandas): bem mais rápido que a SVD da amostra inteira
+    media = pixels.mean(axis=0, dtype=np.float64)
+    autovalores, autovetores = np.linalg.eigh(np.atleast_2d(np.cov(pixels, rowvar=False)))
+    k = min(COMPONENTES_PCA, len(autovalores))
+    return {
+        'media': media,
+        'percentis': np.percentile(pixels, PERCENTIS_RESUMO, axis=0).astype(np.float64),
+        'componentes': autovetores[:, ::-1][:, :k].T,
+        'variancias': autovalores[::-1][:k],
+    }
+
+
+def resumir_cubo(caminho, pixels_amostra=PIXELS_AMOSTRA_ANALISE):
+    """Resumo espectral de um cubo a partir de uma amostra de linhas (ver amostrar_cubo)"""
+    return resumir_pixels(amostrar_cubo(caminho, pixels_amostra))
+
+
+def distancias(resumo, resumos):
+    """
+    Distância de um resumo a uma lista de resumos (mesmo número de bandas): erro
+    quadrático médio entre espectros médios e percentis, relativo à reflectância média
+    da cena, mais PESO_PCA vezes 1 - (similaridade entre os subespaços PCA, de 0 a 1).
+    """
+    def espectral(r):
+        return np.vstack([r['media'][None, :], r['percentis']])
+
+    alvo = espectral(resumo)
+    candidatos = np.stack([espectral(r) for r in resumos])
+    escala = max(float(np.sqrt(np.mean(alvo ** 2))), 1e-12)
+    distancia_espectral = np.sqrt(np.mean((candidatos - alvo) ** 2, axis=(1, 2))) / escala
+
+    # Soma dos cossenos ao quadrado entre os componentes: k quando os subespaços coincidem
+    k = len(resumo['componentes'])
+    similaridade_pca = np.array([np.sum((resumo['componentes'] @ r['componentes'].T) ** 2) / k for r in resumos])
+    return distancia_espectral + PESO_PCA * (1 - similaridade_pca)
+
+
+class BibliotecaTreino:
+    """
+    Índice dos cubos de treino de uma pasta com o resumo espectral de cada um (ver
+    resumir_pixels), gravado em <pasta>/biblioteca_treino.json.
+
+    Cada resumo é calculado uma única vez por arquivo, a partir de uma amostra de
+    linhas do cubo; a entrada é refeita quando o tamanho ou o mtime do cubo mudam e
+    removida quando ele sai da pasta. Para escolher o treino de uma cena basta
+    comparar o resumo dela com os do índice, sem abrir nenhum cubo de treino.
+    """
+
+    def __init__(self, pasta, pixels_amostra=PIXELS_AMOSTRA):
+        self.pasta = pasta
+        self.pixels_amostra = pixels_amostra
+        self.caminho_indice = os.path.join(pasta, ARQUIVO_INDICE)
+        self.entradas = {}
+
+    def _carregar(self):
+        try:
+            with open(self.caminho_indice) as f:
+                indice = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        entradas = {}
+        for nome, entrada in indice.items():
+            resumo = {chave: np.asarray(valor, dtype=np.float64) for chave, valor in entrada['resumo'].items()}
+            entradas[nome] = dict(entrada, resumo=resumo)
+        return entradas
+
+    def _salvar(self):
+        indice = {nome: dict(entrada, resumo={chave: np.round(valor, 6).tolist()
+                                              for chave, valor in entrada['resumo'].items()})
+                  for nome, entrada in self.entradas.items()}
+        caminho_tmp = f"{self.caminho_indice}.tmp{os.getpid()}"
+        with open(caminho_tmp, 'w') as f:
+            json.dump(indice, f)
+        os.replace(caminho_tmp, self.caminho_indice)
+
+    def atualizar(self):
+        """Resume os cubos novos ou alterados da pasta e descarta os que saíram; retorna as entradas"""
+        self.entradas = self._carregar()
+        alterado = False
+
+        cubos = {os.path.basename(caminho): caminho for caminho in cubo_envi.listar_cubos(self.pasta)}
+        for nome in set(self.entradas) - set(cubos):
+            del self.entradas[nome]
+            alterado = True
+
+        for nome, caminho in sorted(cubos.items()):
+            identidade = cubo_envi.identidade_cubo(caminho)
+            if nome in self.entradas and self.entradas[nome]['identidade'] == identidade:
+                continue
+            try:
+                print(f"Resumindo cubo de treino para a biblioteca: {nome}")
+                metadados = cubo_envi.ler_metadados(caminho)
+                resumo = resumir_pixels(amostrar_cubo(caminho, self.pixels_amostra, metadados))
+            except Exception as e:
+                print(f"Aviso: não foi possível resumir {nome}: {e}")
+                self.entradas.pop(nome, None)
+                continue
+            self.entradas[nome] = {'identidade': identidade, 'bandas': metadados['bandas'], 'resumo': resumo}
+            alterado = True
+
+        if alterado:
+            self._salvar()
+        return self.entradas
+
+    def mais_proximos(self, resumo, quantidade=1):
+        """
+        Os cubos de treino mais parecidos com o resumo dado, como lista de (caminho,
+        distância) em ordem crescente de distância. Só entram cubos com o mesmo número de bandas.
+        """
+        nomes = [nome for nome, entrada in sorted(self.entradas.items())
+                 if entrada['bandas'] == len(resumo['media'])]
+        if not nomes:
+            return []
+
+        distancia = distancias(resumo, [self.entradas[nome]['resumo'] for nome in nomes])
+        ordem = np.argsort(distancia)[:quantidade]
+        return [(os.path.join(self.pasta, nomes[i]), float(distancia[i])) for i in ordem]
@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+
+import cubo_envi
+
+# Bytes do início e do fim de cada arquivo do cubo que entram no hash da chave
+BYTES_HASH_PARCIAL = 1 << 20
+
+
+def _hash_parcial(caminho, tamanho):
+    """Hash do primeiro e do último BYTES_HASH_PARCIAL bytes do arquivo"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(caminho, 'rb') as f:
+        h.update(f.read(BYTES_HASH_PARCIAL))
+        if tamanho > BYTES_HASH_PARCIAL:
+            f.seek(max(BYTES_HASH_PARCIAL, tamanho - BYTES_HASH_PARCIAL))
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class CacheMascaras:
+    """
+    Cache em disco das máscaras de água calculadas pelo refinamento.
+
+    A chave combina a identidade do conteúdo do cubo de origem (tamanho, mtime e um
+    hash do início e do fim do .hdr e do .raw, ou do .h5), as bandas usadas e o limiar
+    do NDWI. A pasta não entra na chave: o cubo movido de arquivoRAW para processados
+    depois da detecção continua encontrando a sua máscara. Cada entrada é um
+    .npz com a máscara compactada em bits (np.packbits) e, opcionalmente, o NDWI em
+    float16. Quando o total passa de max_mb, as entradas usadas há mais tempo são
+    removidas. Com a máscara em cache, refinar de novo uma cena (ex: com outro
+    contraste) não lê nenhuma banda do cubo.
+    """
+
+    def __init__(self, pasta, max_mb=256, guardar_ndwi=False):
+        self.pasta = pasta
+        self.max_bytes = max_mb * 1024 * 1024
+        self.guardar_ndwi = guardar_ndwi
+        os.makedirs(pasta, exist_ok=True)
+
+    def chave(self, caminho_cubo, limiar, indices_bandas):
+        """Calcula a chave de uma máscara a partir da identidade do cubo, do limiar e das bandas"""
+        identidade = []
+        for arquivo in sorted({caminho_cubo, cubo_envi.arquivo_dados(caminho_cubo)}):
+            # O mtime é mantido por shutil.move (rename ou cópia com copy2)
+            stat = os.stat(arquivo)
+            identidade.append([os.path.splitext(arquivo)[1], stat.st_size, stat.st_mtime_ns,
+                               _hash_parcial(arquivo, stat.st_size)])
+
+        descricao = {'origem': identidade, 'limiar': float(limiar), 'bandas': [int(i) for i in indices_bandas]}
+        return hashlib.sha256(json.dumps(descricao, sort_keys=True).encode()).hexdigest()[:32]
+
+    def _caminho(self, chave):
+        return os.path.join(self.pasta, f"{chave}.npz")
+
+    def carregar(self, chave):
+        """Retorna (mascara_agua, ndwi ou None), ou None se a entrada não existir"""
+        caminho = self._caminho(chave)
+        if not os.path.exists(caminho):
+            return None
+
+        try:
+            with np.load(caminho) as dados:
+                forma = tuple(int(n) for n in dados['forma'])
+                mascara = np.unpackbits(dados['mascara'], count=forma[0] * forma[1]).astype(bool).reshape(forma)
+                ndwi = dados['ndwi'] if 'ndwi' in dados.files else None
+        except Exception as e:
+            print(f"Aviso: entrada do cache de máscaras inválida ({chave}), será refeita: {e}")
+            os.remove(caminho)
+            return None
+
+        # O mtime marca o último uso, para a remoção das entradas antigas
+        os.utime(caminho)
+        return mascara, ndwi
+
+    def salvar(self, chave, mascara_agua, ndwi=None):
+        """Grava a máscara (e o NDWI em float16, se configurado) de forma atômica"""
+        dados = {'forma': np.array(mascara_agua.shape), 'mascara': np.packbits(mascara_agua, axis=None)}
+        if self.guardar_ndwi and ndwi is not None:
+            dados['ndwi'] = ndwi.astype(np.float16)
+
+        caminho = self._caminho(chave)
+        caminho_tmp = f"{caminho}.tmp{os.getpid()}.npz"
+        try:
+            np.savez(caminho_tmp, **dados)
+            os.replace(caminho_tmp, caminho)
+        finally:
+            if os.path.exists(caminho_tmp):
+                os.remove(caminho_tmp)
+
+        self._remover_antigas()
+
+    def _remover_antigas(self):
+        entradas = []
+        for nome in os.listdir(self.pasta):
+            if nome.endswith('.npz') and '.tmp' not in nome:
+                caminho = os.path.join(self.pasta, nome)
+                stat = os.stat(caminho)
+                entradas.append((stat.st_mtime, stat.st_size, caminho))
+
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        for _, tamanho, caminho in sorted(entradas):
+            if total <= self.max_bytes:
+                break
+            print(f"Removendo máscara antiga do cache: {os.path.basename(caminho)}")
+            os.remove(caminho)
+            total -= tamanho
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from registro_processamento import hash_conteudo
+import cubo_envi
+import dependencias
+from detectores import obter_detector
+
+
+class CacheModelos:
+    """
+    Cache persistente de modelos treinados (scaler + detector).
+
+    A chave combina o hash do conteúdo do arquivo de treino (cabeçalho e dados) com a
+    descrição do treinamento (método, arquitetura, épocas...). Cada entrada é uma pasta
+    com os parâmetros do MinMaxScaler, os parâmetros/pesos do detector e um
+    metadados.json cujo mtime marca o último uso. Acima de max_entradas, as entradas
+    usadas há mais tempo são removidas (LRU). As últimas entradas usadas também ficam
+    em memória, para que várias cenas seguidas não recarreguem o modelo do disco.
+    """
+
+    def __init__(self, pasta, max_entradas=5, max_em_memoria=2):
+        self.pasta = pasta
+        self.max_entradas = max_entradas
+        self.max_em_memoria = max_em_memoria
+        self.em_memoria = OrderedDict()
+        # (caminho, tamanho, mtime) -> hash, para não reler o arquivo de treino a cada cena
+        self.hashes = {}
+        os.makedirs(pasta, exist_ok=True)
+
+    def _hash_arquivo(self, caminho):
+        stat = os.stat(caminho)
+        identidade = (os.path.abspath(caminho), stat.st_size, stat.st_mtime_ns)
+        if identidade not in self.hashes:
+            self.hashes[identidade] = hash_conteudo(caminho)
+        return self.hashes[identidade]
+
+    def chave(self, caminho_hdr_treino, descricao):
+        """
+        Calcula a chave do cache para um arquivo de treino (ou uma lista deles) e uma
+        descrição de treinamento. A ordem dos arquivos faz parte da chave, pois muda a amostra.
+        """
+        if isinstance(caminho_hdr_treino, str):
+            caminho_hdr_treino = [caminho_hdr_treino]
+
+        h = hashlib.sha256()
+        for caminho_treino in caminho_hdr_treino:
+            for caminho in sorted({caminho_treino, cubo_envi.arquivo_dados(caminho_treino)}):
+                h.update(self._hash_arquivo(caminho).encode())
+        h.update(json.dumps(descricao, sort_keys=True).encode())
+        return h.hexdigest()[:32]
+
+    def carregar(self, chave):
+        """Retorna (scaler, modelo) da entrada, ou None se ela não existir"""
+        if chave in self.em_memoria:
+            self.em_memoria.move_to_end(chave)
+            self._marcar_uso(chave)
+            return self.em_memoria[chave]
+
+        pasta_entrada = os.path.join(self.pasta, chave)
+        caminho_meta = os.path.join(pasta_entrada, 'metadados.json')
+        if not os.path.exists(caminho_meta):
+            return None
+
+        try:
+            with open(caminho_meta) as f:
+                meta = json.load(f)
+            scaler = carregar_scaler(os.path.join(pasta_entrada, 'scaler.npz'))
+            modelo = carregar_modelo(pasta_entrada, meta['metodo'])
+        except Exception as e:
+            print(f"Aviso: entrada do cache de modelos inválida ({chave}), será refeita: {e}")
+            shutil.rmtree(pasta_entrada, ignore_errors=True)
+            return None
+
+        self._marcar_uso(chave)
+        self._guardar_em_memoria(chave, (scaler, modelo))
+        return scaler, modelo
+
+    def salvar(self, chave, scaler, modelo, descricao):
+        """Grava uma entrada de forma atômica (pasta temporária + rename) e aplica o LRU"""
+        pasta_entrada = os.path.join(self.pasta, chave)
+        pasta_tmp = f"{pasta_entrada}.tmp{os.getpid()}"
+        shutil.rmtree(pasta_tmp, ignore_errors=True)
+        os.makedirs(pasta_tmp)
+
+        try:
+            salvar_scaler(scaler, os.path.join(pasta_tmp, 'scaler.npz'))
+            salvar_modelo(modelo, pasta_tmp)
+            with open(os.path.join(pasta_tmp, 'metadados.json'), 'w') as f:
+                json.dump({'metodo': modelo['metodo'], 'descricao': descricao, 'criado_em': time.time()}, f)
+
+            shutil.rmtree(pasta_entrada, ignore_errors=True)
+            os.replace(pasta_tmp, pasta_entrada)
+        finally:
+            shutil.rmtree(pasta_tmp, ignore_errors=True)
+
+        self._guardar_em_memoria(chave, (scaler, modelo))
+        self._remover_antigas()
+
+    def _marcar_uso(self, chave):
+        try:
+            os.utime(os.path.join(self.pasta, chave, 'metadados.json'))
+        except FileNotFoundError:
+            pass
+
+    def _guardar_em_memoria(self, chave, entrada):
+        self.em_memoria[chave] = entrada
+        self.em_memoria.move_to_end(chave)
+        while len(self.em_memoria) > self.max_em_memoria:
+            self.em_memoria.popitem(last=False)
+
+    def _remover_antigas(self):
+        entradas = []
+        for nome in os.listdir(self.pasta):
+            caminho_meta = os.path.join(self.pasta, nome, 'metadados.json')
+            if os.path.exists(caminho_meta):
+                entradas.append((os.path.getmtime(caminho_meta), nome))
+
+        entradas.sort()
+        for _, nome in entradas[:max(0, len(entradas) - self.max_entradas)]:
+            print(f"Removendo modelo antigo do cache: {nome}")
+            shutil.rmtree(os.path.join(self.pasta, nome), ignore_errors=True)
+            self.em_memoria.pop(nome, None)
+
+
+# Atributos aprendidos pelo MinMaxScaler no fit
+ATRIBUTOS_SCALER = ('min_', 'scale_', 'data_min_', 'data_max_', 'data_range_', 'n_samples_seen_')
+
+
+def salvar_scaler(scaler, caminho):
+    np.savez(caminho, feature_range=np.asarray(scaler.feature_range),
+             **{nome: np.asarray(getattr(scaler, nome)) for nome in ATRIBUTOS_SCALER})
+
+
+def carregar_scaler(caminho):
+    MinMaxScaler = dependencias.carregar('sklearn.preprocessing').MinMaxScaler
+
+    with np.load(caminho) as dados:
+        scaler = MinMaxScaler(feature_range=tuple(dados['feature_range'].tolist()))
+        for nome in ATRIBUTOS_SCALER:
+            setattr(scaler, nome, dados[nome])
+    scaler.n_samples_seen_ = int(scaler.n_samples_seen_)
+    scaler.n_features_in_ = len(scaler.min_)
+    return scaler
+
+
+def salvar_modelo(modelo, pasta):
+    obter_detector(modelo['metodo']).salvar(modelo, pasta)
+
+
+def carregar_modelo(pasta, metodo):
+    return obter_detector(metodo).carregar(pasta)
@@ -1,4 +1,3 @@
-import xarray as xr
 import numpy as np
 import os
 import time
@@ -6,13 +5,49 @@ import glob
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import threading
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from registro_processamento import RegistroProcessamento, ESTAGIO_CONVERSAO, hash_conteudo
+import dependencias
+import cubo_envi
+import metricas
 
 
 class EMITFileHandler(FileSystemEventHandler):
-    def __init__(self, input_folder, output_folder, processed_files):
+    """
+    Recebe os eventos do watchdog e apenas enfileira os caminhos .nc.
+
+    Uma thread despachante verifica se cada arquivo terminou de ser escrito
+    (tamanho/mtime estáveis e, quando possível, HDF5 válido) e só então envia a
+    conversão para um pool de processos. Assim a thread do observer nunca bloqueia
+    e várias chegadas simultâneas são convertidas em paralelo.
+
+    As métricas do monitor (eventos, arquivos aguardando e em conversão, espera até o
+    arquivo ficar estável e duração de cada conversão) são registradas no processo
+    principal; as fases de cada conversão são registradas pelo próprio worker.
+    """
+
+    def __init__(self, input_folder, output_folder, processed_files, opcoes_conversao=None,
+                 num_workers=1, limite_memoria_mb=None, intervalo_estabilidade=2.0,
+                 tempo_maximo_espera=600, registro=None):
         self.input_folder = input_folder
         self.output_folder = output_folder
         self.processed_files = processed_files
+        self.registro = registro
+        self.opcoes_conversao = opcoes_conversao or {}
+        self.num_workers = num_workers
+        self.limite_memoria_mb = limite_memoria_mb
+        self.intervalo_estabilidade = intervalo_estabilidade
+        self.tempo_maximo_espera = tempo_maximo_espera
+
+        self.fila = queue.Queue()
+        self.lock = threading.Lock()
+        self.em_andamento = set()
+        self.executor = None
+        self.thread_despachante = None
+        self.parar_evento = threading.Event()
 
     def on_created(self, event):
         if event.is_directory:
@@ -20,57 +55,220 @@ class EMITFileHandler(FileSystemEventHandler):
 
         if event.src_path.endswith('.nc'):
             print(f"Novo arquivo detectado: {event.src_path}")
-            time.sleep(2)  # Espera um pouco para garantir que o arquivo esteja completamente escrito
-            self.process_file(event.src_path)
+            metricas.incrementar('monitor_eventos_total', pasta=os.path.basename(self.input_folder))
+            self.fila.put(event.src_path)
 
     def on_moved(self, event):
+        if event.is_directory:
+            return
+
         if event.dest_path.endswith('.nc'):
             print(f"Arquivo movido para a pasta: {event.dest_path}")
-            time.sleep(2)
-            self.process_file(event.dest_path)
-
-    def process_file(self, file_path):
-        if file_path in self.processed_files:
+            metricas.incrementar('monitor_eventos_total', pasta=os.path.basename(self.input_folder))
+            self.fila.put(event.dest_path)
+
+    def iniciar(self):
+        """Cria o pool de conversão e inicia a thread despachante"""
+        self.executor = criar_pool_conversao(self.num_workers, self.limite_memoria_mb)
+        self.thread_despachante = threading.Thread(target=self._despachar, daemon=True)
+        self.thread_despachante.start()
+
+    def parar(self):
+        """Para o despachante e aguarda as conversões em andamento"""
+        self.parar_evento.set()
+        if self.thread_despachante:
+            self.thread_despachante.join()
+        if self.executor:
+            self.executor.shutdown(wait=True)
+
+    def _despachar(self):
+        """Loop da thread despachante: acompanha arquivos pendentes até ficarem estáveis"""
+        # caminho -> (tamanho, mtime, instante da última mudança, instante da detecção)
+        aguardando = {}
+
+        while not self.parar_evento.is_set():
+            # Drena a fila de eventos antes de verificar a estabilidade dos pendentes
+            try:
+                caminho = self.fila.get(timeout=0.5)
+                while True:
+                    agora = time.time()
+                    aguardando.setdefault(caminho, (None, None, agora, agora))
+                    caminho = self.fila.get_nowait()
+            except queue.Empty:
+                pass
+
+            agora = time.time()
+            for caminho, (tamanho, mtime, ultima_mudanca, detectado) in list(aguardando.items()):
+                try:
+                    stat = os.stat(caminho)
+                except FileNotFoundError:
+                    # Arquivo removido ou renomeado antes de terminar: o evento de move será enfileirado
+                    del aguardando[caminho]
+                    continue
+
+                if (stat.st_size, stat.st_mtime) != (tamanho, mtime):
+                    aguardando[caminho] = (stat.st_size, stat.st_mtime, agora, detectado)
+                    continue
+
+                estavel = stat.st_size > 0 and agora - ultima_mudanca >= self.intervalo_estabilidade
+                expirado = agora - detectado >= self.tempo_maximo_espera
+
+                if (estavel and arquivo_hdf5_completo(caminho)) or expirado:
+                    if expirado and not estavel:
+                        print(f"Aviso: tempo de espera esgotado, convertendo mesmo assim: {caminho}")
+                    del aguardando[caminho]
+                    metricas.registrar_fase('monitor', 'espera_estabilidade', agora - detectado,
+                                            cena=os.path.basename(caminho))
+                    self._enviar_para_conversao(caminho)
+
+            metricas.definir('monitor_pendentes', len(aguardando), pasta=os.path.basename(self.input_folder))
+            with self.lock:
+                metricas.definir('conversoes_em_andamento', len(self.em_andamento))
+
+    def _enviar_para_conversao(self, file_path):
+        with self.lock:
+            if file_path in self.processed_files:
+                print(f"Arquivo {file_path} já foi processado anteriormente.")
+                return
+            if file_path in self.em_andamento:
+                return
+            self.em_andamento.add(file_path)
+
+        if self.registro and self.registro.ja_processado(ESTAGIO_CONVERSAO, file_path):
             print(f"Arquivo {file_path} já foi processado anteriormente.")
+            with self.lock:
+                self.em_andamento.discard(file_path)
+                self.processed_files.add(file_path)
             return
 
-        try:
-            # Gera nome do arquivo de saída baseado no nome do arquivo de entrada
-            base_name = os.path.splitext(os.path.basename(file_path))[0]
-            output_base = os.path.join(self.output_folder, base_name)
-
-            converter_emit_para_envi(file_path, output_base)
-            self.processed_files.add(file_path)
+        print(f"Arquivo completo, enviando para conversão: {file_path}")
+        if self.registro:
+            self.registro.marcar_em_andamento(ESTAGIO_CONVERSAO, file_path)
+        enviado = time.perf_counter()
+        futuro = self.executor.submit(_converter_arquivo, file_path, self.output_folder, self.opcoes_conversao,
+                                      self.registro is not None)
+        futuro.add_done_callback(lambda f: self._conversao_concluida(file_path, f, enviado))
 
+    def _conversao_concluida(self, file_path, futuro, enviado):
+        try:
+            sucesso, hash_arquivo = futuro.result()
         except Exception as e:
             print(f"Erro ao processar arquivo {file_path}: {e}")
+            sucesso, hash_arquivo = False, None
+
+        metricas.registrar_fase('monitor', 'conversao', time.perf_counter() - enviado, sucesso,
+                                cena=os.path.basename(file_path))
+
+        _registrar_conversao(self.registro, file_path, self.output_folder, sucesso, self.opcoes_conversao,
+                             hash_arquivo)
+        with self.lock:
+            self.em_andamento.discard(file_path)
+            if sucesso:
+                self.processed_files.add(file_path)
+
+
+def arquivo_hdf5_completo(caminho):
+    """
+    Verifica se um NetCDF4/HDF5 pode ser aberto. Arquivos ainda em escrita costumam
+    falhar por estarem truncados. Sem h5py, ou para NetCDF clássico, retorna True.
+    """
+    try:
+        h5py = dependencias.carregar('h5py')
+    except ImportError:
+        return True
+
+    try:
+        if not h5py.is_hdf5(caminho):
+            return True
+        with h5py.File(caminho, 'r'):
+            return True
+    except Exception:
+        return False
+
 
+# Tipos de armazenamento suportados: tipo numpy (little-endian) e código ENVI
+# float16 não tem código no formato ENVI e só pode ser usado no cubo HDF5
+TIPOS_ARMAZENAMENTO = {
+    'float32': ('<f4', 4),
+    'int16': ('<i2', 2),
+    'float16': ('<f2', None),
+}
+VALOR_IGNORADO = -9999
 
-def converter_emit_para_envi(caminho_arquivo_nc, caminho_saida_base):
+
+def codificar_reflectancia(dados, tipo_dado='float32', fator_escala=10000):
+    """
+    Converte reflectância float para o tipo de armazenamento. Em 'int16' os valores
+    são multiplicados por fator_escala e arredondados; NaN e o valor ignorado
+    (-9999) são gravados como -9999.
+    """
+    dtype_saida = TIPOS_ARMAZENAMENTO[tipo_dado][0]
+    if tipo_dado != 'int16':
+        return dados.astype(dtype_saida, copy=False)
+
+    invalido = np.isnan(dados) | (dados == VALOR_IGNORADO)
+    info = np.iinfo(np.int16)
+    escalado = np.clip(np.rint(dados * fator_escala), info.min, info.max)
+    escalado[invalido] = VALOR_IGNORADO
+    return escalado.astype(dtype_saida)
+
+
+def converter_emit_para_envi(caminho_arquivo_nc, caminho_saida_base, modo_streaming=False,
+                             orcamento_memoria_mb=256, interleave='bsq', tipo_dado='float32',
+                             fator_escala=10000, formato_saida='envi', opcoes_hdf5=None):
     """
     Versão CORRIGIDA: Converte um arquivo NetCDF EMIT L2A para o formato ENVI,
     identificando as dimensões corretamente pelos seus nomes.
+
+    Retorna True se a conversão foi concluída e False em caso de erro.
+
+    Com modo_streaming=True o cubo não é carregado inteiro na memória: a variável
+    'reflectance' é lida em blocos de bandas e escrita diretamente num .raw
+    pré-alocado via memmap. O pico de memória fica limitado por orcamento_memoria_mb.
+
+    interleave define a organização do .raw: 'bsq' (bandas, linhas, amostras),
+    'bil' (linhas, bandas, amostras) ou 'bip' (linhas, amostras, bandas). Em BIP o
+    espectro de cada pixel fica contíguo no disco, que é a ordem usada na detecção.
+
+    tipo_dado='int16' grava a reflectância escalada por fator_escala (metade do
+    tamanho de float32), registrando 'reflectance scale factor' no cabeçalho; o
+    valor ignorado -9999 é mantido. Os leitores em cubo_envi decodificam para float32.
+
+    formato_saida escolhe entre o par ENVI .hdr/.raw ('envi'), um cubo HDF5 em blocos
+    comprimidos ('hdf5', ver escrever_cubo_hdf5) ou ambos ('ambos'). No HDF5 também
+    é aceito tipo_dado='float16'; opcoes_hdf5 repassa tamanho dos blocos e compressão.
+
+    Os dados são gravados com um nome temporário na pasta de saída e só então renomeados
+    (os.replace); o .hdr é gravado por último. Assim os monitores das etapas seguintes,
+    que esperam pelo par .hdr/.raw ou pelo .h5, nunca veem um cubo pela metade.
     """
     print(f"Iniciando a conversão (versão corrigida) de: '{caminho_arquivo_nc}'...")
 
     dataset = None
+    temporarios = []
+    fases = metricas.Fases('conversao', cena=os.path.basename(caminho_arquivo_nc))
     try:
-        # 1. Abrir o arquivo NetCDF com xarray
-        dataset = xr.open_dataset(caminho_arquivo_nc)
+        # 1. Abrir o arquivo NetCDF com xarray (importado só aqui: os workers do pool não o carregam à toa)
+        xr = dependencias.carregar('xarray')
+        fases.iniciar('abrir')
+        # A abertura é preguiçosa; cache=False evita que os blocos lidos fiquem retidos no dataset
+        dataset = xr.open_dataset(caminho_arquivo_nc, cache=not modo_streaming)
 
         if 'reflectance' not in dataset.variables:
             print("Erro: A variável 'reflectance' não foi encontrada.")
-            return
+            return False
 
         imagem_data = dataset['reflectance']
 
         # 2. Extrair metadados identificando as dimensões pelos nomes
         # Esta é a correção principal para evitar a troca de eixos.
+        fases.iniciar('metadados')
         try:
             # A ordem esperada é (bands, downtrack, crosstrack)
             bandas = imagem_data.sizes['bands']
             linhas = imagem_data.sizes['downtrack']
             amostras = imagem_data.sizes['crosstrack']
+            dim_bandas, dim_linhas, dim_amostras = 'bands', 'downtrack', 'crosstrack'
         except KeyError:
             # Plano B se os nomes forem diferentes (ex: x, y, band)
             print("Aviso: Nomes de dimensão padrão não encontrados, tentando inferir...")
@@ -79,101 +277,429 @@ def converter_emit_para_envi(caminho_arquivo_nc, caminho_saida_base):
 
             if band_dim_index == 0:  # (bands, lines, samples)
                 bandas, linhas, amostras = imagem_data.shape
+                dim_bandas, dim_linhas, dim_amostras = imagem_data.dims
             elif band_dim_index == 2:  # (lines, samples, bands)
                 linhas, amostras, bandas = imagem_data.shape
+                dim_linhas, dim_amostras, dim_bandas = imagem_data.dims
             else:
                 raise ValueError("Não foi possível determinar a ordem das dimensões da imagem.")
 
         print(f"Dimensões corretas: {amostras} (amostras) x {linhas} (linhas) x {bandas} (bandas)")
 
-        # 3. Garantir que os dados estejam na ordem correta para salvar em BSQ
-        # A ordem para BSQ (Band Sequential) deve ser (bands, lines, samples)
-        dados_numpy = imagem_data.transpose('bands', 'downtrack', 'crosstrack').values
-
-        # 4. Criar o cabeçalho (.hdr) com os valores corretos
-        tipo_dado_envi = 4  # float32
-        byte_order = 0
+        if formato_saida not in ('envi', 'hdf5', 'ambos'):
+            raise ValueError(f"Formato de saída inválido: '{formato_saida}'. Use 'envi', 'hdf5' ou 'ambos'.")
+        if tipo_dado not in TIPOS_ARMAZENAMENTO:
+            raise ValueError(f"Tipo de dado inválido: '{tipo_dado}'. Use {', '.join(TIPOS_ARMAZENAMENTO)}.")
 
         # Cria a pasta de saída se não existir
         os.makedirs(os.path.dirname(caminho_saida_base), exist_ok=True)
 
-        caminho_saida_hdr = f"{caminho_saida_base}.hdr"
-
-        header_lines = [
-            "ENVI",
-            f"description = {{Arquivo EMIT L2A Reflectance (dimensões corrigidas)}}",
-            f"samples = {amostras}",
-            f"lines   = {linhas}",
-            f"bands   = {bandas}",
-            "header offset = 0",
-            "file type = ENVI Standard",
-            f"data type = {tipo_dado_envi}",
-            "interleave = bsq",
-            f"byte order = {byte_order}",
-            "data ignore value = -9999"
-        ]
-
-        # Adicionar comprimentos de onda, se disponíveis
+        dims = (dim_bandas, dim_linhas, dim_amostras)
+        wavelengths = None
         if 'wavelengths' in imagem_data.coords:
             wavelengths = imagem_data.coords['wavelengths'].values
-            wavelengths_str = ", ".join(map(str, np.round(wavelengths, 2)))
-            header_lines.append(f"wavelength = {{{wavelengths_str}}}")
-
-        header = "\n".join(header_lines) + "\n"
 
-        with open(caminho_saida_hdr, 'w') as f:
-            f.write(header)
-        print(f"Arquivo de cabeçalho (.hdr) corrigido salvo em: '{caminho_saida_hdr}'")
-
-        # 5. Salvar o arquivo de dados brutos (.raw) com a ordem correta
-        caminho_saida_raw = f"{caminho_saida_base}.raw"
-        with open(caminho_saida_raw, 'wb') as f:
-            dados_numpy.tofile(f)
-        print(f"Arquivo de dados brutos (.raw) corrigido salvo em: '{caminho_saida_raw}'")
+        if formato_saida in ('envi', 'ambos'):
+            # 3. Montar o cabeçalho (.hdr) com os valores corretos (gravado depois dos dados)
+            ordem = ordem_dimensoes(interleave, dim_bandas, dim_linhas, dim_amostras)
+            tipo_dado_envi = TIPOS_ARMAZENAMENTO[tipo_dado][1]
+            if tipo_dado_envi is None:
+                raise ValueError(f"O tipo '{tipo_dado}' não existe no formato ENVI; use-o com formato_saida='hdf5'.")
+            byte_order = 0
+
+            caminho_saida_hdr = f"{caminho_saida_base}.hdr"
+
+            header_lines = [
+                "ENVI",
+                f"description = {{Arquivo EMIT L2A Reflectance (dimensões corrigidas)}}",
+                f"samples = {amostras}",
+                f"lines   = {linhas}",
+                f"bands   = {bandas}",
+                "header offset = 0",
+                "file type = ENVI Standard",
+                f"data type = {tipo_dado_envi}",
+                f"interleave = {interleave}",
+                f"byte order = {byte_order}",
+                f"data ignore value = {VALOR_IGNORADO}"
+            ]
+
+            if tipo_dado == 'int16':
+                header_lines.append(f"reflectance scale factor = {fator_escala}")
+
+            # Adicionar comprimentos de onda, se disponíveis
+            if wavelengths is not None:
+                wavelengths_str = ", ".join(map(str, np.round(wavelengths, 2)))
+                header_lines.append(f"wavelength = {{{wavelengths_str}}}")
+
+            header = "\n".join(header_lines) + "\n"
+
+            # 4. Salvar o arquivo de dados brutos (.raw) na ordem do interleave escolhido
+            fases.iniciar('raw')
+            caminho_saida_raw = f"{caminho_saida_base}.raw"
+            caminho_tmp_raw = _caminho_temporario(caminho_saida_raw, temporarios)
+            if modo_streaming:
+                escrever_raw_em_blocos(imagem_data, caminho_tmp_raw, dims,
+                                       interleave, orcamento_memoria_mb, tipo_dado, fator_escala)
+            else:
+                dados_numpy = codificar_reflectancia(imagem_data.transpose(*ordem).values, tipo_dado, fator_escala)
+                with open(caminho_tmp_raw, 'wb') as f:
+                    dados_numpy.tofile(f)
+            os.replace(caminho_tmp_raw, caminho_saida_raw)
+            print(f"Arquivo de dados brutos (.raw) corrigido salvo em: '{caminho_saida_raw}'")
+
+            # O cabeçalho por último: o par .hdr/.raw só fica completo com os dados já no lugar
+            fases.iniciar('cabecalho')
+            caminho_tmp_hdr = _caminho_temporario(caminho_saida_hdr, temporarios)
+            with open(caminho_tmp_hdr, 'w') as f:
+                f.write(header)
+            os.replace(caminho_tmp_hdr, caminho_saida_hdr)
+            print(f"Arquivo de cabeçalho (.hdr) corrigido salvo em: '{caminho_saida_hdr}'")
+            _gravar_indice_metadados(caminho_saida_hdr)
+
+        if formato_saida in ('hdf5', 'ambos'):
+            # 5. Salvar o cubo em blocos comprimidos (.h5)
+            fases.iniciar('hdf5')
+            caminho_saida_h5 = f"{caminho_saida_base}.h5"
+            caminho_tmp_h5 = _caminho_temporario(caminho_saida_h5, temporarios)
+            escrever_cubo_hdf5(imagem_data, caminho_tmp_h5, dims, tipo_dado, fator_escala, wavelengths,
+                               orcamento_memoria_mb, **(opcoes_hdf5 or {}))
+            os.replace(caminho_tmp_h5, caminho_saida_h5)
+            print(f"Cubo comprimido (.h5) salvo em: '{caminho_saida_h5}'")
+            _gravar_indice_metadados(caminho_saida_h5)
+
+        fases.concluir()
         print("\nConversão concluída com sucesso!")
+        return True
 
     except FileNotFoundError:
         print(f"Erro: O arquivo de entrada '{caminho_arquivo_nc}' não foi encontrado.")
+        return False
     except Exception as e:
         print(f"Ocorreu um erro inesperado: {e}")
+        return False
     finally:
+        # Retornos antecipados e exceções contam como falha
+        fases.concluir(sucesso=False)
         if dataset:
             dataset.close()
+        # Restos de uma conversão interrompida
+        for caminho_tmp in temporarios:
+            if os.path.exists(caminho_tmp):
+                os.remove(caminho_tmp)
 
 
-def process_existing_files(input_folder, output_folder, processed_files):
-    """Processa todos os arquivos .nc existentes na pasta de entrada"""
-    pattern = os.path.join(input_folder, "*.nc")
-    existing_files = glob.glob(pattern)
+def _caminho_temporario(caminho, temporarios):
+    """Nome temporário na mesma pasta (o os.replace final não cruza sistemas de arquivos)"""
+    caminho_tmp = f"{caminho}.tmp{os.getpid()}"
+    temporarios.append(caminho_tmp)
+    return caminho_tmp
 
-    if not existing_files:
-        print(f"Nenhum arquivo .nc encontrado na pasta: {input_folder}")
+
+def _gravar_indice_metadados(caminho_cubo):
+    """Grava o índice de metadados do cubo; sem ele as etapas seguintes apenas leem o cabeçalho"""
+    try:
+        print(f"Índice de metadados salvo em: '{cubo_envi.gravar_indice(caminho_cubo)}'")
+    except Exception as e:
+        print(f"Aviso: não foi possível gravar o índice de metadados de '{caminho_cubo}': {e}")
+
+
+def ordem_dimensoes(interleave, dim_bandas, dim_linhas, dim_amostras):
+    """Retorna a ordem das dimensões no arquivo para o interleave ENVI escolhido"""
+    ordens = {
+        'bsq': (dim_bandas, dim_linhas, dim_amostras),
+        'bil': (dim_linhas, dim_bandas, dim_amostras),
+        'bip': (dim_linhas, dim_amostras, dim_bandas),
+    }
+    if interleave not in ordens:
+        raise ValueError(f"Interleave inválido: '{interleave}'. Use 'bsq', 'bil' ou 'bip'.")
+    return ordens[interleave]
+
+
+def escrever_raw_em_blocos(imagem_data, caminho_saida_raw, dims, interleave='bsq', orcamento_memoria_mb=256,
+                           tipo_dado='float32', fator_escala=10000):
+    """
+    Escreve o cubo num .raw pré-alocado (memmap) bloco a bloco. Em BSQ os blocos são
+    de bandas; em BIL/BIP são de linhas, de forma que cada bloco ocupa uma faixa
+    contígua do arquivo. Cada bloco é lido do NetCDF, transposto e copiado para o
+    memmap, de modo que apenas um bloco (mais sua cópia transposta) fica na memória.
+    """
+    dim_bandas, dim_linhas, dim_amostras = dims
+    bandas = imagem_data.sizes[dim_bandas]
+    linhas = imagem_data.sizes[dim_linhas]
+    amostras = imagem_data.sizes[dim_amostras]
+
+    ordem = ordem_dimensoes(interleave, dim_bandas, dim_linhas, dim_amostras)
+    forma = tuple(imagem_data.sizes[d] for d in ordem)
+
+    # Bloco ao longo da primeira dimensão do arquivo (bandas em BSQ, linhas em BIL/BIP)
+    dim_bloco = ordem[0]
+    total = imagem_data.sizes[dim_bloco]
+    bytes_por_fatia = bandas * linhas * amostras * np.dtype(np.float32).itemsize // total
+
+    # Leitura + cópia transposta: ~2 bytes por byte de saída no pico
+    orcamento_bytes = orcamento_memoria_mb * 1024 * 1024
+    fatias_por_bloco = int(max(1, min(total, orcamento_bytes // (2 * bytes_por_fatia))))
+    print(f"Modo streaming: {fatias_por_bloco} {'bandas' if interleave == 'bsq' else 'linhas'} por bloco "
+          f"(orçamento de {orcamento_memoria_mb} MB)")
+
+    saida = np.memmap(caminho_saida_raw, dtype=TIPOS_ARMAZENAMENTO[tipo_dado][0], mode='w+', shape=forma)
+    try:
+        for inicio in range(0, total, fatias_por_bloco):
+            fim = min(inicio + fatias_por_bloco, total)
+            bloco = imagem_data.isel({dim_bloco: slice(inicio, fim)})
+            saida[inicio:fim] = codificar_reflectancia(bloco.transpose(*ordem).values, tipo_dado, fator_escala)
+            # Descarrega as páginas sujas para não acumular o cubo inteiro no cache
+            saida.flush()
+            del bloco
+    finally:
+        del saida
+
+
+def escrever_cubo_hdf5(imagem_data, caminho_saida_h5, dims, tipo_dado='float32', fator_escala=10000,
+                       wavelengths=None, orcamento_memoria_mb=256, tamanho_tile=128, bandas_por_chunk=16,
+                       compressao='lzf'):
+    """
+    Grava o cubo num arquivo HDF5 com o dataset 'reflectance' em (linhas, amostras, bandas),
+    dividido em blocos de tamanho_tile x tamanho_tile pixels x bandas_por_chunk bandas e
+    comprimido (lzf por padrão, ou gzip). Os leitores podem então buscar apenas os
+    blocos espaciais e as bandas de que precisam.
+
+    A escrita percorre faixas de tamanho_tile linhas e, dentro delas, grupos de bandas
+    alinhados aos blocos, de modo que cada bloco é comprimido uma única vez e a memória
+    usada fica limitada por orcamento_memoria_mb.
+    """
+    h5py = dependencias.carregar('h5py')
+
+    dim_bandas, dim_linhas, dim_amostras = dims
+    bandas = imagem_data.sizes[dim_bandas]
+    linhas = imagem_data.sizes[dim_linhas]
+    amostras = imagem_data.sizes[dim_amostras]
+
+    tile_linhas = min(tamanho_tile, linhas)
+    tile_amostras = min(tamanho_tile, amostras)
+    bandas_por_chunk = min(bandas_por_chunk, bandas)
+
+    # Leitura + cópia transposta: ~2 bytes por byte lido no pico
+    orcamento_bytes = orcamento_memoria_mb * 1024 * 1024
+    bytes_por_banda = tile_linhas * amostras * np.dtype(np.float32).itemsize
+    bandas_por_bloco = orcamento_bytes // (2 * bytes_por_banda) // bandas_por_chunk * bandas_por_chunk
+    bandas_por_bloco = int(max(bandas_por_chunk, min(bandas, bandas_por_bloco)))
+
+    with h5py.File(caminho_saida_h5, 'w') as f:
+        dset = f.create_dataset(
+            'reflectance', shape=(linhas, amostras, bandas), dtype=TIPOS_ARMAZENAMENTO[tipo_dado][0],
+            chunks=(tile_linhas, tile_amostras, bandas_por_chunk),
+            compression=compressao, shuffle=True
+        )
+        dset.attrs['data ignore value'] = VALOR_IGNORADO
+        if tipo_dado == 'int16':
+            dset.attrs['reflectance scale factor'] = fator_escala
+        if wavelengths is not None:
+            dset.attrs['wavelength'] = np.round(np.asarray(wavelengths, dtype=np.float64), 2)
+
+        for linha in range(0, linhas, tile_linhas):
+            fim_linha = min(linha + tile_linhas, linhas)
+            for banda in range(0, bandas, bandas_por_bloco):
+                fim_banda = min(banda + bandas_por_bloco, bandas)
+                bloco = imagem_data.isel({dim_linhas: slice(linha, fim_linha), dim_bandas: slice(banda, fim_banda)})
+                dados = bloco.transpose(dim_linhas, dim_amostras, dim_bandas).values
+                dset[linha:fim_linha, :, banda:fim_banda] = codificar_reflectancia(dados, tipo_dado, fator_escala)
+
+
+def _limitar_memoria_worker(limite_memoria_mb):
+    """Inicializador dos processos de conversão: aplica o limite de memória por worker"""
+    if not limite_memoria_mb:
         return
+    try:
+        import resource
 
-    print(f"Encontrados {len(existing_files)} arquivos para processar...")
+        # RLIMIT_DATA limita heap e mapeamentos privados; o memmap do .raw (compartilhado) não conta
+        limite_bytes = int(limite_memoria_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_DATA, (limite_bytes, limite_bytes))
+    except (ImportError, ValueError, OSError) as e:
+        print(f"Aviso: não foi possível limitar a memória do worker: {e}")
 
-    for file_path in existing_files:
-        if file_path in processed_files:
-            continue
 
-        try:
-            base_name = os.path.splitext(os.path.basename(file_path))[0]
-            output_base = os.path.join(output_folder, base_name)
+def _inicializar_worker(limite_memoria_mb, configuracao_metricas):
+    """
+    Inicializador dos processos de conversão. Com 'spawn' os workers não herdam a
+    configuração das métricas: as fases de cada conversão vão para o mesmo JSON-lines,
+    e o textfile do Prometheus fica com o processo principal.
+    """
+    _limitar_memoria_worker(limite_memoria_mb)
+    if configuracao_metricas['pasta']:
+        metricas.configurar(**configuracao_metricas)
+
+
+def criar_pool_conversao(num_workers, limite_memoria_mb=None):
+    """Cria o pool de processos usado nas conversões (backfill e monitoramento)"""
+    # 'spawn' evita herdar threads (ex: do observer) em processos filhos
+    contexto = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(max_workers=max(1, num_workers), mp_context=contexto, initializer=_inicializar_worker,
+                               initargs=(limite_memoria_mb, metricas.configuracao()))
+
+
+def _base_saida(file_path, output_folder):
+    """Gera o caminho base de saída (sem extensão) a partir do arquivo de entrada"""
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(output_folder, base_name)
+
 
-            converter_emit_para_envi(file_path, output_base)
+def _converter_arquivo(file_path, output_folder, opcoes_conversao, calcular_hash=False):
+    """
+    Converte um único arquivo .nc; executado dentro dos processos do pool.
+    Retorna (sucesso, hash do .nc ou None). Com calcular_hash, o hash usado pelo registro
+    é calculado aqui, no worker, e o processo principal não precisa reler o arquivo inteiro.
+    """
+    sucesso = converter_emit_para_envi(file_path, _base_saida(file_path, output_folder), **(opcoes_conversao or {}))
+    return sucesso, hash_conteudo(file_path) if sucesso and calcular_hash else None
+
+
+def arquivos_saida(output_base, opcoes_conversao=None):
+    """Lista os arquivos gerados por uma conversão de acordo com o formato de saída"""
+    formato = (opcoes_conversao or {}).get('formato_saida', 'envi')
+    saidas = []
+    if formato in ('envi', 'ambos'):
+        saidas += [f"{output_base}.hdr", f"{output_base}.raw"]
+    if formato in ('hdf5', 'ambos'):
+        saidas.append(f"{output_base}.h5")
+    return saidas
+
+
+def _registrar_conversao(registro, file_path, output_folder, sucesso, opcoes_conversao=None, hash_arquivo=None):
+    """Grava o resultado de uma conversão no registro persistente, se houver, e nas métricas"""
+    metricas.incrementar('monitor_itens_total', pasta=os.path.basename(os.path.dirname(file_path)),
+                         resultado='sucesso' if sucesso else 'falha')
+    if not registro:
+        return
+    try:
+        if sucesso:
+            output_base = _base_saida(file_path, output_folder)
+            registro.marcar_concluido(ESTAGIO_CONVERSAO, file_path, arquivos_saida(output_base, opcoes_conversao),
+                                      hash_arquivo)
+        else:
+            registro.marcar_falha(ESTAGIO_CONVERSAO, file_path)
+    except Exception as e:
+        print(f"Aviso: não foi possível atualizar o registro para {file_path}: {e}")
+
+
+def process_existing_files(input_folder, output_folder, processed_files, opcoes_conversao=None,
+                           num_workers=1, limite_memoria_mb=None, registro=None):
+    """
+    Processa todos os arquivos .nc existentes na pasta de entrada.
+
+    Com num_workers > 1 os arquivos são convertidos em paralelo num pool de processos,
+    cada um limitado a limite_memoria_mb (quando suportado pelo sistema). O conjunto
+    processed_files é atualizado apenas no processo principal, conforme as conversões
+    terminam com sucesso. Ao final é exibida a vazão agregada do backfill.
+
+    Com um registro persistente, arquivos já convertidos em execuções anteriores
+    (e sem alteração desde então) são pulados.
+    """
+    pattern = os.path.join(input_folder, "*.nc")
+    existing_files = []
+    for file_path in glob.glob(pattern):
+        if file_path in processed_files:
+            continue
+        if registro and registro.ja_processado(ESTAGIO_CONVERSAO, file_path):
             processed_files.add(file_path)
+            continue
+        existing_files.append(file_path)
 
-        except Exception as e:
-            print(f"Erro ao processar arquivo existente {file_path}: {e}")
+    if registro:
+        for file_path in registro.interrompidos(ESTAGIO_CONVERSAO):
+            print(f"Retomando conversão interrompida: {file_path}")
 
+    if not existing_files:
+        print(f"Nenhum arquivo .nc novo encontrado na pasta: {input_folder}")
+        return
+
+    print(f"Encontrados {len(existing_files)} arquivos para processar...")
 
-def start_monitoring(input_folder, output_folder):
-    """Inicia o monitoramento da pasta para novos arquivos"""
+    inicio = time.time()
+    convertidos = 0
+    bytes_convertidos = 0
+
+    if num_workers <= 1:
+        for file_path in existing_files:
+            try:
+                if registro:
+                    registro.marcar_em_andamento(ESTAGIO_CONVERSAO, file_path)
+                sucesso, hash_arquivo = _converter_arquivo(file_path, output_folder, opcoes_conversao,
+                                                           registro is not None)
+                _registrar_conversao(registro, file_path, output_folder, sucesso, opcoes_conversao, hash_arquivo)
+                if sucesso:
+                    processed_files.add(file_path)
+                    convertidos += 1
+                    bytes_convertidos += os.path.getsize(file_path)
+
+            except Exception as e:
+                print(f"Erro ao processar arquivo existente {file_path}: {e}")
+    else:
+        print(f"Backfill paralelo: {num_workers} workers"
+              + (f", limite de {limite_memoria_mb} MB por worker" if limite_memoria_mb else ""))
+
+        pendentes = list(existing_files)
+        em_andamento = {}
+
+        with criar_pool_conversao(num_workers, limite_memoria_mb) as executor:
+            while pendentes or em_andamento:
+                # Mantém no máximo 2 tarefas por worker na fila para limitar o uso de memória
+                while pendentes and len(em_andamento) < 2 * num_workers:
+                    file_path = pendentes.pop(0)
+                    if registro:
+                        registro.marcar_em_andamento(ESTAGIO_CONVERSAO, file_path)
+                    futuro = executor.submit(_converter_arquivo, file_path, output_folder, opcoes_conversao,
+                                             registro is not None)
+                    em_andamento[futuro] = (file_path, time.perf_counter())
+
+                metricas.definir('monitor_pendentes', len(pendentes), pasta=os.path.basename(input_folder))
+                metricas.definir('conversoes_em_andamento', len(em_andamento))
+                concluidos, _ = wait(em_andamento, return_when=FIRST_COMPLETED)
+                for futuro in concluidos:
+                    file_path, enviado = em_andamento.pop(futuro)
+                    try:
+                        sucesso, hash_arquivo = futuro.result()
+                    except Exception as e:
+                        print(f"Erro ao processar arquivo existente {file_path}: {e}")
+                        sucesso, hash_arquivo = False, None
+                    metricas.registrar_fase('monitor', 'conversao', time.perf_counter() - enviado, sucesso,
+                                            cena=os.path.basename(file_path))
+
+                    _registrar_conversao(registro, file_path, output_folder, sucesso, opcoes_conversao, hash_arquivo)
+                    if sucesso:
+                        processed_files.add(file_path)
+                        convertidos += 1
+                        bytes_convertidos += os.path.getsize(file_path)
+                    else:
+                        print(f"Falha ao converter arquivo existente: {file_path}")
+
+    metricas.definir('monitor_pendentes', 0, pasta=os.path.basename(input_folder))
+    metricas.definir('conversoes_em_andamento', 0)
+    duracao = max(time.time() - inicio, 1e-6)
+    print(f"\n=== RESUMO DO BACKFILL ===")
+    print(f"Arquivos convertidos: {convertidos} de {len(existing_files)}")
+    print(f"Tempo total: {duracao:.1f} s")
+    print(f"Vazão: {convertidos / (duracao / 60):.2f} granules/min, "
+          f"{bytes_convertidos / (1024 * 1024) / duracao:.2f} MB/s")
+
+
+def start_monitoring(input_folder, output_folder, opcoes_conversao=None, num_workers=1, limite_memoria_mb=None,
+                     caminho_registro=None):
+    """
+    Inicia o monitoramento da pasta para novos arquivos.
+    opcoes_conversao é repassado para converter_emit_para_envi (ex: modo_streaming);
+    num_workers e limite_memoria_mb configuram o pool de conversão, usado tanto no
+    backfill dos arquivos existentes quanto nos arquivos que chegam durante o monitoramento.
+    caminho_registro aponta para o banco SQLite compartilhado com as demais etapas.
+    """
     processed_files = set()
+    registro = RegistroProcessamento(caminho_registro) if caminho_registro else None
 
     # Primeiro, processa arquivos existentes
     print("=== PROCESSANDO ARQUIVOS EXISTENTES ===")
-    process_existing_files(input_folder, output_folder, processed_files)
+    process_existing_files(input_folder, output_folder, processed_files, opcoes_conversao,
+                           num_workers=num_workers, limite_memoria_mb=limite_memoria_mb, registro=registro)
 
     # Depois, inicia o monitoramento
     print("\n=== INICIANDO MONITORAMENTO ===")
@@ -181,7 +707,10 @@ def start_monitoring(input_folder, output_folder):
     print(f"Pasta de saída: {output_folder}")
     print("Pressione Ctrl+C para parar o monitoramento...")
 
-    event_handler = EMITFileHandler(input_folder, output_folder, processed_files)
+    event_handler = EMITFileHandler(input_folder, output_folder, processed_files, opcoes_conversao,
+                                    num_workers=num_workers, limite_memoria_mb=limite_memoria_mb,
+                                    registro=registro)
+    event_handler.iniciar()
     observer = Observer()
     observer.schedule(event_handler, input_folder, recursive=False)
     observer.start()
@@ -194,6 +723,9 @@ def start_monitoring(input_folder, output_folder):
         observer.stop()
 
     observer.join()
+    event_handler.parar()
+    if registro:
+        registro.fechar()
 
 
 # --- COMO USAR O SCRIPT ---
@@ -201,6 +733,21 @@ if __name__ == '__main__':
     # Configurações
     pasta_entrada = 'arquivosbrutos'  # Pasta onde os arquivos .nc chegam
     pasta_saida = 'arquivoRAW'  # Pasta onde os arquivos convertidos serão salvos
+    caminho_registro = 'registro_processamento.sqlite'  # Registro compartilhado pelas etapas do pipeline
+
+    # Opções de conversão
+    opcoes_conversao = {
+        'modo_streaming': True,  # Lê e grava o cubo em blocos em vez de carregá-lo inteiro
+        'orcamento_memoria_mb': 256,  # Limite aproximado de memória por conversão no modo streaming
+        'interleave': 'bip',  # 'bsq', 'bil' ou 'bip'; BIP deixa os espectros de cada pixel contíguos
+        'tipo_dado': 'float32',  # 'float32' ou 'int16' (reflectância escalada, metade do tamanho em disco)
+        'fator_escala': 10000,  # Usado apenas com tipo_dado='int16'
+        'formato_saida': 'envi',  # 'envi' (.hdr/.raw), 'hdf5' (.h5 em blocos comprimidos) ou 'ambos'
+        'opcoes_hdf5': {'tamanho_tile': 128, 'bandas_por_chunk': 16, 'compressao': 'lzf'},
+    }
+    num_workers = max(1, (os.cpu_count() or 2) - 1)  # Processos de conversão (backfill e novos arquivos)
+    limite_memoria_mb = 2048  # Limite de memória por worker de conversão (None para desativar)
+    pasta_metricas = 'metricas'  # converter.jsonl (fases e contadores) e converter.prom (Prometheus); None desativa
 
     # Garante que as pastas existem
     os.makedirs(pasta_entrada, exist_ok=True)
@@ -209,4 +756,9 @@ if __name__ == '__main__':
     # Instalação da dependência necessária (executar apenas uma vez)
     # pip install watchdog
 
-    start_monitoring(pasta_entrada, pasta_saida)
\ No newline at end of file
+    dependencias.relatorio_importacoes("Tempo de inicialização")
+    if pasta_metricas:
+        metricas.configurar(pasta_metricas, 'converter')
+    start_monitoring(pasta_entrada, pasta_saida, opcoes_conversao, num_workers, limite_memoria_mb, caminho_registro)
+    metricas.exportar(forcar=True)
+    dependencias.relatorio_importacoes("Custo das importações")
\ No newline at end of file
@@ -0,0 +1,321 @@
+import os
+import json
+import glob
+from contextlib import contextmanager
+
+import numpy as np
+
+import dependencias
+
+# Códigos de tipo de dado do formato ENVI
+TIPOS_ENVI = {
+    1: np.uint8,
+    2: np.int16,
+    3: np.int32,
+    4: np.float32,
+    5: np.float64,
+    12: np.uint16,
+    13: np.uint32,
+    14: np.int64,
+    15: np.uint64,
+}
+
+# Comprimentos de onda (nm) procurados pelas etapas: azul, verde e vermelho do RGB e o NIR do NDWI.
+# O índice da banda mais próxima de cada um fica pré-calculado em metadados['bandas_alvo'].
+COMPRIMENTOS_ALVO = (450, 550, 650, 860)
+
+
+def eh_hdf5(caminho):
+    """Indica se o caminho aponta para um cubo HDF5 (.h5) em vez de um par ENVI .hdr/.raw"""
+    return caminho.endswith('.h5')
+
+
+def arquivo_dados(caminho):
+    """Retorna o arquivo que contém os dados do cubo: o .raw de um .hdr ou o próprio .h5"""
+    if eh_hdf5(caminho):
+        return caminho
+    return caminho.replace('.hdr', '.raw')
+
+
+def listar_cubos(pasta):
+    """
+    Lista os cubos de uma pasta: todos os .hdr e os .h5 que não têm um .hdr de
+    mesmo nome (quando a conversão gerou os dois formatos, o ENVI é usado).
+    """
+    cubos = glob.glob(os.path.join(pasta, "*.hdr"))
+    for caminho_h5 in glob.glob(os.path.join(pasta, "*.h5")):
+        if not os.path.exists(os.path.splitext(caminho_h5)[0] + '.hdr'):
+            cubos.append(caminho_h5)
+    return cubos
+
+
+def caminho_indice(caminho):
+    """Arquivo de índice de metadados de um cubo: <cubo>.json (ex: cena.hdr.json, cena.h5.json)"""
+    return f"{caminho}.json"
+
+
+def identidade_cubo(caminho):
+    """Tamanho e mtime do cabeçalho e dos dados, para invalidar um índice de um cubo regravado"""
+    stats = [os.stat(arquivo) for arquivo in sorted({caminho, arquivo_dados(caminho)})]
+    return [[stat.st_size, stat.st_mtime_ns] for stat in stats]
+
+
+def banda_mais_proxima(metadados, alvo):
+    """
+    Índice da banda cujo comprimento de onda é mais próximo de alvo (nm). Os alvos de
+    COMPRIMENTOS_ALVO vêm da tabela pré-calculada; sem comprimentos de onda, KeyError.
+    """
+    if alvo in metadados.get('bandas_alvo', {}):
+        return metadados['bandas_alvo'][alvo]
+    return int(np.argmin(np.abs(np.asarray(metadados['wavelengths']) - alvo)))
+
+
+def _tabela_bandas_alvo(metadados):
+    if 'wavelengths' not in metadados:
+        return {}
+    return {alvo: banda_mais_proxima(metadados, alvo) for alvo in COMPRIMENTOS_ALVO}
+
+
+def gravar_indice(caminho):
+    """
+    Lê o cabeçalho uma vez e grava o índice de metadados do cubo (dimensões, tipo,
+    interleave, valor ignorado, escala, comprimentos de onda e bandas_alvo). Chamado
+    pela conversão depois de gravar o cubo; ler_metadados passa a usar o índice.
+    """
+    metadados = _ler_cabecalho(caminho)
+    indice = dict(metadados, dtype=metadados['dtype'].str, identidade=identidade_cubo(caminho),
+                  bandas_alvo={str(alvo): banda for alvo, banda in metadados['bandas_alvo'].items()})
+
+    caminho_json = caminho_indice(caminho)
+    caminho_tmp = f"{caminho_json}.tmp{os.getpid()}"
+    with open(caminho_tmp, 'w') as f:
+        json.dump(indice, f)
+    os.replace(caminho_tmp, caminho_json)
+    return caminho_json
+
+
+def _ler_indice(caminho):
+    """Metadados do índice do cubo, ou None se não houver índice válido para o cubo atual"""
+    try:
+        with open(caminho_indice(caminho)) as f:
+            indice = json.load(f)
+        if indice.pop('identidade') != identidade_cubo(caminho):
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+
+    indice['dtype'] = np.dtype(indice['dtype'])
+    indice['bandas_alvo'] = {int(alvo): banda for alvo, banda in indice['bandas_alvo'].items()}
+    return indice
+
+
+def ler_metadados(caminho):
+    """
+    Metadados do cubo: dimensões, tipo, interleave, escala, comprimentos de onda e
+    bandas_alvo. Vêm do índice gravado na conversão (ver gravar_indice) quando ele
+    existe e corresponde ao cubo; senão, do cabeçalho ENVI ou dos atributos do .h5.
+    """
+    metadados = _ler_indice(caminho)
+    if metadados is None:
+        metadados = _ler_cabecalho(caminho)
+    return metadados
+
+
+def dependencias_leitura(caminho):
+    """
+    Módulos que a leitura do cubo exige: h5py para um .h5; spectral para um .hdr
+    só quando não há índice válido e o cabeçalho precisa ser interpretado.
+    """
+    if eh_hdf5(caminho):
+        return ['h5py']
+    if _ler_indice(caminho) is None:
+        return ['spectral']
+    return []
+
+
+def _ler_cabecalho(caminho):
+    """Lê o cabeçalho ENVI (ou os atributos do .h5): dimensões, tipo, interleave, escala e comprimentos de onda"""
+    if eh_hdf5(caminho):
+        metadados = _ler_metadados_hdf5(caminho)
+        metadados['bandas_alvo'] = _tabela_bandas_alvo(metadados)
+        return metadados
+
+    envi = dependencias.carregar('spectral').envi
+
+    hdr = envi.read_envi_header(caminho)
+
+    dtype = np.dtype(TIPOS_ENVI[int(hdr['data type'])])
+    dtype = dtype.newbyteorder('>' if int(hdr.get('byte order', 0)) == 1 else '<')
+
+    metadados = {
+        'formato': 'envi',
+        'linhas': int(hdr['lines']),
+        'amostras': int(hdr['samples']),
+        'bandas': int(hdr['bands']),
+        'interleave': hdr.get('interleave', 'bsq').lower(),
+        'dtype': dtype,
+        'offset': int(hdr.get('header offset', 0)),
+        'ignore': float(hdr['data ignore value']) if 'data ignore value' in hdr else None,
+        'escala': float(hdr.get('reflectance scale factor', 1)),
+    }
+
+    # Assim como no cabeçalho, 'wavelengths' só existe quando o arquivo traz os comprimentos de onda
+    if 'wavelength' in hdr:
+        metadados['wavelengths'] = [float(w) for w in hdr['wavelength']]
+
+    metadados['bandas_alvo'] = _tabela_bandas_alvo(metadados)
+    return metadados
+
+
+def _ler_metadados_hdf5(caminho):
+    h5py = dependencias.carregar('h5py')
+
+    with h5py.File(caminho, 'r') as f:
+        dset = f['reflectance']
+        linhas, amostras, bandas = dset.shape
+        metadados = {
+            'formato': 'hdf5',
+            'linhas': linhas,
+            'amostras': amostras,
+            'bandas': bandas,
+            'interleave': 'bip',
+            'dtype': dset.dtype,
+            'offset': 0,
+            'ignore': float(dset.attrs['data ignore value']) if 'data ignore value' in dset.attrs else None,
+            'escala': float(dset.attrs.get('reflectance scale factor', 1)),
+        }
+        if 'wavelength' in dset.attrs:
+            metadados['wavelengths'] = [float(w) for w in dset.attrs['wavelength']]
+
+    return metadados
+
+
+def decodificar(bloco, metadados):
+    """
+    Converte um bloco lido do disco para float32 em unidades de reflectância.
+    Em arquivos inteiros escalados divide pelo 'reflectance scale factor',
+    preservando o 'data ignore value' original (ex: -9999).
+    """
+    escala = metadados['escala']
+    if escala == 1 and metadados['dtype'] == np.float32:
+        return np.asarray(bloco, dtype=np.float32)
+
+    ignorar = metadados['ignore']
+    mascara_ignorar = None
+    if ignorar is not None:
+        # A comparação é feita no tipo armazenado (em float16, -9999 é gravado como -10000)
+        mascara_ignorar = bloco == np.array(ignorar).astype(metadados['dtype'])
+
+    dados = np.array(bloco, dtype=np.float32)
+    if escala != 1:
+        dados /= escala
+    if mascara_ignorar is not None:
+        dados[mascara_ignorar] = ignorar
+    return dados
+
+
+def abrir_memmap(caminho_hdr, metadados=None):
+    """
+    Abre o .raw como memmap somente leitura e retorna uma visão (linhas, amostras, bandas).
+    Em BIP a visão é contígua; em BSQ/BIL é uma transposição sem cópia.
+    """
+    if metadados is None:
+        metadados = ler_metadados(caminho_hdr)
+
+    linhas, amostras, bandas = metadados['linhas'], metadados['amostras'], metadados['bandas']
+    formas = {
+        'bsq': ((bandas, linhas, amostras), (1, 2, 0)),
+        'bil': ((linhas, bandas, amostras), (0, 2, 1)),
+        'bip': ((linhas, amostras, bandas), (0, 1, 2)),
+    }
+    forma, eixos = formas[metadados['interleave']]
+
+    caminho_raw = caminho_hdr.replace('.hdr', '.raw')
+    dados = np.memmap(caminho_raw, dtype=metadados['dtype'], mode='r',
+                      offset=metadados['offset'], shape=forma)
+    return dados.transpose(eixos)
+
+
+@contextmanager
+def _abrir_cubo(caminho, metadados):
+    """Abre o cubo para leitura em (linhas, amostras, bandas): memmap do .raw ou dataset do .h5"""
+    if metadados['formato'] == 'hdf5':
+        h5py = dependencias.carregar('h5py')
+
+        with h5py.File(caminho, 'r') as f:
+            yield f['reflectance']
+    else:
+        yield abrir_memmap(caminho, metadados)
+
+
+def iterar_blocos_de_pixels(caminho, pixels_por_bloco=65536, metadados=None):
+    """
+    Percorre o cubo em blocos de pixels na ordem linha a linha, produzindo
+    (índice do primeiro pixel, bloco float32 de forma (n, bandas)).
+
+    Em BIP cada bloco é uma faixa contígua do arquivo; nos outros interleaves (e no
+    HDF5, onde a leitura acompanha os blocos comprimidos) os blocos são montados a
+    partir de linhas inteiras.
+    """
+    if metadados is None:
+        metadados = ler_metadados(caminho)
+
+    with _abrir_cubo(caminho, metadados) as cubo:
+        linhas, amostras, bandas = cubo.shape
+        total = linhas * amostras
+
+        if metadados['formato'] == 'envi' and metadados['interleave'] == 'bip':
+            pixels = cubo.reshape((total, bandas))
+            for inicio in range(0, total, pixels_por_bloco):
+                fim = min(inicio + pixels_por_bloco, total)
+                yield inicio, decodificar(pixels[inicio:fim], metadados)
+        else:
+            linhas_por_bloco = max(1, pixels_por_bloco // amostras)
+            for linha in range(0, linhas, linhas_por_bloco):
+                fim = min(linha + linhas_por_bloco, linhas)
+                bloco = decodificar(cubo[linha:fim], metadados).reshape((-1, bandas))
+                yield linha * amostras, bloco
+
+
+def ler_bandas(caminho, indices, metadados=None):
+    """Lê as bandas indicadas e retorna um array float32 (linhas, amostras, len(indices))"""
+    if metadados is None:
+        metadados = ler_metadados(caminho)
+
+    with _abrir_cubo(caminho, metadados) as cubo:
+        if metadados['formato'] == 'hdf5':
+            # Uma única leitura com índices ordenados descomprime só os blocos dessas bandas
+            unicos = sorted(set(int(i) for i in indices))
+            dados = cubo[:, :, unicos]
+            posicoes = [unicos.index(int(i)) for i in indices]
+            return decodificar(dados[:, :, posicoes], metadados)
+
+        if metadados['interleave'] == 'bip':
+            # Em BIP as bandas de cada pixel são vizinhas: uma única passada pelo arquivo lê todas
+            return decodificar(cubo[:, :, list(indices)], metadados)
+
+        return np.stack([decodificar(cubo[:, :, i], metadados) for i in indices], axis=-1)
+
+
+def ler_linhas(caminho, indices, metadados=None):
+    """
+    Lê apenas as linhas indicadas e retorna um array float32 (linhas distintas,
+    amostras, bandas), em ordem crescente. Em BIP e no HDF5 cada linha é uma leitura contígua.
+    """
+    if metadados is None:
+        metadados = ler_metadados(caminho)
+
+    with _abrir_cubo(caminho, metadados) as cubo:
+        return decodificar(cubo[sorted({int(i) for i in indices})], metadados)
+
+
+def carregar_cubo(caminho, metadados=None):
+    """Carrega o cubo inteiro em memória como float32 (linhas, amostras, bandas)"""
+    if metadados is None:
+        metadados = ler_metadados(caminho)
+
+    with _abrir_cubo(caminho, metadados) as cubo:
+        if metadados['formato'] == 'envi' and metadados['escala'] == 1 and metadados['dtype'] == np.float32:
+            # Força a leitura para a memória em vez de devolver uma visão do memmap
+            return np.array(cubo, dtype=np.float32)
+        return decodificar(cubo[...], metadados)
@@ -1,287 +1,754 @@
 import numpy as np
 import os
-import glob
-import time
 import shutil
 
+from registro_processamento import RegistroProcessamento, ESTAGIO_DETECCAO
+from cache_modelos import CacheModelos
+from modelo_incremental import ModeloIncremental
+from biblioteca_treino import BibliotecaTreino, resumir_cubo
+from detectores import obter_detector, configurar_threads_tensorflow
+import cubo_envi
+import dependencias
+import estatisticas
+import metricas
+import piramide
+import renderizar
+from monitor_pastas import MonitorPasta, cubo_do_evento, arquivos_do_cubo, par_completo
+
 # Configuração para evitar problemas no macOS
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
 os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 
-# Tentativa de import com fallback
-try:
-    import tensorflow as tf
-    from tensorflow import keras
+# Dependências pesadas são importadas só quando o caminho de código escolhido precisa delas
+# (ver dependencias.carregar); aqui apenas se verifica se estão instaladas
+TENSORFLOW_AVAILABLE = dependencias.disponivel('tensorflow')
+RASTERIO_AVAILABLE = dependencias.disponivel('rasterio')
 
-    TENSORFLOW_AVAILABLE = True
-    print("TensorFlow carregado com sucesso")
-except Exception as e:
-    print(f"TensorFlow não disponível: {e}")
-    TENSORFLOW_AVAILABLE = False
 
-try:
-    from spectral import envi
+def carregar_dados_hdr(caminho_hdr):
+    """Carrega dados de arquivo HDR como float32, decodificando cubos int16 escalados"""
+    try:
+        img = cubo_envi.carregar_cubo(caminho_hdr)
+        return img
+    except Exception as e:
+        print(f"Erro ao carregar arquivo HDR: {e}")
+        raise
 
-    SPECTRAL_AVAILABLE = True
-    print("Spectral carregado com sucesso")
-except Exception as e:
-    print(f"Spectral não disponível: {e}")
-    SPECTRAL_AVAILABLE = False
 
-try:
-    from sklearn.preprocessing import MinMaxScaler
+def mascara_pixels_validos(pixels, nodata_val=-9999):
+    """Marca os pixels válidos: nenhuma banda com nodata e soma das bandas positiva"""
+    return (pixels != nodata_val).all(axis=1) & (pixels.sum(axis=1) > 0)
 
-    SKLEARN_AVAILABLE = True
-    print("Scikit-learn carregado com sucesso")
-except Exception as e:
-    print(f"Scikit-learn não disponível: {e}")
-    SKLEARN_AVAILABLE = False
 
-try:
-    import matplotlib.pyplot as plt
+# Semente da amostragem de treino: a mesma entrada gera sempre a mesma amostra
+SEMENTE_AMOSTRAGEM = 0
 
-    MATPLOTLIB_AVAILABLE = True
-    print("Matplotlib carregado com sucesso")
-except Exception as e:
-    print(f"Matplotlib não disponível: {e}")
-    MATPLOTLIB_AVAILABLE = False
 
-try:
-    import rasterio
+def detector_padrao():
+    """Detector usado quando nenhum é escolhido: autoencoder com TensorFlow, senão Z-score"""
+    return 'autoencoder' if TENSORFLOW_AVAILABLE else 'zscore'
 
-    RASTERIO_AVAILABLE = True
-    print("Rasterio carregado com sucesso")
-except Exception as e:
-    print(f"Rasterio não disponível: {e}")
-    RASTERIO_AVAILABLE = False
 
+def descricao_treinamento(max_pixels_treino=None, detector=None):
+    """Descreve como o modelo é treinado; mudanças aqui invalidam o cache de modelos"""
+    nome = detector or detector_padrao()
+    return {
+        'metodo': nome,
+        **obter_detector(nome).descricao(),
+        'max_pixels_treino': max_pixels_treino,
+        'semente_amostragem': SEMENTE_AMOSTRAGEM if max_pixels_treino else None,
+    }
 
-def carregar_dados_hdr(caminho_hdr):
-    """Carrega dados de arquivo HDR"""
-    try:
-        img = envi.open(caminho_hdr).load()
-        return img
-    except Exception as e:
-        print(f"Erro ao carregar arquivo HDR: {e}")
-        raise
+
+def lista_treinos(caminho_hdr_treino):
+    """Aceita um arquivo de treino ou uma lista deles e retorna sempre uma lista"""
+    if isinstance(caminho_hdr_treino, (list, tuple)):
+        return list(caminho_hdr_treino)
+    return [caminho_hdr_treino]
+
+
+def nomes_treino(caminho_hdr_treino):
+    """Nomes dos arquivos de treino para as mensagens"""
+    return ', '.join(os.path.basename(c) for c in lista_treinos(caminho_hdr_treino))
 
 
-def detectar_anomalias_simples(dados_treino, dados_analise):
-    """Método simplificado para detecção de anomalias sem TensorFlow"""
+def amostrar_pixels_treino(caminhos_treino, max_pixels, pixels_por_bloco=65536, semente=SEMENTE_AMOSTRAGEM):
+    """
+    Sorteia até max_pixels pixels válidos dos arquivos de treino por amostragem de
+    reservatório: os cubos são lidos em blocos (ver cubo_envi.iterar_blocos_de_pixels)
+    e cada pixel válido de todos os arquivos tem a mesma chance de entrar na amostra.
+    A memória usada é a da amostra mais um bloco, qualquer que seja o tamanho das cenas.
+    """
+    rng = np.random.default_rng(semente)
+    reservatorio = None
+    vistos = 0
+
+    for caminho in caminhos_treino:
+        metadados = cubo_envi.ler_metadados(caminho)
+        if reservatorio is None:
+            reservatorio = np.empty((max_pixels, metadados['bandas']), dtype=np.float32)
+        elif metadados['bandas'] != reservatorio.shape[1]:
+            raise ValueError(f"Número de bandas diferente entre arquivos de treino: {caminho}")
+
+        for _, bloco in cubo_envi.iterar_blocos_de_pixels(caminho, pixels_por_bloco, metadados):
+            bloco = bloco[mascara_pixels_validos(bloco)]
+
+            # Enche o reservatório com os primeiros pixels
+            livres = min(max_pixels - vistos, len(bloco))
+            if livres > 0:
+                reservatorio[vistos:vistos + livres] = bloco[:livres]
+                vistos += livres
+                bloco = bloco[livres:]
+            if not len(bloco):
+                continue
+
+            # O pixel de ordem t (contando desde 1) substitui uma posição sorteada em [0, t) se ela cair na amostra
+            posicoes = rng.integers(0, np.arange(vistos + 1, vistos + len(bloco) + 1))
+            substitui = posicoes < max_pixels
+            reservatorio[posicoes[substitui]] = bloco[substitui]
+            vistos += len(bloco)
+
+    if reservatorio is None:
+        return np.empty((0, 0), dtype=np.float32), 0
+    return reservatorio[:min(vistos, max_pixels)], vistos
+
+
+def carregar_pixels_treino(caminhos_treino):
+    """Carrega todos os pixels válidos dos arquivos de treino (sem amostragem)"""
+    pixels = []
+    for caminho in caminhos_treino:
+        print(f"Carregando dados de treinamento: '{caminho}'")
+        img_treino = carregar_dados_hdr(caminho)
+        h_t, w_t, num_bands = img_treino.shape
+        dados_pixels_treino = img_treino.reshape((h_t * w_t, num_bands))
+        pixels.append(dados_pixels_treino[mascara_pixels_validos(dados_pixels_treino)])
+    return pixels[0] if len(pixels) == 1 else np.concatenate(pixels)
+
+
+def treinar_modelo(x_train, detector=None):
+    """
+    Treina o detector escolhido (ver detectores.DETECTORES) com os pixels de treino
+    normalizados; sem detector, usa o autoencoder se houver TensorFlow. Se o detector
+    não estiver disponível ou o treino falhar, recorre ao Z-score. Retorna um
+    dicionário com o 'metodo' e os parâmetros treinados.
+    """
+    nome = detector or detector_padrao()
+    escolhido = obter_detector(nome)
+
+    if escolhido.disponivel():
+        try:
+            print(f"Usando detector '{nome}' para detecção...")
+            return escolhido.treinar(x_train)
+        except Exception as e:
+            if nome == 'zscore':
+                raise
+            print(f"Erro no detector '{nome}', usando método simplificado: {e}")
+    else:
+        print(f"Detector '{nome}' não disponível, usando método simplificado")
+
+    # Método simplificado
     print("Usando método simplificado de detecção de anomalias...")
+    return obter_detector('zscore').treinar(x_train)
 
-    # Calcula média e desvio padrão dos dados de treino
-    media_treino = np.mean(dados_treino, axis=0)
-    std_treino = np.std(dados_treino, axis=0)
 
-    # Evita divisão por zero
-    std_treino[std_treino == 0] = 1e-8
+def criar_pontuador(modelo):
+    """Retorna uma função que calcula o escore de anomalia de um bloco de pixels normalizados"""
+    return obter_detector(modelo['metodo']).criar_pontuador(modelo)
 
-    # Calcula Z-score para dados de análise
-    z_scores = np.abs((dados_analise - media_treino) / std_treino)
 
-    # Média do Z-score por pixel
-    anomalias = np.mean(z_scores, axis=1)
+def obter_modelo(caminho_hdr_treino, cache_modelos=None, max_pixels_treino=None, detector=None,
+                 modelo_incremental=None):
+    """
+    Retorna (scaler, modelo) treinados com o arquivo de treino (ou a lista de arquivos).
+    Com um cache de modelos, um treino idêntico já feito (mesmo conteúdo, mesma
+    descrição) é reutilizado sem carregar o cubo de treino.
+
+    Com max_pixels_treino, o treino usa uma amostra de tamanho fixo sorteada em
+    streaming (ver amostrar_pixels_treino) em vez de todos os pixels válidos.
+    detector escolhe o detector registrado (ex: 'autoencoder', 'zscore', 'rx').
+
+    Com modelo_incremental (ModeloIncremental), o cache não é usado: o modelo é o da
+    versão atual, atualizado com os arquivos de treino que ainda não fazem parte dele
+    (ver atualizar_modelo_incremental).
+    """
+    caminhos_treino = lista_treinos(caminho_hdr_treino)
+    if modelo_incremental:
+        return atualizar_modelo_incremental(modelo_incremental, caminhos_treino, max_pixels_treino, detector)
+
+    descricao = descricao_treinamento(max_pixels_treino, detector)
+    with metricas.Fases('treino', treino=nomes_treino(caminhos_treino), detector=descricao['metodo']) as fases:
+        chave = None
+        if cache_modelos:
+            fases.iniciar('cache')
+            chave = cache_modelos.chave(caminho_hdr_treino, descricao)
+            entrada = cache_modelos.carregar(chave)
+            if entrada:
+                print(f"Modelo reutilizado do cache ({entrada[1]['metodo']}): {chave}")
+                return entrada
+
+        fases.iniciar('carregar')
+        if max_pixels_treino:
+            print(f"Amostrando até {max_pixels_treino} pixels de treino de: {nomes_treino(caminhos_treino)}")
+            dados_treino_validos, total_validos = amostrar_pixels_treino(caminhos_treino, max_pixels_treino)
+            print(f"Amostra de {len(dados_treino_validos)} de {total_validos} pixels válidos")
+        else:
+            dados_treino_validos = carregar_pixels_treino(caminhos_treino)
 
-    return anomalias
+        # Normalização
+        fases.iniciar('normalizar')
+        scaler = dependencias.carregar('sklearn.preprocessing').MinMaxScaler()
+        x_train = scaler.fit_transform(dados_treino_validos)
+        print(f"Dados de treino preparados: {len(x_train)} pixels")
 
+        fases.iniciar('treinar')
+        modelo = treinar_modelo(x_train, descricao['metodo'])
 
-def criar_modelo_autoencoder(num_bands):
-    """Cria modelo autoencoder sem warnings"""
-    model = keras.Sequential()
-    model.add(keras.layers.Input(shape=(num_bands,)))
-    model.add(keras.layers.Dense(64, activation='relu'))
-    model.add(keras.layers.Dense(32, activation='relu'))
-    model.add(keras.layers.Dense(16, activation='relu'))
-    model.add(keras.layers.Dense(32, activation='relu'))
-    model.add(keras.layers.Dense(64, activation='relu'))
-    model.add(keras.layers.Dense(num_bands, activation='sigmoid'))
+        # Um fallback para o Z-score (detector indisponível ou com erro) não é guardado com a chave do detector
+        if cache_modelos and modelo['metodo'] == descricao['metodo']:
+            fases.iniciar('salvar_cache')
+            cache_modelos.salvar(chave, scaler, modelo, descricao)
 
-    model.compile(optimizer='adam', loss='mse')
-    return model
+        return scaler, modelo
 
 
-def treinar_e_detectar_anomalias(caminho_hdr_treino, caminho_hdr_analise, caminho_saida_tif, caminho_saida_png):
+def atualizar_modelo_incremental(modelo_incremental, caminhos_treino, max_pixels_treino=None, detector=None):
     """
-    Versão MODIFICADA: Usa TensorFlow se disponível, caso contrário usa método simplificado
+    Retorna (scaler, modelo) da versão atual do modelo incremental, depois de incluir
+    os arquivos de treino novos ou regravados. Sem versão (ou com outro detector), o
+    modelo é treinado do zero com todos os arquivos; senão só os pixels dos arquivos
+    novos são lidos e o modelo atual é atualizado com eles mais a amostra de reposição.
+    """
+    metodo = detector or detector_padrao()
+    atual = modelo_incremental.carregar()
+    completo = atual is None or atual[1]['metodo'] != metodo
+    novos = modelo_incremental.pendentes(caminhos_treino, desde_inicio=completo)
+    if not novos:
+        if atual is None:
+            raise ValueError(f"Nenhum arquivo de treino para o modelo incremental: {nomes_treino(caminhos_treino)}")
+        return atual
+
+    with metricas.Fases('treino_incremental', treino=nomes_treino(novos), detector=metodo,
+                        tipo='completo' if completo else 'incremental') as fases:
+        fases.iniciar('carregar')
+        if max_pixels_treino:
+            print(f"Amostrando até {max_pixels_treino} pixels de treino de: {nomes_treino(novos)}")
+            pixels, total_validos = amostrar_pixels_treino(novos, max_pixels_treino)
+        else:
+            pixels = carregar_pixels_treino(novos)
+            total_validos = len(pixels)
+
+        if not completo:
+            fases.iniciar('atualizar')
+            return modelo_incremental.atualizar(novos, pixels, total_validos)
+
+        fases.iniciar('normalizar')
+        scaler = dependencias.carregar('sklearn.preprocessing').MinMaxScaler()
+        x_train = scaler.fit_transform(pixels)
+
+        fases.iniciar('treinar')
+        modelo = treinar_modelo(x_train, metodo)
+
+        fases.iniciar('salvar')
+        return modelo_incremental.criar(novos, pixels, total_validos, scaler, modelo)
+
+
+def detectar_em_tiles(caminho_hdr_analise, scaler, pontuar, pixels_por_tile=65536, estimador=None, fases=None):
+    """
+    Percorre o cubo de análise (memmap ou HDF5) em tiles de pixels, aplicando
+    normalização -> modelo -> erro a cada tile e escrevendo os escores direto num
+    mapa float32 pré-alocado. O pico de memória depende do tamanho do tile, não da cena.
+    Com estimador (estatisticas.EstimadorQuantis), cada tile do mapa também é contado nele.
+    Com fases (metricas.Fases), os tempos de leitura, normalização e predição somados
+    sobre os tiles são registrados como fases da detecção.
+    Retorna o mapa (linhas, amostras) e o número de pixels válidos.
+    """
+    metadados = cubo_envi.ler_metadados(caminho_hdr_analise)
+    h_a, w_a = metadados['linhas'], metadados['amostras']
+    mapa = np.zeros(h_a * w_a, dtype=np.float32)
+    total_validos = 0
+    cronometro = metricas.Cronometro()
+
+    for inicio, bloco in cubo_envi.iterar_blocos_de_pixels(caminho_hdr_analise, pixels_por_tile, metadados):
+        cronometro.marcar('carregar')
+        tile = mapa[inicio:inicio + len(bloco)]
+        mascara = mascara_pixels_validos(bloco)
+        if mascara.any():
+            normalizados = scaler.transform(bloco[mascara])
+            cronometro.marcar('normalizar')
+            tile[mascara] = pontuar(normalizados)
+            total_validos += int(mascara.sum())
+            cronometro.marcar('prever')
+
+        # Pixels inválidos ficam com 0 no mapa e também entram nos percentis
+        if estimador is not None:
+            estimador.adicionar(tile)
+            cronometro.marcar('percentis')
+
+    if fases is not None:
+        cronometro.registrar(fases)
+    return mapa.reshape((h_a, w_a)), total_validos
+
+
+def treinar_e_detectar_anomalias(caminho_hdr_treino, caminho_hdr_analise, caminho_saida_tif, caminho_saida_png,
+                                 modo_tiles=False, pixels_por_tile=65536, cache_modelos=None,
+                                 max_pixels_treino=None, detector=None, opcoes_piramide=None,
+                                 modelo_incremental=None):
+    """
+    Versão MODIFICADA: Usa TensorFlow se disponível, caso contrário usa método simplificado.
+    Retorna True se os resultados foram gerados e False em caso de erro.
+
+    Com modo_tiles=True o cubo de análise não é carregado: ele é lido como memmap
+    em tiles de pixels_por_tile pixels (ver detectar_em_tiles).
+
+    Com cache_modelos (CacheModelos), o scaler e o modelo treinados são reaproveitados
+    entre cenas e execuções enquanto o arquivo de treino não mudar.
+
+    caminho_hdr_treino pode ser uma lista de arquivos; com max_pixels_treino o treino
+    usa uma amostra de tamanho fixo desses arquivos.
+
+    detector escolhe o detector por execução: 'autoencoder', 'zscore' ou 'rx' (Mahalanobis);
+    None usa o autoencoder quando há TensorFlow e o Z-score caso contrário.
+
+    Com opcoes_piramide (dicionário, ex: {'tamanho_tile': 256, 'formato': 'png'}), o mapa
+    também é gravado como pirâmide de tiles em <nome>_anomalias_tiles (ver piramide.py).
+
+    Com modelo_incremental (ModeloIncremental), os arquivos de treino novos atualizam o
+    modelo atual em vez de um novo treino do zero (ver atualizar_modelo_incremental).
     """
     try:
-        # Verifica dependências mínimas
-        if not all([SPECTRAL_AVAILABLE, SKLEARN_AVAILABLE, MATPLOTLIB_AVAILABLE]):
-            print("Bibliotecas essenciais não disponíveis. Verifique a instalação.")
-            return
+        # Verifica só as dependências que o leitor de cada cubo usado realmente precisa
+        necessarias = {'sklearn'}
+        for caminho in lista_treinos(caminho_hdr_treino) + [caminho_hdr_analise]:
+            necessarias.update(cubo_envi.dependencias_leitura(caminho))
+        faltando = sorted(nome for nome in necessarias if not dependencias.disponivel(nome))
+        if faltando:
+            print(f"Bibliotecas essenciais não disponíveis ({', '.join(faltando)}). Verifique a instalação.")
+            return False
 
         # --- 1. PREPARAÇÃO DOS DADOS ---
         print("--- Fase de Preparação de Dados ---")
-        print(f"Carregando dados de treinamento: '{caminho_hdr_treino}'")
-        img_treino = carregar_dados_hdr(caminho_hdr_treino)
-        h_t, w_t, num_bands = img_treino.shape
-        dados_pixels_treino = img_treino.reshape((h_t * w_t, num_bands))
-
-        print(f"Carregando dados de análise: '{caminho_hdr_analise}'")
-        img_analise = carregar_dados_hdr(caminho_hdr_analise)
-        h_a, w_a, _ = img_analise.shape
-        dados_pixels_analise = img_analise.reshape((h_a * w_a, num_bands))
+        scaler, modelo = obter_modelo(caminho_hdr_treino, cache_modelos, max_pixels_treino, detector,
+                                      modelo_incremental)
+        detectar_e_salvar(scaler, modelo, caminho_hdr_analise, caminho_saida_tif, caminho_saida_png,
+                          modo_tiles, pixels_por_tile, opcoes_piramide)
 
-        # Processa dados válidos
-        nodata_val = -9999
-        mask_validos_treino = (dados_pixels_treino != nodata_val).all(axis=1) & (dados_pixels_treino.sum(axis=1) > 0)
-        mask_validos_analise = (dados_pixels_analise != nodata_val).all(axis=1) & (dados_pixels_analise.sum(axis=1) > 0)
+        print("\nProcesso concluído com sucesso!")
+        return True
 
-        dados_treino_validos = dados_pixels_treino[mask_validos_treino]
-        dados_analise_validos = dados_pixels_analise[mask_validos_analise]
+    except Exception as e:
+        print(f"Erro no processamento: {e}")
+        return False
 
-        # Normalização
-        scaler = MinMaxScaler()
-        x_train = scaler.fit_transform(dados_treino_validos)
-        dados_analise_normalizados = scaler.transform(dados_analise_validos)
 
-        print(f"Dados preparados: Treino={len(x_train)}, Análise={len(dados_analise_validos)}")
+def detectar_e_salvar(scaler, modelo, caminho_hdr_analise, caminho_saida_tif, caminho_saida_png,
+                      modo_tiles=False, pixels_por_tile=65536, opcoes_piramide=None):
+    """
+    Fases de detecção e gravação com um scaler e modelo já treinados: pontua o cubo
+    de análise e grava o PNG e o GeoTIFF (ou .npy sem rasterio), mais a pirâmide de
+    tiles se opcoes_piramide não for None. Retorna o mapa de anomalias gravado
+    (float32). Erros são propagados.
+    """
+    with metricas.Fases('deteccao', cena=os.path.basename(caminho_hdr_analise)) as fases:
+        num_bands = scaler.n_features_in_
+
+        if not modo_tiles:
+            fases.iniciar('carregar')
+            print(f"Carregando dados de análise: '{caminho_hdr_analise}'")
+            img_analise = carregar_dados_hdr(caminho_hdr_analise)
+            h_a, w_a, _ = img_analise.shape
+            dados_pixels_analise = img_analise.reshape((h_a * w_a, num_bands))
+
+            mask_validos_analise = mascara_pixels_validos(dados_pixels_analise)
+            dados_analise_validos = dados_pixels_analise[mask_validos_analise]
+            fases.iniciar('normalizar')
+            dados_analise_normalizados = scaler.transform(dados_analise_validos)
+
+            print(f"Dados de análise preparados: {len(dados_analise_validos)} pixels")
+        else:
+            print(f"Análise em tiles de {pixels_por_tile} pixels")
 
         # --- 2. DETECÇÃO DE ANOMALIAS ---
         print("\n--- Fase de Detecção de Anomalias ---")
+        pontuar = criar_pontuador(modelo)
+        estimador = estatisticas.EstimadorQuantis()
 
-        if TENSORFLOW_AVAILABLE:
-            try:
-                # Método com Autoencoder (TensorFlow)
-                print("Usando Autoencoder (TensorFlow) para detecção...")
-                autoencoder = criar_modelo_autoencoder(num_bands)
+        # --- 3. PROCESSAMENTO DOS RESULTADOS ---
+        if modo_tiles:
+            print(f"Analisando em tiles: '{caminho_hdr_analise}'")
+            mapa_anomalia_final, total_validos = detectar_em_tiles(caminho_hdr_analise, scaler, pontuar,
+                                                                   pixels_por_tile, estimador, fases)
+            h_a, w_a = mapa_anomalia_final.shape
+            print(f"Pixels válidos analisados: {total_validos}")
+        else:
+            fases.iniciar('prever')
+            mse_erro = pontuar(dados_analise_normalizados)
 
-                # Treinamento rápido
-                autoencoder.fit(x_train, x_train, epochs=10, batch_size=256, shuffle=True, verbose=0)
+            print("Processando resultados...")
+            mapa_anomalia_final = np.full(h_a * w_a, 0.0)
+            mapa_anomalia_final[mask_validos_analise] = mse_erro
+            mapa_anomalia_final = mapa_anomalia_final.reshape((h_a, w_a))
+            estimador.adicionar(mapa_anomalia_final)
 
-                # Predição
-                pixels_reconstruidos = autoencoder.predict(dados_analise_normalizados, verbose=0)
-                mse_erro = np.mean(np.power(dados_analise_normalizados - pixels_reconstruidos, 2), axis=1)
+        salvar_resultados_deteccao(mapa_anomalia_final, estimador, caminho_hdr_analise, caminho_saida_tif,
+                                   caminho_saida_png, fases, opcoes_piramide)
+        return mapa_anomalia_final.astype(np.float32, copy=False)
 
-            except Exception as e:
-                print(f"Erro no TensorFlow, usando método simplificado: {e}")
-                mse_erro = detectar_anomalias_simples(x_train, dados_analise_normalizados)
-        else:
-            # Método simplificado
-            mse_erro = detectar_anomalias_simples(x_train, dados_analise_normalizados)
 
-        # --- 3. PROCESSAMENTO DOS RESULTADOS ---
-        print("Processando resultados...")
-        mapa_anomalia_final = np.full(h_a * w_a, 0.0)
-        mapa_anomalia_final[mask_validos_analise] = mse_erro
-        mapa_anomalia_final = mapa_anomalia_final.reshape((h_a, w_a))
-
-        # Normalização para visualização
-        vmax = np.percentile(mapa_anomalia_final, 98)
-        mapa_anomalia_norm = np.clip(mapa_anomalia_final, 0, vmax) / vmax
-
-        # --- 4. SALVANDO RESULTADOS ---
-        print("\n--- Salvando Resultados ---")
-
-        # Salva PNG
-        fig = plt.figure(figsize=(12, 8))
-        fig.patch.set_alpha(0)  # Fundo transparente
-        ax = plt.Axes(fig, [0., 0., 1., 1.])
-        ax.set_axis_off()
-        fig.add_axes(ax)
-        ax.imshow(mapa_anomalia_norm, cmap='jet')
-        plt.savefig(caminho_saida_png, bbox_inches='tight', pad_inches=0, dpi=150, transparent=True)
-        plt.close(fig)
-        print(f"Visualização PNG salva em: '{caminho_saida_png}'")
-
-        # Tenta salvar GeoTIFF se rasterio disponível
-        if RASTERIO_AVAILABLE:
-            try:
+def salvar_resultados_deteccao(mapa_anomalia_final, estimador, caminho_hdr_analise, caminho_saida_tif,
+                               caminho_saida_png, fases, opcoes_piramide=None):
+    """
+    Grava o mapa de anomalias de uma cena: PNG (contraste pelo percentil 98 do
+    estimador), pirâmide de tiles se opcoes_piramide não for None e GeoTIFF (ou .npy
+    sem rasterio). Cada gravação é cronometrada como uma fase de fases (metricas.Fases).
+    """
+    h_a, w_a = mapa_anomalia_final.shape
+
+    # Normalização para visualização (percentil do histograma acumulado na detecção)
+    vmax = estimador.quantil(98)
+    mapa_anomalia_norm = np.clip(mapa_anomalia_final, 0, vmax) / vmax
+
+    # --- 4. SALVANDO RESULTADOS ---
+    print("\n--- Salvando Resultados ---")
+    fases.iniciar('gravar')
+
+    # Salva PNG (um pixel por pixel da cena, colormap jet)
+    renderizar.salvar_colormap_png(mapa_anomalia_norm, caminho_saida_png, 'jet')
+    print(f"Visualização PNG salva em: '{caminho_saida_png}'")
+
+    if opcoes_piramide is not None:
+        fases.iniciar('piramide')
+        piramide.gravar_piramide(mapa_anomalia_norm, piramide.pasta_piramide(caminho_saida_png),
+                                 piramide.colorir_colormap('jet'), **opcoes_piramide)
+
+    # Tenta salvar GeoTIFF se rasterio disponível
+    fases.iniciar('geotiff')
+    if RASTERIO_AVAILABLE:
+        try:
+            rasterio = dependencias.carregar('rasterio')
+
+            # Cubos HDF5 não carregam georreferenciamento: o GeoTIFF sai sem CRS
+            transform, crs = None, None
+            if not cubo_envi.eh_hdf5(caminho_hdr_analise):
                 caminho_raw_analise = caminho_hdr_analise.replace('.hdr', '.raw')
                 with rasterio.open(caminho_raw_analise) as src_ref:
                     transform = src_ref.transform
                     crs = src_ref.crs
 
-                with rasterio.open(
-                        caminho_saida_tif, 'w', driver='GTiff',
-                        height=h_a, width=w_a, count=1, dtype=rasterio.float32,
-                        crs=crs, transform=transform
-                ) as dst:
-                    dst.write(mapa_anomalia_final.astype(rasterio.float32), 1)
-                print(f"Mapa GeoTIFF salvo em: '{caminho_saida_tif}'")
-            except Exception as e:
-                print(f"Erro ao salvar GeoTIFF: {e}")
-        else:
-            # Salva como numpy array se rasterio não disponível
-            caminho_npy = caminho_saida_tif.replace('.tif', '.npy')
-            np.save(caminho_npy, mapa_anomalia_final)
-            print(f"Dados de anomalias salvos como numpy array: '{caminho_npy}'")
-
-        print("\nProcesso concluído com sucesso!")
-
-    except Exception as e:
-        print(f"Erro no processamento: {e}")
-
-
-def selecionar_melhor_treino(pasta_treino):
+            with rasterio.open(
+                    caminho_saida_tif, 'w', driver='GTiff',
+                    height=h_a, width=w_a, count=1, dtype=rasterio.float32,
+                    crs=crs, transform=transform
+            ) as dst:
+                dst.write(mapa_anomalia_final.astype(rasterio.float32), 1)
+            print(f"Mapa GeoTIFF salvo em: '{caminho_saida_tif}'")
+        except Exception as e:
+            print(f"Erro ao salvar GeoTIFF: {e}")
+    else:
+        # Salva como numpy array se rasterio não disponível
+        caminho_npy = caminho_saida_tif.replace('.tif', '.npy')
+        np.save(caminho_npy, mapa_anomalia_final)
+        print(f"Dados de anomalias salvos como numpy array: '{caminho_npy}'")
+
+
+def selecionar_melhor_treino(pasta_treino, usar_todos=False, caminho_analise=None):
     """
     Seleciona o melhor arquivo para treino da pasta de treino
-    Pode ser expandido para lógica mais sofisticada
+    Com usar_todos=True retorna a lista de todos os arquivos de treino
+    Com caminho_analise, retorna o cubo de treino mais parecido com a cena, pelo
+    resumo espectral guardado na biblioteca de treino (ver biblioteca_treino.py);
+    sem ele, o primeiro arquivo
     """
-    arquivos_treino = glob.glob(os.path.join(pasta_treino, "*.hdr"))
+    arquivos_treino = cubo_envi.listar_cubos(pasta_treino)
 
     if not arquivos_treino:
         return None
 
-    # Por enquanto, retorna o primeiro arquivo
-    # Você pode adicionar lógica para selecionar o "melhor" arquivo
+    if usar_todos:
+        return sorted(arquivos_treino)
+
+    if caminho_analise is not None and len(arquivos_treino) > 1:
+        try:
+            biblioteca = BibliotecaTreino(pasta_treino)
+            biblioteca.atualizar()
+            proximos = biblioteca.mais_proximos(resumir_cubo(caminho_analise))
+            if proximos:
+                caminho_treino, distancia = proximos[0]
+                print(f"Treino mais parecido com {os.path.basename(caminho_analise)}: "
+                      f"{os.path.basename(caminho_treino)} (distância {distancia:.3f})")
+                return caminho_treino
+        except Exception as e:
+            print(f"Aviso: não foi possível comparar a cena com a biblioteca de treino: {e}")
+
     return arquivos_treino[0]
 
 
-def processar_arquivo_analise(caminho_hdr_analise, pasta_saida, caminho_hdr_treino):
-    """Processa um arquivo de análise usando um arquivo de treino específico"""
-    try:
-        if not os.path.exists(caminho_hdr_analise):
-            print(f"Arquivo .hdr não encontrado: {caminho_hdr_analise}")
-            return False
+def verificar_arquivos_analise(caminho_hdr_analise, caminho_hdr_treino):
+    """Confere se a cena e os arquivos de treino existem; retorna o arquivo de dados da cena ou None"""
+    if not os.path.exists(caminho_hdr_analise):
+        print(f"Arquivo .hdr não encontrado: {caminho_hdr_analise}")
+        return None
 
-        # Verifica arquivo .raw correspondente
-        caminho_raw = caminho_hdr_analise.replace('.hdr', '.raw')
-        if not os.path.exists(caminho_raw):
-            print(f"Arquivo .raw não encontrado: {caminho_raw}")
-            return False
+    # Verifica arquivo .raw correspondente (para cubos .h5 é o próprio arquivo)
+    caminho_raw = cubo_envi.arquivo_dados(caminho_hdr_analise)
+    if not os.path.exists(caminho_raw):
+        print(f"Arquivo .raw não encontrado: {caminho_raw}")
+        return None
+
+    # Verifica arquivo(s) de treino
+    for caminho_treino in lista_treinos(caminho_hdr_treino):
+        if not os.path.exists(caminho_treino):
+            print(f"Arquivo de treino não encontrado: {caminho_treino}")
+            return None
+    return caminho_raw
 
-        # Verifica arquivo de treino
-        if not os.path.exists(caminho_hdr_treino):
-            print(f"Arquivo de treino não encontrado: {caminho_hdr_treino}")
+
+def nomes_saida_analise(caminho_hdr_analise, pasta_saida):
+    """Caminhos do GeoTIFF e do PNG de anomalias de uma cena"""
+    nome_base = os.path.splitext(os.path.basename(caminho_hdr_analise))[0]
+    return (os.path.join(pasta_saida, f"{nome_base}_anomalias.tif"),
+            os.path.join(pasta_saida, f"{nome_base}_anomalias.png"))
+
+
+def processar_arquivo_analise(caminho_hdr_analise, pasta_saida, caminho_hdr_treino, registro=None,
+                              opcoes_deteccao=None):
+    """
+    Processa um arquivo de análise usando um arquivo de treino específico.
+    Com um registro persistente, cenas já processadas (e inalteradas) são puladas.
+    opcoes_deteccao é repassado para treinar_e_detectar_anomalias (ex: modo_tiles).
+    """
+    try:
+        caminho_raw = verificar_arquivos_analise(caminho_hdr_analise, caminho_hdr_treino)
+        if not caminho_raw:
             return False
 
         # Cria pasta de saída
         os.makedirs(pasta_saida, exist_ok=True)
 
         # Gera nomes de saída
-        nome_base = os.path.splitext(os.path.basename(caminho_hdr_analise))[0]
-        arquivo_tif_saida = os.path.join(pasta_saida, f"{nome_base}_anomalias.tif")
-        arquivo_png_saida = os.path.join(pasta_saida, f"{nome_base}_anomalias.png")
+        arquivo_tif_saida, arquivo_png_saida = nomes_saida_analise(caminho_hdr_analise, pasta_saida)
+
+        # A identidade da cena no registro é a do .raw, que contém os dados
+        if registro and registro.ja_processado(ESTAGIO_DETECCAO, caminho_raw):
+            print(f"Análise já realizada anteriormente: {os.path.basename(caminho_hdr_analise)}")
+            return True
 
         print(f"\n=== PROCESSANDO ANÁLISE: {caminho_hdr_analise} ===")
-        print(f"Usando treino: {os.path.basename(caminho_hdr_treino)}")
+        print(f"Usando treino: {nomes_treino(caminho_hdr_treino)}")
 
-        treinar_e_detectar_anomalias(caminho_hdr_treino, caminho_hdr_analise, arquivo_tif_saida, arquivo_png_saida)
-        return True
+        if registro:
+            registro.marcar_em_andamento(ESTAGIO_DETECCAO, caminho_raw)
+
+        sucesso = treinar_e_detectar_anomalias(caminho_hdr_treino, caminho_hdr_analise, arquivo_tif_saida,
+                                               arquivo_png_saida, **(opcoes_deteccao or {}))
+
+        if registro:
+            if sucesso:
+                registro.marcar_concluido(ESTAGIO_DETECCAO, caminho_raw, [arquivo_png_saida])
+            else:
+                registro.marcar_falha(ESTAGIO_DETECCAO, caminho_raw)
+        return sucesso
 
     except Exception as e:
         print(f"Erro ao processar arquivo de análise: {e}")
         return False
 
 
-def processar_todos_arquivos_analise(pasta_analise, pasta_saida, pasta_treino):
-    """Processa todos os arquivos de análise usando arquivos de treino"""
+# Pixels válidos por lote no modo em lote: uma normalização e um predict por lote, com pixels de várias cenas
+PIXELS_POR_LOTE = 1 << 20
+
+
+class _CenaLote:
+    """Cena em pontuação no modo em lote: caminhos de saída e mapa de escores preenchido lote a lote"""
+
+    def __init__(self, caminho_hdr, caminho_raw, caminho_tif, caminho_png):
+        self.caminho_hdr = caminho_hdr
+        self.caminho_raw = caminho_raw
+        self.caminho_tif = caminho_tif
+        self.caminho_png = caminho_png
+        self.forma = None
+        self.mapa = None
+        self.lida = False
+        self.falhou = False
+
+
+def detectar_em_lote(cenas, scaler, modelo, pixels_por_lote=PIXELS_POR_LOTE, pixels_por_tile=65536,
+                     opcoes_piramide=None, ao_concluir=None):
+    """
+    Pontua várias cenas com o mesmo scaler e modelo. Os pixels válidos de cada cena,
+    lidos em tiles, são copiados para um buffer de pixels_por_lote pixels que, cheio,
+    é normalizado e pontuado de uma vez; os escores voltam para o mapa de cada cena
+    pelas posições guardadas junto com os pixels. Uma cena é gravada (ver
+    salvar_resultados_deteccao) assim que todos os seus pixels foram pontuados, de
+    modo que só as cenas com pixels no buffer ficam em memória.
+
+    cenas é uma lista de _CenaLote; ao_concluir(cena, sucesso) é chamado para cada
+    cena gravada ou com falha de leitura/gravação. Erros do modelo são propagados.
+    """
+    num_bands = scaler.n_features_in_
+    pontuar = criar_pontuador(modelo)
+    buffer = np.empty((pixels_por_lote, num_bands), dtype=np.float32)
+    destinos = []  # (cena, posições no mapa) na ordem dos pixels do buffer
+    ocupados = 0
+    abertas = []
+    fases_lote = metricas.Fases('deteccao_lote', cenas=len(cenas))
+    cronometro = metricas.Cronometro()
+
+    def concluir(cena):
+        sucesso = False
+        if not cena.falhou:
+            try:
+                with metricas.Fases('deteccao', cena=os.path.basename(cena.caminho_hdr)) as fases:
+                    mapa = cena.mapa.reshape(cena.forma)
+                    estimador = estatisticas.EstimadorQuantis()
+                    estimador.adicionar(mapa)
+                    salvar_resultados_deteccao(mapa, estimador, cena.caminho_hdr, cena.caminho_tif,
+                                               cena.caminho_png, fases, opcoes_piramide)
+                sucesso = True
+            except Exception as e:
+                print(f"Erro ao salvar resultados de {cena.caminho_hdr}: {e}")
+        cena.mapa = None
+        cronometro.marcar('gravar')
+        if ao_concluir:
+            ao_concluir(cena, sucesso)
+
+    def pontuar_lote():
+        nonlocal ocupados
+        if ocupados:
+            normalizados = scaler.transform(buffer[:ocupados])
+            cronometro.marcar('normalizar')
+            escores = pontuar(normalizados)
+            cronometro.marcar('prever')
+            inicio = 0
+            for cena, posicoes in destinos:
+                cena.mapa[posicoes] = escores[inicio:inicio + len(posicoes)]
+                inicio += len(posicoes)
+            cronometro.marcar('distribuir')
+            print(f"Lote de {ocupados} pixels pontuado ({len({id(c) for c, _ in destinos})} cenas)")
+        destinos.clear()
+        ocupados = 0
+
+        # As cenas já lidas por completo têm agora todos os escores no mapa
+        for cena in [c for c in abertas if c.lida]:
+            abertas.remove(cena)
+            concluir(cena)
+
+    for cena in cenas:
+        print(f"Lendo cena: {os.path.basename(cena.caminho_hdr)}")
+        abertas.append(cena)
+        try:
+            metadados = cubo_envi.ler_metadados(cena.caminho_hdr)
+            if metadados['bandas'] != num_bands:
+                raise ValueError(f"a cena tem {metadados['bandas']} bandas e o modelo, {num_bands}")
+            cena.forma = (metadados['linhas'], metadados['amostras'])
+            cena.mapa = np.zeros(metadados['linhas'] * metadados['amostras'], dtype=np.float32)
+
+            cronometro.marcar('carregar')
+            for inicio, bloco in cubo_envi.iterar_blocos_de_pixels(cena.caminho_hdr, pixels_por_tile, metadados):
+                mascara = mascara_pixels_validos(bloco)
+                validos = bloco[mascara]
+                posicoes = inicio + np.flatnonzero(mascara)
+                # Um tile pode completar o lote e continuar no próximo
+                while len(validos):
+                    n = min(len(validos), pixels_por_lote - ocupados)
+                    buffer[ocupados:ocupados + n] = validos[:n]
+                    destinos.append((cena, posicoes[:n]))
+                    ocupados += n
+                    validos, posicoes = validos[n:], posicoes[n:]
+                    if ocupados == pixels_por_lote:
+                        cronometro.marcar('carregar')
+                        pontuar_lote()
+                cronometro.marcar('carregar')
+        except Exception as e:
+            print(f"Erro ao ler a cena {cena.caminho_hdr}: {e}")
+            cena.falhou = True
+        cena.lida = True
+
+    pontuar_lote()
+    cronometro.registrar(fases_lote)
+    fases_lote.concluir()
+
+
+def processar_em_lote(arquivos_analise, pasta_saida, caminho_hdr_treino, registro=None, opcoes_deteccao=None,
+                      pixels_por_lote=PIXELS_POR_LOTE, threads_intra=None, threads_inter=None):
+    """
+    Modo em lote de processar_todos_arquivos_analise: treina (ou reutiliza do cache)
+    um único modelo e pontua todas as cenas pendentes com detectar_em_lote, em lotes
+    grandes que ocupam todos os núcleos. Com TensorFlow, os threads são configurados
+    antes do primeiro treino (ver detectores.configurar_threads_tensorflow).
+
+    opcoes_deteccao são as mesmas do modo por cena (modo_tiles é ignorado: o modo em
+    lote sempre lê as cenas em tiles). Retorna as cenas que não chegaram a ser
+    pontuadas (ex: erro no modelo), para serem processadas uma a uma.
+    """
+    opcoes = dict(opcoes_deteccao or {})
+    if TENSORFLOW_AVAILABLE and opcoes.get('detector') in (None, 'autoencoder'):
+        configurar_threads_tensorflow(threads_intra, threads_inter)
+
+    os.makedirs(pasta_saida, exist_ok=True)
+    cenas = []
+    for caminho_hdr in arquivos_analise:
+        caminho_raw = verificar_arquivos_analise(caminho_hdr, caminho_hdr_treino)
+        if not caminho_raw:
+            continue
+        if registro and registro.ja_processado(ESTAGIO_DETECCAO, caminho_raw):
+            print(f"Análise já realizada anteriormente: {os.path.basename(caminho_hdr)}")
+            continue
+        cenas.append(_CenaLote(caminho_hdr, caminho_raw, *nomes_saida_analise(caminho_hdr, pasta_saida)))
+
+    if not cenas:
+        return []
+
+    concluidas = set()
+
+    def ao_concluir(cena, sucesso):
+        concluidas.add(cena.caminho_hdr)
+        print(f"{'Concluída' if sucesso else 'Falha na'} análise: {os.path.basename(cena.caminho_hdr)}")
+        if registro:
+            if sucesso:
+                registro.marcar_concluido(ESTAGIO_DETECCAO, cena.caminho_raw, [cena.caminho_png])
+            else:
+                registro.marcar_falha(ESTAGIO_DETECCAO, cena.caminho_raw)
+
+    print(f"\n=== MODO EM LOTE: {len(cenas)} cenas, lotes de {pixels_por_lote} pixels ===")
+    try:
+        scaler, modelo = obter_modelo(caminho_hdr_treino, opcoes.get('cache_modelos'),
+                                      opcoes.get('max_pixels_treino'), opcoes.get('detector'),
+                                      opcoes.get('modelo_incremental'))
+        if registro:
+            for cena in cenas:
+                registro.marcar_em_andamento(ESTAGIO_DETECCAO, cena.caminho_raw)
+        detectar_em_lote(cenas, scaler, modelo, pixels_por_lote, opcoes.get('pixels_por_tile', 65536),
+                         opcoes.get('opcoes_piramide'), ao_concluir)
+    except Exception as e:
+        print(f"Erro no modo em lote, processando as cenas restantes uma a uma: {e}")
+
+    return [cena.caminho_hdr for cena in cenas if cena.caminho_hdr not in concluidas]
+
+
+def processar_todos_arquivos_analise(pasta_analise, pasta_saida, pasta_treino, registro=None, opcoes_deteccao=None,
+                                     usar_todos_treinos=False, opcoes_lote=None):
+    """
+    Processa todos os arquivos de análise usando arquivos de treino.
+    Sem usar_todos_treinos, cada cena usa o cubo de treino mais parecido com ela
+    (ver selecionar_melhor_treino) e as cenas são agrupadas por treino.
+    Com opcoes_lote (dicionário, ex: {'pixels_por_lote': 1 << 20}), as cenas são
+    pontuadas juntas em lotes grandes por um único modelo (ver processar_em_lote).
+    """
     print("=== PROCESSANDO ARQUIVOS DE ANÁLISE ===")
 
-    # Seleciona o melhor arquivo para treino
-    caminho_hdr_treino = selecionar_melhor_treino(pasta_treino)
+    # Seleciona o melhor arquivo para treino (ou todos, com usar_todos_treinos)
+    caminho_hdr_treino = selecionar_melhor_treino(pasta_treino, usar_todos_treinos)
 
     if not caminho_hdr_treino:
         print(f"ERRO: Nenhum arquivo de treino encontrado em: {pasta_treino}")
         return
 
-    print(f"Arquivo de treino selecionado: {os.path.basename(caminho_hdr_treino)}")
+    if usar_todos_treinos:
+        print(f"Arquivo de treino selecionado: {nomes_treino(caminho_hdr_treino)}")
 
     # Processa arquivos de análise
-    arquivos_analise = glob.glob(os.path.join(pasta_analise, "*.hdr"))
+    arquivos_analise = cubo_envi.listar_cubos(pasta_analise)
 
     if not arquivos_analise:
         print(f"Nenhum arquivo de análise encontrado em: {pasta_analise}")
@@ -289,8 +756,21 @@ def processar_todos_arquivos_analise(pasta_analise, pasta_saida, pasta_treino):
 
     print(f"Encontrados {len(arquivos_analise)} arquivos de análise")
 
-    for arquivo_analise in arquivos_analise:
-        processar_arquivo_analise(arquivo_analise, pasta_saida, caminho_hdr_treino)
+    if usar_todos_treinos:
+        grupos = {0: (caminho_hdr_treino, arquivos_analise)}
+    else:
+        grupos = {}
+        for arquivo_analise in arquivos_analise:
+            treino = selecionar_melhor_treino(pasta_treino, False, arquivo_analise)
+            grupos.setdefault(treino, (treino, []))[1].append(arquivo_analise)
+
+    for caminho_hdr_treino, arquivos_grupo in grupos.values():
+        if opcoes_lote is not None:
+            arquivos_grupo = processar_em_lote(arquivos_grupo, pasta_saida, caminho_hdr_treino, registro,
+                                               opcoes_deteccao, **opcoes_lote)
+
+        for arquivo_analise in arquivos_grupo:
+            processar_arquivo_analise(arquivo_analise, pasta_saida, caminho_hdr_treino, registro, opcoes_deteccao)
 
 
 def mover_arquivo_processado(caminho_arquivo, pasta_processados):
@@ -299,95 +779,85 @@ def mover_arquivo_processado(caminho_arquivo, pasta_processados):
         # Cria pasta de processados se não existir
         os.makedirs(pasta_processados, exist_ok=True)
 
-        # Move tanto .hdr quanto .raw
+        # Move .hdr, .raw e o cubo .h5, com seus índices de metadados, quando existirem
         base_name = os.path.splitext(caminho_arquivo)[0]
-        arquivo_hdr = base_name + '.hdr'
-        arquivo_raw = base_name + '.raw'
-
-        if os.path.exists(arquivo_hdr):
-            shutil.move(arquivo_hdr, os.path.join(pasta_processados, os.path.basename(arquivo_hdr)))
-        if os.path.exists(arquivo_raw):
-            shutil.move(arquivo_raw, os.path.join(pasta_processados, os.path.basename(arquivo_raw)))
+        for extensao in ('.hdr', '.raw', '.h5', '.hdr.json', '.h5.json'):
+            arquivo = base_name + extensao
+            if os.path.exists(arquivo):
+                shutil.move(arquivo, os.path.join(pasta_processados, os.path.basename(arquivo)))
 
-        print(f"Arquivo movido para processados: {os.path.basename(arquivo_hdr)}")
+        print(f"Arquivo movido para processados: {os.path.basename(caminho_arquivo)}")
 
     except Exception as e:
         print(f"Erro ao mover arquivo processado: {e}")
 
 
-def monitorar_pasta_analise(pasta_analise, pasta_saida, pasta_treino, pasta_processados, intervalo=10):
+def monitorar_pasta_analise(pasta_analise, pasta_saida, pasta_treino, pasta_processados, intervalo_varredura=300,
+                            registro=None, opcoes_deteccao=None, usar_todos_treinos=False, opcoes_lote=None):
     """
-    Monitora pasta de análise por novos arquivos
+    Monitora pasta de análise por novos arquivos (eventos do watchdog, ver MonitorPasta).
+    opcoes_lote ativa o modo em lote no processamento dos arquivos já existentes.
     """
     print("=== INICIANDO SISTEMA DE DETECÇÃO DE ANOMALIAS ===")
     print(f"Pasta de treino: {pasta_treino}")
     print(f"Pasta de análise: {pasta_analise}")
     print(f"Pasta de saída: {pasta_saida}")
     print(f"Pasta de processados: {pasta_processados}")
-    print(f"Verificando novos arquivos a cada {intervalo} segundos...")
     print("Pressione Ctrl+C para parar\n")
 
     # Processa arquivos existentes primeiro
-    processar_todos_arquivos_analise(pasta_analise, pasta_saida, pasta_treino)
+    processar_todos_arquivos_analise(pasta_analise, pasta_saida, pasta_treino, registro, opcoes_deteccao,
+                                     usar_todos_treinos, opcoes_lote)
 
     # Move arquivos processados
-    arquivos_processados = glob.glob(os.path.join(pasta_analise, "*.hdr"))
+    arquivos_processados = cubo_envi.listar_cubos(pasta_analise)
     for arquivo in arquivos_processados:
         mover_arquivo_processado(arquivo, pasta_processados)
 
-    # Conjunto para rastrear arquivos já processados
-    arquivos_processados_set = set()
-
     print(f"\n=== INICIANDO MONITORAMENTO ===")
     print("Aguardando novos arquivos de análise... (Ctrl+C para parar)")
 
-    # Seleciona arquivo de treino (uma vez só)
-    caminho_hdr_treino = selecionar_melhor_treino(pasta_treino)
+    # Seleciona arquivo de treino (uma vez só; sem usar_todos_treinos, cada cena escolhe o seu)
+    caminho_hdr_treino = selecionar_melhor_treino(pasta_treino, usar_todos_treinos)
 
     if not caminho_hdr_treino:
         print("ERRO: Nenhum arquivo de treino disponível. Monitoramento cancelado.")
         return
 
+    # O modelo incremental acompanha a pasta de treino: ela é relistada a cada cena
+    relistar_treinos = usar_todos_treinos and (opcoes_deteccao or {}).get('modelo_incremental')
+
+    def processar(arquivo_analise):
+        print(f"Novo arquivo de análise detectado: {os.path.basename(arquivo_analise)}")
+        if usar_todos_treinos:
+            treino = selecionar_melhor_treino(pasta_treino, True) if relistar_treinos else caminho_hdr_treino
+        else:
+            treino = selecionar_melhor_treino(pasta_treino, False, arquivo_analise)
+        sucesso = processar_arquivo_analise(arquivo_analise, pasta_saida, treino, registro, opcoes_deteccao)
+        if sucesso:
+            # Move para pasta de processados
+            mover_arquivo_processado(arquivo_analise, pasta_processados)
+        return sucesso
+
     try:
-        while True:
-            # Verifica por novos arquivos na pasta de análise
-            arquivos_atual = set(glob.glob(os.path.join(pasta_analise, "*.hdr")))
-            novos_arquivos = arquivos_atual - arquivos_processados_set
-
-            for arquivo_analise in novos_arquivos:
-                # Verifica se o arquivo .raw correspondente existe
-                arquivo_raw = arquivo_analise.replace('.hdr', '.raw')
-                if os.path.exists(arquivo_raw):
-                    print(f"Novo arquivo de análise detectado: {os.path.basename(arquivo_analise)}")
-
-                    # Processa o arquivo
-                    sucesso = processar_arquivo_analise(arquivo_analise, pasta_saida, caminho_hdr_treino)
-
-                    if sucesso:
-                        # Move para pasta de processados
-                        mover_arquivo_processado(arquivo_analise, pasta_processados)
-                        arquivos_processados_set.add(arquivo_analise)
-                else:
-                    print(f"Aguardando arquivo .raw correspondente para: {arquivo_analise}")
-
-            # Aguarda antes da próxima verificação
-            time.sleep(intervalo)
-
-    except KeyboardInterrupt:
-        print("\nParando monitoramento...")
+        MonitorPasta(pasta_analise, cubo_do_evento, lambda: cubo_envi.listar_cubos(pasta_analise), processar,
+                     pronto=par_completo, arquivos=arquivos_do_cubo,
+                     intervalo_varredura=intervalo_varredura).executar()
     except Exception as e:
         print(f"Erro no monitoramento: {e}")
 
 
-def modo_processamento_unico(pasta_analise, pasta_saida, pasta_treino, pasta_processados):
+def modo_processamento_unico(pasta_analise, pasta_saida, pasta_treino, pasta_processados, registro=None,
+                             opcoes_deteccao=None, usar_todos_treinos=False, opcoes_lote=None):
     """
     Modo único: processa todos os arquivos e termina
     """
     print("=== MODO PROCESSAMENTO ÚNICO ===")
-    processar_todos_arquivos_analise(pasta_analise, pasta_saida, pasta_treino)
+    processar_todos_arquivos_analise(pasta_analise, pasta_saida, pasta_treino, registro, opcoes_deteccao,
+                                     usar_todos_treinos, opcoes_lote)
 
     # Move arquivos processados
-    arquivos_processados = glob.glob(os.path.join(pasta_analise, "*.hdr"))
+    arquivos_processados = cubo_envi.listar_cubos(pasta_analise)
     for arquivo in arquivos_processados:
         mover_arquivo_processado(arquivo, pasta_processados)
 
@@ -401,8 +871,37 @@ if __name__ == '__main__':
     PASTA_ANALISE = 'arquivoRAW'  # Arquivos para processar/análise
     PASTA_SAIDA = 'resultados'  # Resultados do processamento
     PASTA_PROCESSADOS = 'processados'  # Arquivos já processados (movidos da pasta análise)
+    PASTA_CACHE_MODELOS = 'cache_modelos'  # Modelos treinados reutilizados entre cenas e execuções
+    # Ex: 'modelo_incremental' para atualizar o modelo a cada cena nova de PASTA_TREINO em vez de treinar do
+    # zero (versões e rollback em modelo_incremental.py; use com USAR_TODOS_TREINOS = True)
+    PASTA_MODELO_INCREMENTAL = None
+    CAMINHO_REGISTRO = 'registro_processamento.sqlite'  # Registro compartilhado pelas etapas do pipeline
 
     MODO_MONITORAMENTO = True  # True para monitorar continuamente, False para processar uma vez
+    # False usa, para cada cena, o arquivo de treino mais parecido com ela (índice em
+    # PASTA_TREINO/biblioteca_treino.json); True treina um único modelo com todos os arquivos (amostrados)
+    USAR_TODOS_TREINOS = False
+    QUANTIS_EXATOS = False  # True calcula o contraste com np.percentile (validação do histograma)
+    NIVEL_COMPRESSAO_PNG = 4  # zlib 0-9: 1 grava mais rápido, 9 gera PNGs menores
+    PASTA_METRICAS = 'metricas'  # <script>.jsonl (fases e contadores) e <script>.prom (Prometheus); None desativa
+
+    # Opções de detecção
+    OPCOES_DETECCAO = {
+        'modo_tiles': True,  # Lê o cubo de análise em tiles (memmap) em vez de carregá-lo inteiro
+        'pixels_por_tile': 65536,  # Tamanho de cada tile no modo_tiles
+        'cache_modelos': CacheModelos(PASTA_CACHE_MODELOS, max_entradas=5),  # None para treinar a cada cena
+        'max_pixels_treino': 200000,  # Tamanho fixo da amostra de treino; None usa todos os pixels válidos
+        'detector': None,  # 'autoencoder', 'zscore', 'rx' ou None (autoencoder se houver TensorFlow)
+        'modelo_incremental': ModeloIncremental(PASTA_MODELO_INCREMENTAL) if PASTA_MODELO_INCREMENTAL else None,
+        'opcoes_piramide': None,  # Ex: {'tamanho_tile': 256, 'formato': 'png'} para gravar também tiles XYZ
+    }
+
+    # Modo em lote para o acúmulo de cenas já na pasta (None processa uma cena por vez)
+    OPCOES_LOTE = {
+        'pixels_por_lote': 1 << 20,  # Pixels válidos (de várias cenas) normalizados e pontuados de uma vez
+        'threads_intra': None,  # Threads do TensorFlow por operação (None = todos os núcleos)
+        'threads_inter': None,  # Operações do TensorFlow em paralelo (None = 2)
+    }
 
     # Cria diretórios se não existirem
     os.makedirs(PASTA_TREINO, exist_ok=True)
@@ -410,6 +909,15 @@ if __name__ == '__main__':
     os.makedirs(PASTA_SAIDA, exist_ok=True)
     os.makedirs(PASTA_PROCESSADOS, exist_ok=True)
 
+    dependencias.informar_disponiveis({'TensorFlow': 'tensorflow', 'Spectral': 'spectral',
+                                       'Scikit-learn': 'sklearn', 'Rasterio': 'rasterio'})
+
+    dependencias.relatorio_importacoes("Tempo de inicialização")
+    estatisticas.MODO_EXATO = QUANTIS_EXATOS
+    renderizar.NIVEL_COMPRESSAO_PNG = NIVEL_COMPRESSAO_PNG
+    if PASTA_METRICAS:
+        metricas.configurar(PASTA_METRICAS, 'deeplearn')
+
     print("=== CONFIGURAÇÃO DAS PASTAS ===")
     print(f"Treino: {PASTA_TREINO} - Coloque aqui os arquivos de referência 'saudáveis'")
     print(f"Análise: {PASTA_ANALISE} - Coloque aqui os arquivos para processar")
@@ -417,13 +925,22 @@ if __name__ == '__main__':
     print(f"Processados: {PASTA_PROCESSADOS} - Arquivos processados serão movidos para aqui")
     print()
 
+    registro = RegistroProcessamento(CAMINHO_REGISTRO)
+
     try:
         if MODO_MONITORAMENTO:
             # Modo monitoramento contínuo
-            monitorar_pasta_analise(PASTA_ANALISE, PASTA_SAIDA, PASTA_TREINO, PASTA_PROCESSADOS, intervalo=10)
+            monitorar_pasta_analise(PASTA_ANALISE, PASTA_SAIDA, PASTA_TREINO, PASTA_PROCESSADOS,
+                                    intervalo_varredura=300, registro=registro, opcoes_deteccao=OPCOES_DETECCAO,
+                                    usar_todos_treinos=USAR_TODOS_TREINOS, opcoes_lote=OPCOES_LOTE)
         else:
             # Modo processamento único
-            modo_processamento_unico(PASTA_ANALISE, PASTA_SAIDA, PASTA_TREINO, PASTA_PROCESSADOS)
+            modo_processamento_unico(PASTA_ANALISE, PASTA_SAIDA, PASTA_TREINO, PASTA_PROCESSADOS, registro,
+                                     OPCOES_DETECCAO, USAR_TODOS_TREINOS, OPCOES_LOTE)
 
     except Exception as e:
-        print(f"Erro na execução: {e}")
\ No newline at end of file
+        print(f"Erro na execução: {e}")
+    finally:
+        registro.fechar()
+        metricas.exportar(forcar=True)
+        dependencias.relatorio_importacoes("Custo das importações")
\ No newline at end of file
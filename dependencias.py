@@ -0,0 +1,51 @@
+import sys
+import time
+import importlib
+import importlib.util
+
+# Referência para o tempo decorrido (este módulo é importado junto com os módulos do script)
+INICIO = time.perf_counter()
+
+# Módulo -> segundos gastos na primeira importação feita por carregar()
+TEMPOS_IMPORTACAO = {}
+
+
+def disponivel(nome_modulo):
+    """Indica se o módulo está instalado, sem importá-lo"""
+    try:
+        return importlib.util.find_spec(nome_modulo) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def carregar(nome_modulo):
+    """
+    Importa o módulo na primeira vez que um caminho de código precisa dele e
+    registra quanto tempo a importação levou. Chamadas seguintes são só uma busca em sys.modules.
+    """
+    if nome_modulo in sys.modules:
+        return sys.modules[nome_modulo]
+
+    inicio = time.perf_counter()
+    modulo = importlib.import_module(nome_modulo)
+    TEMPOS_IMPORTACAO[nome_modulo] = time.perf_counter() - inicio
+    return modulo
+
+
+def informar_disponiveis(nomes):
+    """Mostra quais dependências opcionais estão instaladas (sem importá-las)"""
+    for nome_exibido, nome_modulo in nomes.items():
+        if disponivel(nome_modulo):
+            print(f"{nome_exibido} disponível (carregado sob demanda)")
+        else:
+            print(f"{nome_exibido} não disponível")
+
+
+def relatorio_importacoes(titulo="Tempo de inicialização"):
+    """Mostra o custo de cada importação feita por carregar() e o tempo decorrido"""
+    print(f"\n=== {titulo.upper()} ===")
+    for nome_modulo, segundos in sorted(TEMPOS_IMPORTACAO.items(), key=lambda item: -item[1]):
+        print(f"  {nome_modulo:<28} {segundos:7.3f} s")
+    if not TEMPOS_IMPORTACAO:
+        print("  Nenhuma dependência pesada carregada")
+    print(f"  {'tempo decorrido':<28} {time.perf_counter() - INICIO:7.3f} s\n")
@@ -0,0 +1,237 @@
+import os
+import abc
+
+import numpy as np
+
+import dependencias
+
+# Detectores registrados por nome (ver registrar_detector)
+DETECTORES = {}
+
+
+def registrar_detector(classe):
+    """Decorador que registra um detector pelo seu nome; o nome é o 'metodo' do modelo treinado"""
+    DETECTORES[classe.nome] = classe()
+    return classe
+
+
+def obter_detector(nome):
+    """Retorna o detector registrado com o nome dado"""
+    if nome not in DETECTORES:
+        raise ValueError(f"Detector desconhecido: {nome} (disponíveis: {', '.join(sorted(DETECTORES))})")
+    return DETECTORES[nome]
+
+
+class Detector(abc.ABC):
+    """
+    Interface dos detectores de anomalia.
+
+    Um detector treina com pixels já normalizados (n, bandas) e produz um modelo:
+    um dicionário com o 'metodo' (nome do detector) e os parâmetros treinados. O
+    pontuador criado a partir do modelo recebe um bloco de pixels normalizados e
+    retorna um escore por pixel (maior = mais anômalo). salvar/carregar gravam o
+    modelo numa pasta do cache de modelos.
+    """
+    nome = None
+
+    def disponivel(self):
+        """Indica se as dependências do detector estão instaladas"""
+        return True
+
+    def descricao(self):
+        """Parâmetros que definem o treino; fazem parte da chave do cache de modelos"""
+        return {}
+
+    @abc.abstractmethod
+    def treinar(self, x_train):
+        """Treina com pixels normalizados (n, bandas) e retorna o modelo"""
+
+    def atualizar(self, modelo, x_train):
+        """
+        Atualiza um modelo já treinado com novos pixels normalizados (ver
+        modelo_incremental.py). Por padrão treina de novo, o que é barato nos
+        detectores de forma fechada (Z-score, RX).
+        """
+        return self.treinar(x_train)
+
+    @abc.abstractmethod
+    def criar_pontuador(self, modelo):
+        """Retorna a função que pontua um bloco de pixels normalizados com o modelo"""
+
+    def salvar(self, modelo, pasta):
+        parametros = {k: v for k, v in modelo.items() if k != 'metodo'}
+        np.savez(os.path.join(pasta, f'{self.nome}.npz'), **parametros)
+
+    def carregar(self, pasta):
+        with np.load(os.path.join(pasta, f'{self.nome}.npz')) as dados:
+            return {'metodo': self.nome, **{k: dados[k] for k in dados.files}}
+
+
+def ajustar_zscore(dados_treino):
+    """Calcula média e desvio padrão por banda dos dados de treino para o método simplificado"""
+    media_treino = np.mean(dados_treino, axis=0)
+    std_treino = np.std(dados_treino, axis=0)
+
+    # Evita divisão por zero
+    std_treino[std_treino == 0] = 1e-8
+
+    return media_treino, std_treino
+
+
+def pontuar_zscore(dados_analise, media_treino, std_treino):
+    """Média do Z-score absoluto por pixel"""
+    z_scores = np.abs((dados_analise - media_treino) / std_treino)
+    return np.mean(z_scores, axis=1)
+
+
+@registrar_detector
+class DetectorZScore(Detector):
+    """Média do Z-score absoluto por banda em relação ao treino"""
+    nome = 'zscore'
+
+    def treinar(self, x_train):
+        media_treino, std_treino = ajustar_zscore(x_train)
+        return {'metodo': self.nome, 'media': media_treino, 'std': std_treino}
+
+    def criar_pontuador(self, modelo):
+        return lambda dados: pontuar_zscore(dados, modelo['media'], modelo['std'])
+
+
+# Regularização relativa da covariância do RX (fração do autovalor médio)
+REGULARIZACAO_RX = 1e-6
+# Pixels por produto matricial na pontuação do RX
+PIXELS_POR_LOTE_RX = 65536
+
+
+@registrar_detector
+class DetectorRX(Detector):
+    """
+    Detector RX (distância de Mahalanobis ao fundo do treino).
+
+    No treino calcula a média e a covariância e guarda uma matriz de branqueamento W
+    (autovetores divididos pela raiz dos autovalores regularizados), tal que
+    (x - média) W W^T (x - média)^T é a distância de Mahalanobis. A pontuação é um
+    produto matricial por lote seguido da soma dos quadrados, sem inverter nada por cena.
+    """
+    nome = 'rx'
+
+    def descricao(self):
+        return {'regularizacao': REGULARIZACAO_RX}
+
+    def treinar(self, x_train):
+        x_train = np.asarray(x_train, dtype=np.float64)
+        media = x_train.mean(axis=0)
+        covariancia = np.cov(x_train - media, rowvar=False)
+
+        autovalores, autovetores = np.linalg.eigh(np.atleast_2d(covariancia))
+        piso = max(autovalores.mean(), 1e-12) * REGULARIZACAO_RX
+        branqueamento = autovetores / np.sqrt(np.maximum(autovalores, 0) + piso)
+
+        return {'metodo': self.nome, 'media': media.astype(np.float32),
+                'branqueamento': branqueamento.astype(np.float32)}
+
+    def criar_pontuador(self, modelo):
+        media = modelo['media']
+        branqueamento = modelo['branqueamento']
+
+        def pontuar(dados):
+            escores = np.empty(len(dados), dtype=np.float32)
+            for inicio in range(0, len(dados), PIXELS_POR_LOTE_RX):
+                lote = np.asarray(dados[inicio:inicio + PIXELS_POR_LOTE_RX], dtype=np.float32) - media
+                projetado = lote @ branqueamento
+                escores[inicio:inicio + len(lote)] = np.einsum('ij,ij->i', projetado, projetado)
+            return escores
+
+        return pontuar
+
+
+# Camadas ocultas do autoencoder e parâmetros de treino (fazem parte da chave do cache de modelos)
+ARQUITETURA_AUTOENCODER = (64, 32, 16, 32, 64)
+EPOCAS_TREINO = 10
+BATCH_TREINO = 256
+# Épocas de uma atualização incremental, que parte dos pesos já treinados
+EPOCAS_INCREMENTAIS = 3
+# Pixels por passo do predict; o padrão do Keras (32) deixa o tempo dominado pelo custo de cada passo
+BATCH_PREDICAO = 8192
+
+
+def configurar_threads_tensorflow(threads_intra=None, threads_inter=None):
+    """
+    Define os threads do TensorFlow: threads_intra paralelizam cada operação (ex: o
+    produto matricial de um lote grande) e threads_inter executam operações
+    independentes ao mesmo tempo. None usa todos os núcleos em threads_intra e 2 em
+    threads_inter. Só tem efeito antes do primeiro treino ou predict do processo.
+    """
+    tf = dependencias.carregar('tensorflow')
+    threads_intra = threads_intra or os.cpu_count() or 1
+    threads_inter = threads_inter or 2
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads_intra)
+        tf.config.threading.set_inter_op_parallelism_threads(threads_inter)
+        print(f"TensorFlow: {threads_intra} threads por operação, {threads_inter} operações em paralelo")
+    except RuntimeError as e:
+        # O runtime já foi inicializado neste processo
+        print(f"Aviso: não foi possível configurar os threads do TensorFlow: {e}")
+
+
+def criar_modelo_autoencoder(num_bands):
+    """Cria modelo autoencoder sem warnings"""
+    keras = dependencias.carregar('tensorflow').keras
+
+    model = keras.Sequential()
+    model.add(keras.layers.Input(shape=(num_bands,)))
+    for unidades in ARQUITETURA_AUTOENCODER:
+        model.add(keras.layers.Dense(unidades, activation='relu'))
+    model.add(keras.layers.Dense(num_bands, activation='sigmoid'))
+
+    model.compile(optimizer='adam', loss='mse')
+    return model
+
+
+@registrar_detector
+class DetectorAutoencoder(Detector):
+    """Erro de reconstrução (MSE) de um autoencoder denso treinado com os pixels de treino"""
+    nome = 'autoencoder'
+
+    def disponivel(self):
+        try:
+            dependencias.carregar('tensorflow')
+            return True
+        except Exception:
+            return False
+
+    def descricao(self):
+        return {
+            'arquitetura': list(ARQUITETURA_AUTOENCODER),
+            'epocas': EPOCAS_TREINO,
+            'batch_size': BATCH_TREINO,
+        }
+
+    def treinar(self, x_train):
+        autoencoder = criar_modelo_autoencoder(x_train.shape[1])
+        autoencoder.fit(x_train, x_train, epochs=EPOCAS_TREINO, batch_size=BATCH_TREINO, shuffle=True, verbose=0)
+        return {'metodo': self.nome, 'autoencoder': autoencoder}
+
+    def atualizar(self, modelo, x_train):
+        # Continua o treino a partir dos pesos atuais em vez de pesos aleatórios
+        autoencoder = modelo['autoencoder']
+        autoencoder.fit(x_train, x_train, epochs=EPOCAS_INCREMENTAIS, batch_size=BATCH_TREINO, shuffle=True,
+                        verbose=0)
+        return {'metodo': self.nome, 'autoencoder': autoencoder}
+
+    def criar_pontuador(self, modelo):
+        autoencoder = modelo['autoencoder']
+
+        def pontuar(dados):
+            pixels_reconstruidos = autoencoder.predict(dados, batch_size=BATCH_PREDICAO, verbose=0)
+            return np.mean(np.power(dados - pixels_reconstruidos, 2), axis=1)
+
+        return pontuar
+
+    def salvar(self, modelo, pasta):
+        modelo['autoencoder'].save(os.path.join(pasta, 'autoencoder.keras'))
+
+    def carregar(self, pasta):
+        keras = dependencias.carregar('tensorflow').keras
+
+        return {'metodo': self.nome, 'autoencoder': keras.models.load_model(os.path.join(pasta, 'autoencoder.keras'))}
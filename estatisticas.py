@@ -0,0 +1,147 @@
+import numpy as np
+
+# Com MODO_EXATO = True os percentis são calculados com np.percentile (para validação)
+MODO_EXATO = False
+
+# Erro relativo máximo de cada quantil (os bins têm largura proporcional ao valor)
+ERRO_RELATIVO = 2e-4
+
+# Máximo de bins por sinal (com ERRO_RELATIVO, ~180 ordens de grandeza); acima dele os
+# bins de menor magnitude são fundidos
+NUM_BINS_PADRAO = 1 << 20
+
+# Linhas (ou elementos, em arrays 1D) consumidas por vez pela função percentil
+ELEMENTOS_POR_BLOCO = 1 << 20
+
+
+class _BinsLogaritmicos:
+    """Contagens por índice de bin logarítmico, num array denso que cresce conforme os índices vistos"""
+
+    def __init__(self, max_bins):
+        self.max_bins = max_bins
+        self.primeiro = None
+        self.contagens = np.zeros(0, dtype=np.int64)
+
+    def adicionar(self, indices):
+        if not len(indices):
+            return
+        menor, maior = int(indices.min()), int(indices.max())
+        if self.primeiro is None:
+            self.primeiro = menor
+        ultimo = max(self.primeiro + len(self.contagens) - 1, maior)
+        primeiro = min(self.primeiro, menor)
+
+        # Acima de max_bins, os índices mais baixos (valores de menor magnitude) vão para o primeiro bin
+        primeiro = max(primeiro, ultimo - self.max_bins + 1)
+        if primeiro != self.primeiro or ultimo - primeiro + 1 != len(self.contagens):
+            contagens = np.zeros(ultimo - primeiro + 1, dtype=np.int64)
+            antigos = np.clip(np.arange(self.primeiro, self.primeiro + len(self.contagens)) - primeiro, 0, None)
+            np.add.at(contagens, antigos, self.contagens)
+            self.primeiro, self.contagens = primeiro, contagens
+
+        self.contagens += np.bincount(np.maximum(indices - primeiro, 0), minlength=len(self.contagens))
+
+
+class EstimadorQuantis:
+    """
+    Estimador de quantis em uma única passada com memória fixa.
+
+    Os valores são contados em bins logarítmicos (como no DDSketch): o bin k de um
+    valor positivo cobre (gama^(k-1), gama^k], com gama = (1 + erro) / (1 - erro), e
+    os negativos são contados pela magnitude num segundo conjunto de bins. Cada
+    quantil tem erro relativo de no máximo erro_relativo, qualquer que seja o
+    intervalo dos dados: um pixel extremo só ocupa um bin a mais, sem alargar os
+    outros. Valores NaN/infinitos são ignorados.
+
+    Com exato=True os valores são guardados e o quantil vem de np.percentile.
+    """
+
+    def __init__(self, num_bins=NUM_BINS_PADRAO, exato=None, erro_relativo=ERRO_RELATIVO):
+        self.num_bins = num_bins
+        self.exato = MODO_EXATO if exato is None else exato
+        self.gama = (1 + erro_relativo) / (1 - erro_relativo)
+        self.log_gama = np.log(self.gama)
+        self.positivos = _BinsLogaritmicos(num_bins)
+        self.negativos = _BinsLogaritmicos(num_bins)
+        self.zeros = 0
+        self.minimo = np.inf
+        self.maximo = -np.inf
+        self.valores = []
+
+    def adicionar(self, valores):
+        """Acrescenta um bloco de valores (qualquer forma)"""
+        valores = np.asarray(valores, dtype=np.float64).ravel()
+        valores = valores[np.isfinite(valores)]
+        if not len(valores):
+            return
+
+        if self.exato:
+            self.valores.append(valores)
+            return
+
+        self.minimo = min(self.minimo, valores.min())
+        self.maximo = max(self.maximo, valores.max())
+
+        positivos = valores > 0
+        negativos = valores < 0
+        self.zeros += int(len(valores) - positivos.sum() - negativos.sum())
+        self.positivos.adicionar(self._indices(valores[positivos]))
+        self.negativos.adicionar(self._indices(-valores[negativos]))
+
+    def _indices(self, magnitudes):
+        return np.ceil(np.log(magnitudes) / self.log_gama).astype(np.int64)
+
+    def _valor_bin(self, indices):
+        # Ponto do bin com o mesmo erro relativo para os dois extremos
+        return 2 * np.exp(indices * self.log_gama) / (self.gama + 1)
+
+    @property
+    def total(self):
+        if self.exato:
+            return sum(len(v) for v in self.valores)
+        return int(self.positivos.contagens.sum() + self.negativos.contagens.sum()) + self.zeros
+
+    def quantil(self, percentis):
+        """Percentil(is) em 0-100, com a mesma interpolação linear de np.percentile"""
+        if not self.total:
+            raise ValueError("Nenhum valor para calcular percentis")
+
+        if self.exato:
+            return np.percentile(np.concatenate(self.valores), percentis)
+
+        # Bins em ordem crescente de valor: negativos (da maior para a menor magnitude), zeros, positivos
+        negativos, positivos = self.negativos, self.positivos
+        indices_negativos = np.arange(len(negativos.contagens))[::-1] + (negativos.primeiro or 0)
+        indices_positivos = np.arange(len(positivos.contagens)) + (positivos.primeiro or 0)
+        valores_bins = np.concatenate([-self._valor_bin(indices_negativos), [0.0],
+                                       self._valor_bin(indices_positivos)])
+        acumulado = np.cumsum(np.concatenate([negativos.contagens[::-1], [self.zeros], positivos.contagens]))
+
+        def valor_na_posicao(posicao):
+            return valores_bins[np.searchsorted(acumulado, posicao, side='right')]
+
+        posicao = np.asarray(percentis, dtype=np.float64) / 100 * (self.total - 1)
+        abaixo = np.floor(posicao)
+        valor_abaixo = valor_na_posicao(abaixo)
+        resultado = valor_abaixo + (posicao - abaixo) * (valor_na_posicao(np.ceil(posicao)) - valor_abaixo)
+        resultado = np.clip(resultado, self.minimo, self.maximo)
+        return float(resultado) if resultado.ndim == 0 else resultado
+
+
+def percentil(valores, percentis, mascara=None, exato=None):
+    """
+    Percentil(is) de um array (ex: mapa ou memmap) percorrido em blocos de linhas.
+    Com mascara, só os elementos marcados entram na conta, sem a cópia de valores[mascara].
+    """
+    estimador = EstimadorQuantis(exato=exato)
+    valores = np.asarray(valores) if not isinstance(valores, np.ndarray) else valores
+    elementos_por_linha = max(1, int(np.prod(valores.shape[1:]))) if valores.ndim > 1 else 1
+    linhas_por_bloco = max(1, ELEMENTOS_POR_BLOCO // elementos_por_linha)
+
+    for inicio in range(0, len(valores), linhas_por_bloco):
+        bloco = valores[inicio:inicio + linhas_por_bloco]
+        if mascara is not None:
+            bloco = bloco[mascara[inicio:inicio + linhas_por_bloco]]
+        estimador.adicionar(bloco)
+
+    return estimador.quantil(percentis)
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import threading
+
+# Prefixo dos nomes das métricas no Prometheus
+PREFIXO = 'pipeline'
+
+# O textfile do Prometheus é regravado no máximo a cada INTERVALO_EXPORTACAO segundos
+INTERVALO_EXPORTACAO = 5.0
+
+_lock = threading.Lock()
+_config = {'pasta': None, 'script': None, 'prometheus': False, 'pid': None}
+_contadores = {}  # (nome, rótulos) -> valor acumulado
+_medidores = {}  # (nome, rótulos) -> último valor
+_ultima_exportacao = [0.0]
+
+
+def configurar(pasta, script, prometheus=True):
+    """
+    Ativa a instrumentação: os eventos vão para <pasta>/<script>.jsonl (uma linha JSON
+    por fase, contador ou medidor) e, com prometheus=True, os agregados vão para
+    <pasta>/<script>.prom, no formato do textfile collector do node_exporter. Sem
+    configurar, as métricas só são acumuladas em memória.
+    """
+    os.makedirs(pasta, exist_ok=True)
+    _config.update(pasta=pasta, script=script, prometheus=prometheus, pid=os.getpid())
+
+
+def configuracao():
+    """Configuração atual, para repassar a processos filhos (que só gravam o JSON-lines)"""
+    return {'pasta': _config['pasta'], 'script': _config['script'], 'prometheus': False}
+
+
+def _chave(nome, rotulos):
+    return nome, tuple(sorted((k, str(v)) for k, v in rotulos.items() if v is not None))
+
+
+def _registrar_evento(evento):
+    if not _config['pasta']:
+        return
+    evento = dict(instante=time.time(), script=_config['script'], pid=os.getpid(), **evento)
+    linha = json.dumps(evento, ensure_ascii=False) + '\n'
+    try:
+        # Uma única escrita em modo append: linhas de processos diferentes não se misturam
+        with open(os.path.join(_config['pasta'], f"{_config['script']}.jsonl"), 'a') as f:
+            f.write(linha)
+    except OSError as e:
+        print(f"Aviso: não foi possível gravar métricas: {e}")
+
+
+def incrementar(nome, valor=1, **rotulos):
+    """Soma valor a um contador (ex: itens processados, falhas)"""
+    with _lock:
+        chave = _chave(nome, rotulos)
+        _contadores[chave] = _contadores.get(chave, 0) + valor
+    _registrar_evento({'tipo': 'contador', 'nome': nome, 'valor': valor, 'rotulos': rotulos})
+    exportar()
+
+
+def definir(nome, valor, **rotulos):
+    """Define o valor atual de um medidor (ex: tamanho da fila); só grava o evento se o valor mudou"""
+    with _lock:
+        chave = _chave(nome, rotulos)
+        mudou = _medidores.get(chave) != valor
+        _medidores[chave] = valor
+    if mudou:
+        _registrar_evento({'tipo': 'medidor', 'nome': nome, 'valor': valor, 'rotulos': rotulos})
+    exportar()
+
+
+def registrar_fase(etapa, fase, segundos, sucesso=True, **rotulos):
+    """
+    Registra a duração de uma fase. No Prometheus entram soma, contagem e último valor
+    por etapa/fase; os rótulos extras (ex: cena) ficam só no JSON-lines.
+    """
+    with _lock:
+        for nome, valor in (('fase_segundos_total', segundos), ('fase_execucoes_total', 1)):
+            chave = _chave(nome, {'etapa': etapa, 'fase': fase})
+            _contadores[chave] = _contadores.get(chave, 0) + valor
+        _medidores[_chave('fase_segundos_ultima', {'etapa': etapa, 'fase': fase})] = segundos
+    _registrar_evento({'tipo': 'fase', 'etapa': etapa, 'fase': fase, 'segundos': segundos, 'sucesso': sucesso,
+                       'rotulos': rotulos})
+    exportar()
+
+
+class Fases:
+    """
+    Cronometra as fases numeradas de uma etapa: iniciar(fase) encerra a fase anterior e
+    começa a próxima; concluir(sucesso) encerra a última e registra a fase 'total' e o
+    contador de itens da etapa. Chamadas repetidas de concluir são ignoradas, o que
+    permite chamá-lo também num finally. Usado num with, conclui com falha se o bloco
+    levantar uma exceção.
+    """
+
+    def __init__(self, etapa, **rotulos):
+        self.etapa = etapa
+        self.rotulos = rotulos
+        self.inicio_total = time.perf_counter()
+        self.fase = None
+        self.inicio_fase = None
+        self.concluida = False
+
+    def iniciar(self, fase):
+        self._encerrar_fase()
+        self.fase = fase
+        self.inicio_fase = time.perf_counter()
+
+    def acumular(self, fase, segundos):
+        """Registra uma fase medida por fora (ex: a soma dos tiles de uma cena)"""
+        registrar_fase(self.etapa, fase, segundos, **self.rotulos)
+
+    def _encerrar_fase(self, sucesso=True):
+        if self.fase is not None:
+            registrar_fase(self.etapa, self.fase, time.perf_counter() - self.inicio_fase, sucesso, **self.rotulos)
+            self.fase = None
+
+    def concluir(self, sucesso=True):
+        if self.concluida:
+            return
+        self.concluida = True
+        self._encerrar_fase(sucesso)
+        registrar_fase(self.etapa, 'total', time.perf_counter() - self.inicio_total, sucesso, **self.rotulos)
+        incrementar('itens_total', etapa=self.etapa, resultado='sucesso' if sucesso else 'falha')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo_excecao, excecao, traceback):
+        self.concluir(sucesso=tipo_excecao is None)
+        return False
+
+
+class Cronometro:
+    """
+    Acumula tempos por fase dentro de um laço (ex: tiles de uma cena): marcar(fase) soma
+    à fase o tempo desde a marcação anterior. registrar(fases) grava os totais.
+    """
+
+    def __init__(self):
+        self.tempos = {}
+        self.instante = time.perf_counter()
+
+    def marcar(self, fase):
+        agora = time.perf_counter()
+        self.tempos[fase] = self.tempos.get(fase, 0.0) + agora - self.instante
+        self.instante = agora
+
+    def registrar(self, fases):
+        for fase, segundos in self.tempos.items():
+            fases.acumular(fase, segundos)
+
+
+def _formatar_serie(nome, rotulos, valor):
+    rotulos = dict(rotulos, script=_config['script']) if _config['script'] else dict(rotulos)
+    texto = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                     for k, v in sorted(rotulos.items()))
+    return f"{PREFIXO}_{nome}{{{texto}}} {valor}"
+
+
+def exportar(forcar=False):
+    """Regrava o textfile do Prometheus (no processo que configurou, respeitando INTERVALO_EXPORTACAO)"""
+    if not _config['prometheus'] or _config['pid'] != os.getpid():
+        return
+    agora = time.monotonic()
+    if not forcar and agora - _ultima_exportacao[0] < INTERVALO_EXPORTACAO:
+        return
+
+    with _lock:
+        _ultima_exportacao[0] = agora
+        linhas = []
+        for tipo, series in (('counter', _contadores), ('gauge', _medidores)):
+            for nome in sorted({nome for nome, _ in series}):
+                linhas.append(f"# TYPE {PREFIXO}_{nome} {tipo}")
+                linhas += [_formatar_serie(nome, rotulos, valor)
+                           for (n, rotulos), valor in sorted(series.items()) if n == nome]
+
+    caminho = os.path.join(_config['pasta'], f"{_config['script']}.prom")
+    caminho_tmp = f"{caminho}.tmp{os.getpid()}"
+    try:
+        with open(caminho_tmp, 'w') as f:
+            f.write('\n'.join(linhas) + '\n')
+        # O collector só deve ver o arquivo completo
+        os.replace(caminho_tmp, caminho)
+    except OSError as e:
+        print(f"Aviso: não foi possível exportar as métricas: {e}")
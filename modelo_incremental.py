@@ -0,0 +1,273 @@
+import os
+import copy
+import json
+import time
+import shutil
+
+import numpy as np
+
+from cache_modelos import salvar_scaler, carregar_scaler, salvar_modelo, carregar_modelo
+import cubo_envi
+from detectores import obter_detector
+
+# Arquivo com a versão atual e as cenas de treino descartadas por um rollback
+ARQUIVO_ATUAL = 'atual.json'
+# Pixels de treino guardados como amostra de reposição (replay) em cada versão
+TAMANHO_REPOSICAO = 20000
+# Versões mantidas em disco para rollback (a atual nunca é removida)
+MAX_VERSOES = 5
+# Semente das amostras de reposição
+SEMENTE_REPOSICAO = 0
+
+
+def nome_versao(versao):
+    return f"v{versao:04d}"
+
+
+def misturar_reposicao(reposicao, vistos, novos, total_novos, tamanho, rng):
+    """
+    Nova amostra de reposição de até tamanho pixels: os pixels antigos e os novos entram
+    na proporção dos pixels válidos que cada parte representa (vistos e total_novos),
+    para que a amostra continue representando todas as cenas já incluídas.
+    """
+    total = vistos + total_novos
+    n_novos = min(len(novos), int(round(tamanho * total_novos / total))) if total else len(novos)
+    n_antigos = min(len(reposicao), tamanho - n_novos)
+    # Sem pixels antigos suficientes, completa com novos
+    n_novos = min(len(novos), tamanho - n_antigos)
+
+    antigos = reposicao[rng.choice(len(reposicao), n_antigos, replace=False)] if n_antigos else reposicao[:0]
+    novos = novos[rng.choice(len(novos), n_novos, replace=False)] if n_novos else novos[:0]
+    return np.concatenate([antigos, novos]).astype(np.float32)
+
+
+class ModeloIncremental:
+    """
+    Modelo (scaler + detector) que acompanha as cenas de referência de uma pasta de
+    treino sem treinar do zero a cada cena nova.
+
+    Cada versão é uma pasta <pasta>/vNNNN com o scaler, o detector, a amostra de
+    reposição (reposicao.npy, pixels de treino sem normalizar) e um metadados.json
+    com as cenas incluídas e a versão anterior. A primeira versão é
+    um treino completo (criar). As seguintes (atualizar) partem da versão atual: o
+    scaler é estendido com os pixels novos (partial_fit) e o detector é atualizado
+    com a amostra de reposição mais os pixels novos (ver Detector.atualizar; o
+    autoencoder continua o treino dos pesos atuais por EPOCAS_INCREMENTAIS épocas).
+
+    <pasta>/atual.json aponta a versão em uso. reverter() volta para uma versão
+    anterior e marca as cenas incluídas depois dela como descartadas, para que não
+    voltem ao modelo enquanto não forem regravadas. Acima de max_versoes, as versões
+    mais antigas são removidas.
+    """
+
+    def __init__(self, pasta, tamanho_reposicao=TAMANHO_REPOSICAO, max_versoes=MAX_VERSOES):
+        self.pasta = pasta
+        self.tamanho_reposicao = tamanho_reposicao
+        self.max_versoes = max_versoes
+        self.rng = np.random.default_rng(SEMENTE_REPOSICAO)
+        # Versão atual em memória: (número, metadados, scaler, modelo)
+        self.em_memoria = None
+        os.makedirs(pasta, exist_ok=True)
+
+    def _ler_atual(self):
+        try:
+            with open(os.path.join(self.pasta, ARQUIVO_ATUAL)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'versao': None, 'descartados': {}}
+
+    def _gravar_atual(self, atual):
+        caminho = os.path.join(self.pasta, ARQUIVO_ATUAL)
+        caminho_tmp = f"{caminho}.tmp{os.getpid()}"
+        with open(caminho_tmp, 'w') as f:
+            json.dump(atual, f)
+        os.replace(caminho_tmp, caminho)
+
+    def _ler_metadados(self, versao):
+        with open(os.path.join(self.pasta, nome_versao(versao), 'metadados.json')) as f:
+            return json.load(f)
+
+    def versao_atual(self):
+        """Número da versão em uso (None sem versões)"""
+        return self._ler_atual()['versao']
+
+    def versoes(self):
+        """Metadados das versões em disco, da mais antiga para a mais nova"""
+        versoes = []
+        for nome in sorted(os.listdir(self.pasta)):
+            if nome.startswith('v') and nome[1:].isdigit():
+                try:
+                    versoes.append(self._ler_metadados(int(nome[1:])))
+                except (OSError, ValueError):
+                    continue
+        return versoes
+
+    def carregar(self):
+        """Retorna (scaler, modelo) da versão atual, ou None se ainda não houver uma"""
+        versao = self.versao_atual()
+        if versao is None:
+            return None
+        if self.em_memoria and self.em_memoria[0] == versao:
+            return self.em_memoria[2], self.em_memoria[3]
+
+        pasta_versao = os.path.join(self.pasta, nome_versao(versao))
+        try:
+            metadados = self._ler_metadados(versao)
+            scaler = carregar_scaler(os.path.join(pasta_versao, 'scaler.npz'))
+            modelo = carregar_modelo(pasta_versao, metadados['metodo'])
+        except Exception as e:
+            print(f"Aviso: versão {versao} do modelo incremental inválida: {e}")
+            return None
+
+        self.em_memoria = (versao, metadados, scaler, modelo)
+        return scaler, modelo
+
+    def pendentes(self, caminhos_treino, desde_inicio=False):
+        """
+        Cenas de treino ainda não incluídas na versão atual (novas ou regravadas); com
+        desde_inicio, todas. Cenas descartadas por um rollback ficam de fora até mudarem.
+        """
+        atual = self._ler_atual()
+        incluidos = {}
+        if atual['versao'] is not None and not desde_inicio:
+            incluidos = self._ler_metadados(atual['versao'])['treinos']
+
+        pendentes = []
+        for caminho in caminhos_treino:
+            nome = os.path.basename(caminho)
+            identidade = cubo_envi.identidade_cubo(caminho)
+            if incluidos.get(nome) == identidade or atual['descartados'].get(nome) == identidade:
+                continue
+            pendentes.append(caminho)
+        return pendentes
+
+    def criar(self, caminhos_treino, pixels, total_validos, scaler, modelo):
+        """Grava um modelo treinado do zero como nova versão (sem versão anterior)"""
+        reposicao = misturar_reposicao(pixels[:0], 0, pixels, total_validos, self.tamanho_reposicao, self.rng)
+        return self._gravar_versao(caminhos_treino, {}, None, 'completo', total_validos, reposicao, scaler, modelo)
+
+    def atualizar(self, caminhos_novos, pixels, total_validos):
+        """
+        Nova versão a partir da atual com os pixels (sem normalizar) das cenas novas;
+        total_validos é o número de pixels válidos que a amostra representa.
+        """
+        if self.carregar() is None:
+            raise ValueError("Modelo incremental sem versão atual; use criar() primeiro")
+        versao, metadados, scaler_atual, modelo_atual = self.em_memoria
+        # O autoencoder é atualizado no lugar: até a nova versão ser gravada, a atual é relida do disco
+        self.em_memoria = None
+        reposicao = np.load(os.path.join(self.pasta, nome_versao(versao), 'reposicao.npy'))
+
+        inicio = time.perf_counter()
+        scaler = copy.deepcopy(scaler_atual)
+        scaler.partial_fit(pixels)
+        x_train = scaler.transform(np.concatenate([reposicao, pixels]))
+        print(f"Atualizando modelo incremental (v{versao}) com {len(pixels)} pixels novos "
+              f"e {len(reposicao)} de reposição")
+
+        modelo = obter_detector(metadados['metodo']).atualizar(modelo_atual, x_train)
+        print(f"Modelo incremental atualizado em {time.perf_counter() - inicio:.1f} s")
+
+        reposicao = misturar_reposicao(reposicao, metadados['pixels_vistos'], pixels, total_validos,
+                                       self.tamanho_reposicao, self.rng)
+        return self._gravar_versao(caminhos_novos, metadados['treinos'], versao, 'incremental',
+                                   metadados['pixels_vistos'] + total_validos, reposicao, scaler, modelo)
+
+    def _gravar_versao(self, caminhos_novos, treinos, anterior, tipo, pixels_vistos, reposicao, scaler, modelo):
+        versoes = [metadados['versao'] for metadados in self.versoes()]
+        versao = max(versoes, default=0) + 1
+        adicionados = {os.path.basename(c): cubo_envi.identidade_cubo(c) for c in caminhos_novos}
+        metadados = {
+            'versao': versao,
+            'anterior': anterior,
+            'tipo': tipo,
+            'metodo': modelo['metodo'],
+            'treinos': dict(treinos, **adicionados),
+            'adicionados': sorted(adicionados),
+            'pixels_vistos': int(pixels_vistos),
+            'criado_em': time.time(),
+        }
+
+        # Pasta temporária + rename, como no cache de modelos
+        pasta_versao = os.path.join(self.pasta, nome_versao(versao))
+        pasta_tmp = f"{pasta_versao}.tmp{os.getpid()}"
+        shutil.rmtree(pasta_tmp, ignore_errors=True)
+        os.makedirs(pasta_tmp)
+        try:
+            salvar_scaler(scaler, os.path.join(pasta_tmp, 'scaler.npz'))
+            salvar_modelo(modelo, pasta_tmp)
+            np.save(os.path.join(pasta_tmp, 'reposicao.npy'), reposicao)
+            with open(os.path.join(pasta_tmp, 'metadados.json'), 'w') as f:
+                json.dump(metadados, f)
+            os.replace(pasta_tmp, pasta_versao)
+        finally:
+            shutil.rmtree(pasta_tmp, ignore_errors=True)
+
+        atual = self._ler_atual()
+        # Uma cena regravada e incluída de novo deixa de estar descartada
+        descartados = {nome: identidade for nome, identidade in atual['descartados'].items()
+                       if nome not in adicionados}
+        self._gravar_atual({'versao': versao, 'descartados': descartados})
+        self.em_memoria = (versao, metadados, scaler, modelo)
+        print(f"Modelo incremental: versão {versao} ({tipo}, {', '.join(metadados['adicionados'])})")
+
+        self._remover_antigas(versao)
+        return scaler, modelo
+
+    def reverter(self, versao=None):
+        """
+        Volta para a versão dada (None = a anterior à atual). As cenas incluídas depois
+        dela ficam descartadas até serem regravadas. Retorna a versão em uso.
+        """
+        atual = self._ler_atual()
+        if atual['versao'] is None:
+            raise ValueError("Modelo incremental sem versões")
+
+        metadados_atual = self._ler_metadados(atual['versao'])
+        if versao is None:
+            versao = metadados_atual['anterior']
+            if versao is None:
+                raise ValueError(f"A versão {atual['versao']} não tem versão anterior")
+        if not os.path.isdir(os.path.join(self.pasta, nome_versao(versao))):
+            raise ValueError(f"Versão {versao} não encontrada em {self.pasta}")
+
+        incluidos = self._ler_metadados(versao)['treinos']
+        descartados = dict(atual['descartados'])
+        for nome, identidade in metadados_atual['treinos'].items():
+            if incluidos.get(nome) != identidade:
+                descartados[nome] = identidade
+        for nome in incluidos:
+            descartados.pop(nome, None)
+
+        self._gravar_atual({'versao': versao, 'descartados': descartados})
+        self.em_memoria = None
+        print(f"Modelo incremental revertido da versão {atual['versao']} para a {versao}"
+              + (f" (descartadas: {', '.join(sorted(descartados))})" if descartados else ""))
+        return versao
+
+    def _remover_antigas(self, versao_atual):
+        versoes = sorted(metadados['versao'] for metadados in self.versoes())
+        excedentes = [v for v in versoes if v != versao_atual][:max(0, len(versoes) - self.max_versoes)]
+        for versao in excedentes:
+            print(f"Removendo versão antiga do modelo incremental: {versao}")
+            shutil.rmtree(os.path.join(self.pasta, nome_versao(versao)), ignore_errors=True)
+
+
+# --- EXECUÇÃO PRINCIPAL ---
+if __name__ == '__main__':
+    # CONFIGURAÇÕES
+    PASTA_MODELO_INCREMENTAL = 'modelo_incremental'  # A mesma configurada em deeplearn.py
+    REVERTER_PARA = None  # Número da versão a restaurar; None apenas lista as versões
+
+    modelo_incremental = ModeloIncremental(PASTA_MODELO_INCREMENTAL)
+    try:
+        if REVERTER_PARA is not None:
+            modelo_incremental.reverter(REVERTER_PARA)
+
+        versao_atual = modelo_incremental.versao_atual()
+        for metadados in modelo_incremental.versoes():
+            marcador = '*' if metadados['versao'] == versao_atual else ' '
+            print(f"{marcador} v{metadados['versao']} ({metadados['tipo']}, {metadados['metodo']}, "
+                  f"anterior: {metadados['anterior']}): {', '.join(metadados['adicionados'])}")
+    except Exception as e:
+        print(f"Erro: {e}")
@@ -0,0 +1,188 @@
+import os
+import time
+import queue
+
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+
+import cubo_envi
+import metricas
+
+
+def cubo_do_evento(caminho):
+    """
+    Mapeia um arquivo de cubo (.hdr, .raw ou .h5) para o caminho do cubo usado pelas
+    etapas: o .hdr do par ENVI ou o .h5 quando não há um .hdr de mesmo nome.
+    """
+    base, extensao = os.path.splitext(caminho)
+    if extensao in ('.hdr', '.raw'):
+        return base + '.hdr'
+    if extensao == '.h5':
+        return base + '.hdr' if os.path.exists(base + '.hdr') else caminho
+    return None
+
+
+def arquivos_do_cubo(caminho_cubo):
+    """Arquivos que formam o cubo: o .hdr e o .raw, ou só o .h5"""
+    return sorted({caminho_cubo, cubo_envi.arquivo_dados(caminho_cubo)})
+
+
+def par_completo(caminho_cubo):
+    """O cubo está completo quando o cabeçalho e os dados existem"""
+    return all(os.path.exists(arquivo) for arquivo in arquivos_do_cubo(caminho_cubo))
+
+
+def _assinatura(arquivos):
+    try:
+        return tuple((os.path.getsize(a), os.path.getmtime(a)) for a in arquivos)
+    except OSError:
+        return None
+
+
+class _EnfileirarEventos(FileSystemEventHandler):
+    """Apenas enfileira os caminhos dos eventos; a decisão fica com o MonitorPasta"""
+
+    def __init__(self, fila):
+        self.fila = fila
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.fila.put(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.fila.put(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.fila.put(event.dest_path)
+
+
+class MonitorPasta:
+    """
+    Monitora uma pasta por eventos do watchdog em vez de varrê-la a cada poucos segundos.
+
+    Cada evento é convertido por normalizar(caminho) na chave do item (ex: o .raw de um
+    par vira o .hdr). O item só é processado quando pronto(chave) (ex: .hdr e .raw
+    presentes) e quando tamanho e mtime dos seus arquivos ficam estáveis por
+    intervalo_estabilidade segundos. Como rede de segurança para eventos perdidos (ex:
+    pastas de rede), listar() é consultada a cada intervalo_varredura segundos.
+
+    processar(chave) retorna True em caso de sucesso; itens com falha voltam a ser
+    tentados no próximo evento ou na próxima varredura.
+
+    Eventos, varreduras, itens pendentes e o resultado e a duração de cada item são
+    registrados em metricas com o rótulo pasta (nome da pasta monitorada).
+    """
+
+    def __init__(self, pasta, normalizar, listar, processar, pronto=None, arquivos=None,
+                 intervalo_varredura=300, intervalo_estabilidade=2.0):
+        self.pasta = os.path.abspath(pasta)
+        self.normalizar = normalizar
+        self.listar = listar
+        self.processar = processar
+        self.pronto = pronto or os.path.exists
+        self.arquivos = arquivos or (lambda chave: [chave])
+        self.intervalo_varredura = intervalo_varredura
+        self.intervalo_estabilidade = intervalo_estabilidade
+
+        self.fila = queue.Queue()
+        self.pendentes = {}  # chave -> (assinatura, instante em que foi observada)
+        self.avisados = set()
+        self.concluidos = set()
+        self.rotulo = os.path.basename(self.pasta)
+
+    def _adicionar(self, caminho):
+        if os.path.dirname(os.path.abspath(caminho)) != self.pasta:
+            # Ex: o destino de um arquivo movido para fora da pasta monitorada
+            return
+        chave = self.normalizar(caminho)
+        if chave:
+            self.concluidos.discard(chave)
+            self.pendentes[chave] = (None, 0)
+
+    def _varrer(self):
+        metricas.incrementar('monitor_varreduras_total', pasta=self.rotulo)
+        for chave in self.listar():
+            if chave not in self.concluidos and chave not in self.pendentes:
+                self.pendentes[chave] = (None, 0)
+
+    def _verificar_pendentes(self):
+        agora = time.monotonic()
+        for chave in list(self.pendentes):
+            assinatura_anterior, instante = self.pendentes.pop(chave)
+
+            # A chave pode mudar depois do evento (ex: o .hdr de um .h5 apareceu)
+            chave = self.normalizar(chave) or chave
+            arquivos = self.arquivos(chave)
+            if not any(os.path.exists(a) for a in arquivos):
+                # Todos os arquivos sumiram (ex: movidos por outra etapa)
+                self.avisados.discard(chave)
+                continue
+
+            if not self.pronto(chave):
+                if chave not in self.avisados:
+                    print(f"Aguardando arquivos correspondentes para: {os.path.basename(chave)}")
+                    self.avisados.add(chave)
+                self.pendentes[chave] = (None, agora)
+                continue
+
+            assinatura = _assinatura(arquivos)
+            if assinatura is None or assinatura != assinatura_anterior:
+                self.pendentes[chave] = (assinatura, agora)
+                continue
+            if agora - instante < self.intervalo_estabilidade:
+                self.pendentes[chave] = (assinatura, instante)
+                continue
+
+            self.avisados.discard(chave)
+            inicio = time.perf_counter()
+            try:
+                sucesso = self.processar(chave)
+            except Exception as e:
+                print(f"Erro ao processar {chave}: {e}")
+                sucesso = False
+            metricas.registrar_fase('monitor', 'processar', time.perf_counter() - inicio, sucesso,
+                                    pasta=self.rotulo, cena=os.path.basename(chave))
+            metricas.incrementar('monitor_itens_total', pasta=self.rotulo, resultado='sucesso' if sucesso else 'falha')
+            if sucesso:
+                self.concluidos.add(chave)
+
+        metricas.definir('monitor_pendentes', len(self.pendentes), pasta=self.rotulo)
+
+    def executar(self):
+        """Observa a pasta até Ctrl+C"""
+        observer = Observer()
+        observer.schedule(_EnfileirarEventos(self.fila), self.pasta, recursive=False)
+        observer.start()
+        print(f"Monitorando eventos em: {self.pasta} (varredura completa a cada {self.intervalo_varredura} s)")
+
+        proxima_varredura = time.monotonic() + self.intervalo_varredura
+        try:
+            while True:
+                # Aguarda o próximo evento; com itens pendentes, acorda para checar a estabilidade
+                espera = self.intervalo_estabilidade if self.pendentes else max(
+                    0.0, proxima_varredura - time.monotonic())
+                eventos = 0
+                try:
+                    self._adicionar(self.fila.get(timeout=espera))
+                    eventos += 1
+                    while True:
+                        self._adicionar(self.fila.get_nowait())
+                        eventos += 1
+                except queue.Empty:
+                    pass
+                if eventos:
+                    metricas.incrementar('monitor_eventos_total', eventos, pasta=self.rotulo)
+
+                if time.monotonic() >= proxima_varredura:
+                    self._varrer()
+                    proxima_varredura = time.monotonic() + self.intervalo_varredura
+
+                self._verificar_pendentes()
+
+        except KeyboardInterrupt:
+            print("\nParando monitoramento...")
+        finally:
+            observer.stop()
+            observer.join()
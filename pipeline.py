@@ -0,0 +1,279 @@
+import os
+import glob
+import time
+
+from registro_processamento import (RegistroProcessamento, ESTAGIO_CONVERSAO, ESTAGIO_DETECCAO,
+                                    ESTAGIO_REFINAMENTO, ESTAGIO_VISUALIZACAO)
+from cache_modelos import CacheModelos
+import cubo_envi
+import dependencias
+import estatisticas
+import metricas
+import piramide
+import renderizar
+import converter
+import deeplearn
+import refinar
+import visualizar
+
+
+def _cubo_convertido(output_base, opcoes_conversao):
+    """Cubo usado pelas etapas seguintes: o .hdr do ENVI ou, se só houver HDF5, o .h5"""
+    formato = (opcoes_conversao or {}).get('formato_saida', 'envi')
+    return f"{output_base}.h5" if formato == 'hdf5' else f"{output_base}.hdr"
+
+
+def _caminhos_granulo(caminho_nc, pastas, opcoes_conversao=None):
+    """Cubo convertido, arquivo de dados e produtos de um grânulo"""
+    nome_base = os.path.splitext(os.path.basename(caminho_nc))[0]
+    output_base = os.path.join(pastas['processados'], nome_base)
+    caminho_cubo = _cubo_convertido(output_base, opcoes_conversao)
+    return {
+        'nome_base': nome_base,
+        'output_base': output_base,
+        'cubo': caminho_cubo,
+        'dados': cubo_envi.arquivo_dados(caminho_cubo),
+        'tif': os.path.join(pastas['resultados'], f"{nome_base}_anomalias.tif"),
+        'png': os.path.join(pastas['resultados'], f"{nome_base}_anomalias.png"),
+        'refinado': os.path.join(pastas['final'], f"{nome_base}_refinado.png"),
+        'rgb': os.path.join(pastas['final'], f"{nome_base}_rgb.png"),
+    }
+
+
+def granulo_concluido(caminho_nc, pastas, registro, opcoes_conversao=None):
+    """O grânulo só está concluído quando a última etapa (RGB) consta no registro"""
+    caminhos = _caminhos_granulo(caminho_nc, pastas, opcoes_conversao)
+    return (registro.ja_processado(ESTAGIO_CONVERSAO, caminho_nc)
+            and registro.ja_processado(ESTAGIO_VISUALIZACAO, caminhos['dados']))
+
+
+def processar_granulo(caminho_nc, pastas, modelo_da_cena, opcoes_conversao=None, opcoes_deteccao=None,
+                      registro=None, opcoes_piramide=None):
+    """
+    Executa as quatro etapas para um grânulo NetCDF num único processo:
+    conversão -> detecção -> refinamento -> RGB.
+
+    O cubo é gravado uma vez (na pasta de processados, onde o fluxo por pastas o deixaria)
+    e lido por memmap. O mapa de anomalias passa da detecção para o refinamento em memória
+    e as bandas do NDWI e do RGB são lidas numa única leitura. Os artefatos são os mesmos
+    dos scripts separados e cada etapa é marcada no registro, para que os monitores
+    deles não refaçam o trabalho. Com opcoes_piramide, os três produtos também são
+    gravados como pirâmides de tiles (ver piramide.py).
+
+    modelo_da_cena(caminho_cubo) retorna o (scaler, modelo) da detecção; só é chamado
+    depois da conversão e quando a detecção precisa ser feita.
+
+    Com registro, o grânulo é retomado da primeira etapa não concluída (ex: uma falha
+    no RGB não refaz a conversão). A detecção só é pulada se o refinamento também já
+    estiver concluído, pois ele usa o mapa de anomalias em memória.
+    """
+    opcoes_deteccao = opcoes_deteccao or {}
+    caminhos = _caminhos_granulo(caminho_nc, pastas, opcoes_conversao)
+    nome_base, output_base = caminhos['nome_base'], caminhos['output_base']
+    caminho_cubo, caminho_dados = caminhos['cubo'], caminhos['dados']
+    caminho_tif, caminho_png = caminhos['tif'], caminhos['png']
+    caminho_refinado, caminho_rgb = caminhos['refinado'], caminhos['rgb']
+
+    def concluido(estagio, caminho):
+        return registro is not None and registro.ja_processado(estagio, caminho)
+
+    print(f"\n=== PIPELINE: {os.path.basename(caminho_nc)} ===")
+    inicio = time.perf_counter()
+
+    # --- 1. CONVERSÃO ---
+    if concluido(ESTAGIO_CONVERSAO, caminho_nc):
+        print(f"Conversão já realizada: {os.path.basename(caminho_cubo)}")
+    else:
+        if registro:
+            registro.marcar_em_andamento(ESTAGIO_CONVERSAO, caminho_nc)
+        sucesso = converter.converter_emit_para_envi(caminho_nc, output_base, **(opcoes_conversao or {}))
+        if not sucesso:
+            if registro:
+                registro.marcar_falha(ESTAGIO_CONVERSAO, caminho_nc)
+            return False
+        if registro:
+            registro.marcar_concluido(ESTAGIO_CONVERSAO, caminho_nc,
+                                      converter.arquivos_saida(output_base, opcoes_conversao))
+
+    metadados = cubo_envi.ler_metadados(caminho_cubo)
+    refinamento_concluido = concluido(ESTAGIO_REFINAMENTO, caminho_tif)
+    visualizacao_concluida = concluido(ESTAGIO_VISUALIZACAO, caminho_dados)
+
+    # --- 2. DETECÇÃO ---
+    if refinamento_concluido and concluido(ESTAGIO_DETECCAO, caminho_dados):
+        print(f"Detecção e refinamento já realizados: {nome_base}")
+    else:
+        try:
+            if registro:
+                registro.marcar_em_andamento(ESTAGIO_DETECCAO, caminho_dados)
+            scaler, modelo = modelo_da_cena(caminho_cubo)
+            mapa_anomalia = deeplearn.detectar_e_salvar(scaler, modelo, caminho_cubo, caminho_tif, caminho_png,
+                                                        opcoes_deteccao.get('modo_tiles', False),
+                                                        opcoes_deteccao.get('pixels_por_tile', 65536),
+                                                        opcoes_piramide)
+            if registro:
+                registro.marcar_concluido(ESTAGIO_DETECCAO, caminho_dados, [caminho_png])
+        except Exception as e:
+            print(f"Erro na detecção: {e}")
+            if registro:
+                registro.marcar_falha(ESTAGIO_DETECCAO, caminho_dados, e)
+            return False
+        # Um novo mapa de anomalias invalida o refinamento anterior
+        refinamento_concluido = False
+
+    # Bandas do NDWI e do RGB numa única leitura do cubo
+    green_idx, nir_idx = refinar.indices_ndwi(metadados)
+    red_idx, green_rgb_idx, blue_idx = visualizar.indices_rgb(metadados)
+    bandas = cubo_envi.ler_bandas(caminho_cubo, [green_idx, nir_idx, red_idx, green_rgb_idx, blue_idx], metadados)
+
+    # --- 3. REFINAMENTO ---
+    if not refinamento_concluido:
+        try:
+            if registro:
+                registro.marcar_em_andamento(ESTAGIO_REFINAMENTO, caminho_tif)
+            mascara_agua = refinar.calcular_mascara_agua(bandas[:, :, 0], bandas[:, :, 1])
+            mapa_refinado = refinar.refinar_mapa(mapa_anomalia, mascara_agua)
+            refinar.salvar_mapa_refinado(mapa_refinado, caminho_refinado)
+            if opcoes_piramide is not None:
+                piramide.gravar_piramide(mapa_refinado, piramide.pasta_piramide(caminho_refinado),
+                                         piramide.colorir_colormap('jet'), **opcoes_piramide)
+            if registro:
+                registro.marcar_concluido(ESTAGIO_REFINAMENTO, caminho_tif, [caminho_refinado])
+        except Exception as e:
+            print(f"Erro no refinamento: {e}")
+            if registro:
+                registro.marcar_falha(ESTAGIO_REFINAMENTO, caminho_tif, e)
+            return False
+
+    # --- 4. RGB ---
+    if not visualizacao_concluida:
+        try:
+            if registro:
+                registro.marcar_em_andamento(ESTAGIO_VISUALIZACAO, caminho_dados)
+            rgb = visualizar.compor_rgb(bandas[:, :, 2:5], metadados)
+            visualizar.salvar_rgb(rgb, caminho_rgb)
+            if opcoes_piramide is not None:
+                piramide.gravar_piramide(rgb, piramide.pasta_piramide(caminho_rgb), **opcoes_piramide)
+            if registro:
+                registro.marcar_concluido(ESTAGIO_VISUALIZACAO, caminho_dados, [caminho_rgb])
+        except Exception as e:
+            print(f"Erro ao gerar o RGB: {e}")
+            if registro:
+                registro.marcar_falha(ESTAGIO_VISUALIZACAO, caminho_dados, e)
+            return False
+
+    print(f"Pipeline concluído em {time.perf_counter() - inicio:.1f} s: {nome_base}")
+    return True
+
+
+def executar_pipeline(pastas, pasta_treino, opcoes_conversao=None, opcoes_deteccao=None, registro=None,
+                      usar_todos_treinos=False, opcoes_piramide=None):
+    """
+    Processa todos os grânulos .nc da pasta de entrada com o pipeline em processo.
+    Com usar_todos_treinos, um único modelo (todos os arquivos de treino) é usado para
+    todos os grânulos; sem ele, cada cubo convertido usa o cubo de treino mais parecido
+    (ver deeplearn.selecionar_melhor_treino), com o modelo reaproveitado enquanto o
+    treino escolhido se repetir e, entre treinos, pelo cache de modelos. Grânulos com todas
+    as etapas no registro são pulados e os demais são retomados da primeira etapa
+    não concluída (ver processar_granulo).
+    """
+    for pasta in pastas.values():
+        os.makedirs(pasta, exist_ok=True)
+
+    opcoes_deteccao = opcoes_deteccao or {}
+    caminho_hdr_treino = deeplearn.selecionar_melhor_treino(pasta_treino, usar_todos_treinos)
+    if not caminho_hdr_treino:
+        print(f"ERRO: Nenhum arquivo de treino encontrado em: {pasta_treino}")
+        return
+
+    arquivos_nc = sorted(glob.glob(os.path.join(pastas['entrada'], "*.nc")))
+    if registro:
+        arquivos_nc = [f for f in arquivos_nc if not granulo_concluido(f, pastas, registro, opcoes_conversao)]
+
+    if not arquivos_nc:
+        print(f"Nenhum arquivo .nc novo encontrado em: {pastas['entrada']}")
+        return
+
+    print(f"Encontrados {len(arquivos_nc)} arquivos .nc para processar")
+    ultimo = {}  # treino -> (scaler, modelo) do último treino usado
+
+    def modelo_da_cena(caminho_cubo):
+        treino = caminho_hdr_treino if usar_todos_treinos else deeplearn.selecionar_melhor_treino(
+            pasta_treino, False, caminho_cubo)
+        chave = tuple(deeplearn.lista_treinos(treino))
+        if chave not in ultimo:
+            ultimo.clear()
+            ultimo[chave] = deeplearn.obter_modelo(treino, opcoes_deteccao.get('cache_modelos'),
+                                                   opcoes_deteccao.get('max_pixels_treino'),
+                                                   opcoes_deteccao.get('detector'),
+                                                   opcoes_deteccao.get('modelo_incremental'))
+        return ultimo[chave]
+
+    sucessos = 0
+    for caminho_nc in arquivos_nc:
+        try:
+            if processar_granulo(caminho_nc, pastas, modelo_da_cena, opcoes_conversao, opcoes_deteccao, registro,
+                                 opcoes_piramide):
+                sucessos += 1
+        except Exception as e:
+            print(f"Erro ao processar {caminho_nc}: {e}")
+
+    print(f"\n=== RESUMO DO PIPELINE ===")
+    print(f"Grânulos processados com sucesso: {sucessos}")
+    print(f"Grânulos com erro: {len(arquivos_nc) - sucessos}")
+
+
+# --- EXECUÇÃO PRINCIPAL ---
+if __name__ == '__main__':
+    # CONFIGURAÇÕES DAS PASTAS (as mesmas usadas pelos scripts separados)
+    PASTAS = {
+        'entrada': 'arquivosbrutos',  # Grânulos .nc
+        'processados': 'processados',  # Cubos convertidos
+        'resultados': 'resultados',  # _anomalias.tif/.png
+        'final': 'final',  # _refinado.png e _rgb.png
+    }
+    PASTA_TREINO = 'dados_treino'
+    PASTA_CACHE_MODELOS = 'cache_modelos'
+    CAMINHO_REGISTRO = 'registro_processamento.sqlite'
+    # False usa, para cada grânulo, o arquivo de treino mais parecido com ele (índice em
+    # PASTA_TREINO/biblioteca_treino.json); True treina um único modelo com todos os arquivos (amostrados)
+    USAR_TODOS_TREINOS = False
+    QUANTIS_EXATOS = False  # True calcula os contrastes com np.percentile (validação do histograma)
+    NIVEL_COMPRESSAO_PNG = 4  # zlib 0-9: 1 grava mais rápido, 9 gera PNGs menores
+    PASTA_METRICAS = 'metricas'  # <script>.jsonl (fases e contadores) e <script>.prom (Prometheus); None desativa
+
+    OPCOES_CONVERSAO = {
+        'modo_streaming': True,
+        'orcamento_memoria_mb': 256,
+        'interleave': 'bip',  # BIP: os tiles da detecção e a leitura das 5 bandas são passadas sequenciais
+        'tipo_dado': 'float32',
+        'fator_escala': 10000,
+        'formato_saida': 'envi',
+    }
+    OPCOES_DETECCAO = {
+        'modo_tiles': True,
+        'pixels_por_tile': 65536,
+        'cache_modelos': CacheModelos(PASTA_CACHE_MODELOS, max_entradas=5),
+        'max_pixels_treino': 200000,
+        'detector': None,
+    }
+    # Ex: {'tamanho_tile': 256, 'formato': 'png'} para gravar também os três produtos como tiles XYZ
+    OPCOES_PIRAMIDE = None
+
+    print("=== PIPELINE EM PROCESSO: NETCDF -> DETECÇÃO -> REFINAMENTO -> RGB ===")
+    dependencias.relatorio_importacoes("Tempo de inicialização")
+    estatisticas.MODO_EXATO = QUANTIS_EXATOS
+    renderizar.NIVEL_COMPRESSAO_PNG = NIVEL_COMPRESSAO_PNG
+    if PASTA_METRICAS:
+        metricas.configurar(PASTA_METRICAS, 'pipeline')
+
+    registro = RegistroProcessamento(CAMINHO_REGISTRO)
+    try:
+        executar_pipeline(PASTAS, PASTA_TREINO, OPCOES_CONVERSAO, OPCOES_DETECCAO, registro, USAR_TODOS_TREINOS,
+                          OPCOES_PIRAMIDE)
+    except Exception as e:
+        print(f"Erro na execução: {e}")
+    finally:
+        registro.fechar()
+        metricas.exportar(forcar=True)
+        dependencias.relatorio_importacoes("Custo das importações")
@@ -0,0 +1,108 @@
+import os
+import json
+import math
+import shutil
+
+import numpy as np
+
+import dependencias
+import renderizar
+
+# Opções padrão da pirâmide (podem ser sobrescritas pelo dicionário opcoes_piramide de cada etapa)
+TAMANHO_TILE = 256
+FORMATO_TILE = 'png'  # 'png' (sem perdas) ou 'webp' (menor, com perdas)
+
+
+def pasta_piramide(caminho_png):
+    """Pasta da pirâmide de um produto: <nome>_tiles ao lado do PNG"""
+    return os.path.splitext(caminho_png)[0] + '_tiles'
+
+
+def numero_niveis(altura, largura, tamanho_tile=TAMANHO_TILE):
+    """Níveis até a imagem inteira caber num único tile (o nível 0)"""
+    return max(0, math.ceil(math.log2(max(altura, largura) / tamanho_tile))) + 1
+
+
+def reduzir_pela_metade(imagem):
+    """Média de blocos 2x2; linhas/colunas ímpares na borda são repetidas"""
+    altura, largura = imagem.shape[:2]
+    if altura % 2 or largura % 2:
+        imagem = np.pad(imagem, [(0, altura % 2), (0, largura % 2)] + [(0, 0)] * (imagem.ndim - 2), mode='edge')
+
+    soma = imagem.astype(np.float32)
+    soma = soma[0::2, 0::2] + soma[1::2, 0::2] + soma[0::2, 1::2] + soma[1::2, 1::2]
+    if np.issubdtype(imagem.dtype, np.integer):
+        return np.round(soma / 4).astype(imagem.dtype)
+    return soma / 4
+
+
+def colorir_colormap(nome='jet'):
+    """Função que converte um tile escalar normalizado (0-1) em RGB uint8 com a LUT do colormap"""
+    return lambda tile: renderizar.aplicar_colormap(tile, nome)
+
+
+def _tile_rgba(pixels, tamanho_tile):
+    """Completa um tile de borda até tamanho_tile x tamanho_tile com pixels transparentes"""
+    tile = np.zeros((tamanho_tile, tamanho_tile, 4), dtype=np.uint8)
+    altura, largura = pixels.shape[:2]
+    if pixels.ndim == 2:
+        pixels = np.repeat(pixels[:, :, None], 3, axis=2)
+    tile[:altura, :largura, :pixels.shape[2]] = pixels
+    if pixels.shape[2] == 3:
+        tile[:altura, :largura, 3] = 255
+    return tile
+
+
+def gravar_piramide(imagem, pasta, colorir=None, tamanho_tile=TAMANHO_TILE, formato=FORMATO_TILE, qualidade=90):
+    """
+    Grava imagem como uma pirâmide de tiles no esquema XYZ: <pasta>/{z}/{x}/{y}.<formato>.
+
+    O nível mais alto tem a resolução original e cada nível abaixo é a redução 2x2 do
+    anterior, até o nível 0 caber num tile. Cada nível é gravado tile a tile e só ele
+    e o próximo ficam em memória. imagem pode ser escalar (2D, convertida por
+    colorir(tile) em RGB/RGBA uint8) ou RGB/RGBA uint8. A redução é feita nos valores
+    escalares, antes do colormap. As coordenadas são em pixels da cena (ex:
+    L.CRS.Simple no Leaflet), não em Web Mercator; as dimensões ficam em piramide.json.
+    A pirâmide é montada numa pasta temporária e substitui a anterior de uma vez.
+    """
+    altura, largura = imagem.shape[:2]
+    niveis = numero_niveis(altura, largura, tamanho_tile)
+
+    pasta_tmp = f"{pasta}.tmp{os.getpid()}"
+    if os.path.exists(pasta_tmp):
+        shutil.rmtree(pasta_tmp)
+
+    try:
+        nivel = imagem
+        total_tiles = 0
+        for z in range(niveis - 1, -1, -1):
+            altura_nivel, largura_nivel = nivel.shape[:2]
+            for x in range(math.ceil(largura_nivel / tamanho_tile)):
+                os.makedirs(os.path.join(pasta_tmp, str(z), str(x)))
+                for y in range(math.ceil(altura_nivel / tamanho_tile)):
+                    pixels = nivel[y * tamanho_tile:(y + 1) * tamanho_tile, x * tamanho_tile:(x + 1) * tamanho_tile]
+                    if colorir is not None:
+                        pixels = colorir(pixels)
+                    caminho_tile = os.path.join(pasta_tmp, str(z), str(x), f"{y}.{formato}")
+                    if formato == 'png':
+                        renderizar.salvar_png(_tile_rgba(pixels, tamanho_tile), caminho_tile)
+                    else:
+                        Image = dependencias.carregar('PIL.Image')
+                        Image.fromarray(_tile_rgba(pixels, tamanho_tile)).save(caminho_tile, quality=qualidade)
+                    total_tiles += 1
+            if z:
+                nivel = reduzir_pela_metade(nivel)
+
+        with open(os.path.join(pasta_tmp, 'piramide.json'), 'w') as f:
+            json.dump({'largura': largura, 'altura': altura, 'tamanho_tile': tamanho_tile, 'niveis': niveis,
+                       'nivel_max': niveis - 1, 'url': f"{{z}}/{{x}}/{{y}}.{formato}"}, f, indent=2)
+
+        if os.path.exists(pasta):
+            shutil.rmtree(pasta)
+        os.replace(pasta_tmp, pasta)
+    finally:
+        if os.path.exists(pasta_tmp):
+            shutil.rmtree(pasta_tmp)
+
+    print(f"Pirâmide de tiles salva em: '{pasta}' ({niveis} níveis, {total_tiles} tiles)")
+    return pasta
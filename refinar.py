@@ -1,77 +1,144 @@
 import numpy as np
-import rasterio
-from spectral import envi
-import matplotlib.pyplot as plt
 import os
 import glob
 
+from registro_processamento import RegistroProcessamento, ESTAGIO_REFINAMENTO
+import cubo_envi
+import dependencias
+import estatisticas
+import metricas
+import piramide
+import renderizar
+from monitor_pastas import MonitorPasta
+from cache_mascaras import CacheMascaras
 
-def encontrar_banda_mais_proxima(wavelengths, target_wavelength):
-    """Encontra o índice da banda cujo comprimento de onda é mais próximo do alvo."""
-    idx = np.argmin(np.abs(np.array(wavelengths) - target_wavelength))
-    return idx
+# Pixels com NDWI acima deste limiar são considerados água
+LIMIAR_NDWI = 0.2
 
 
-def refinar_mapa_anomalia(caminho_hdr_original, caminho_tif_anomalia, caminho_saida_final_png):
+def indices_ndwi(metadados):
+    """Índices das bandas Verde e Infravermelho Próximo (NIR) usadas no NDWI"""
+    try:
+        # Tabela pré-calculada no índice do cubo (ver cubo_envi.gravar_indice)
+        green_idx = cubo_envi.banda_mais_proxima(metadados, 550)  # Verde
+        nir_idx = cubo_envi.banda_mais_proxima(metadados, 860)  # NIR
+        print(f"Usando bandas: Verde (idx {green_idx}) e NIR (idx {nir_idx}) para o NDWI.")
+    except KeyError:
+        print("AVISO: 'wavelength' não encontrado. Usando índices de banda padrão para EMIT.")
+        green_idx, nir_idx = 35, 85  # Índices aproximados para Verde e NIR no EMIT
+    return green_idx, nir_idx
+
+
+def calcular_ndwi(green_band, nir_band):
+    """NDWI = (Verde - NIR) / (Verde + NIR), em float32"""
+    green_band = np.asarray(green_band, dtype=np.float32)
+    nir_band = np.asarray(nir_band, dtype=np.float32)
+
+    # Evitar divisão por zero
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (green_band - nir_band) / (green_band + nir_band)
+
+
+def calcular_mascara_agua(green_band, nir_band, limiar=LIMIAR_NDWI, retornar_ndwi=False):
+    """
+    Máscara de água: pixels com NDWI > limiar (0.2 por padrão).
+    Com retornar_ndwi=True retorna (mascara_agua, ndwi), ex: para guardar o NDWI no cache.
+    """
+    ndwi = calcular_ndwi(green_band, nir_band)
+    mascara_agua = ndwi > limiar
+    print(f"Máscara de água criada. {np.count_nonzero(mascara_agua)} pixels de água encontrados.")
+    return (mascara_agua, ndwi) if retornar_ndwi else mascara_agua
+
+
+def obter_mascara_agua(caminho_hdr_original, cache_mascaras=None, limiar=LIMIAR_NDWI):
+    """
+    Retorna a máscara de água do cubo. Com um cache de máscaras, uma máscara já
+    calculada para o mesmo cubo (inalterado) e o mesmo limiar é lida do cache sem
+    acessar as bandas; caso contrário as bandas Verde e NIR são lidas e o NDWI calculado.
+    """
+    metadados = cubo_envi.ler_metadados(caminho_hdr_original)
+
+    # NDWI usa as bandas Verde e Infravermelho Próximo (NIR)
+    green_idx, nir_idx = indices_ndwi(metadados)
+
+    chave = None
+    if cache_mascaras:
+        chave = cache_mascaras.chave(caminho_hdr_original, limiar, (green_idx, nir_idx))
+        entrada = cache_mascaras.carregar(chave)
+        if entrada:
+            mascara_agua = entrada[0]
+            print(f"Máscara de água lida do cache. {np.count_nonzero(mascara_agua)} pixels de água.")
+            return mascara_agua
+
+    bandas = cubo_envi.ler_bandas(caminho_hdr_original, [green_idx, nir_idx], metadados)
+    mascara_agua, ndwi = calcular_mascara_agua(bandas[:, :, 0], bandas[:, :, 1], limiar, retornar_ndwi=True)
+
+    if cache_mascaras:
+        cache_mascaras.salvar(chave, mascara_agua, ndwi)
+    return mascara_agua
+
+
+def refinar_mapa(mapa_anomalia, mascara_agua):
+    """Zera a água no mapa de anomalias e normaliza pelo 98º percentil calculado só na terra"""
+    # Aplicar a máscara: onde for água, o valor da anomalia se torna 0
+    mapa_anomalia_mascarado = np.where(mascara_agua, 0, mapa_anomalia)
+
+    # Criar uma máscara dos pixels de terra para o cálculo do percentil
+    mascara_terra = ~mascara_agua
+
+    # Recalcular o limite de contraste APENAS nos pixels de terra (em blocos, sem copiar os pixels de terra)
+    vmax = estatisticas.percentil(mapa_anomalia_mascarado, 98, mascara=mascara_terra)
+    print(f"Novo limite de contraste (98º percentil na terra): {vmax:.6f}")
+
+    # Normalizar o mapa com o novo limite
+    return np.clip(mapa_anomalia_mascarado, 0, vmax) / vmax
+
+
+def salvar_mapa_refinado(mapa_anomalia_refinado, caminho_saida_final_png):
+    """Grava o mapa refinado como PNG com o colormap jet"""
+    renderizar.salvar_colormap_png(mapa_anomalia_refinado, caminho_saida_final_png, 'jet', vmin=0, vmax=1)
+    print(f"Sucesso! Mapa final refinado salvo em: '{caminho_saida_final_png}'")
+
+
+def refinar_mapa_anomalia(caminho_hdr_original, caminho_tif_anomalia, caminho_saida_final_png, cache_mascaras=None,
+                          opcoes_piramide=None):
     """
     Mascara corpos d'água em um mapa de anomalias e reescala o contraste para
     revelar anomalias sutis na vegetação.
+    Com cache_mascaras (CacheMascaras), a máscara de água de cada cena é calculada uma única vez.
+    Com opcoes_piramide (dicionário), o mapa refinado também é gravado como pirâmide de tiles.
     """
+    fases = metricas.Fases('refinamento', cena=os.path.basename(caminho_tif_anomalia))
     try:
         print("--- Iniciando Refinamento do Mapa de Anomalias ---")
 
         # --- 1. CALCULAR A MÁSCARA DE ÁGUA USANDO NDWI ---
         print("Passo 1: Calculando Índice de Água (NDWI) para criar máscara...")
+        fases.iniciar('mascara')
 
-        hdr = envi.read_envi_header(caminho_hdr_original)
-        img = envi.open(caminho_hdr_original)
-
-        # NDWI usa as bandas Verde e Infravermelho Próximo (NIR)
-        try:
-            wavelengths = [float(w) for w in hdr['wavelength']]
-            green_idx = encontrar_banda_mais_proxima(wavelengths, 550)  # Verde
-            nir_idx = encontrar_banda_mais_proxima(wavelengths, 860)  # NIR
-            print(f"Usando bandas: Verde (idx {green_idx}) e NIR (idx {nir_idx}) para o NDWI.")
-        except KeyError:
-            print("AVISO: 'wavelength' não encontrado. Usando índices de banda padrão para EMIT.")
-            green_idx, nir_idx = 35, 85  # Índices aproximados para Verde e NIR no EMIT
-
-        green_band = img.read_band(green_idx).astype(float)
-        nir_band = img.read_band(nir_idx).astype(float)
-
-        # Evitar divisão por zero
-        np.seterr(divide='ignore', invalid='ignore')
-        ndwi = (green_band - nir_band) / (green_band + nir_band)
-
-        # Criar a máscara: pixels com NDWI > 0.2 são considerados água
-        mascara_agua = ndwi > 0.2
-        print(f"Máscara de água criada. {np.count_nonzero(mascara_agua)} pixels de água encontrados.")
+        mascara_agua = obter_mascara_agua(caminho_hdr_original, cache_mascaras)
 
         # --- 2. APLICAR A MÁSCARA E REESCALAR O CONTRASTE ---
         print("Passo 2: Aplicando máscara e reescalando contraste...")
 
+        fases.iniciar('ler')
+        rasterio = dependencias.carregar('rasterio')
         with rasterio.open(caminho_tif_anomalia) as src:
             mapa_anomalia = src.read(1)
 
-        # Aplicar a máscara: onde for água, o valor da anomalia se torna 0
-        mapa_anomalia_mascarado = np.where(mascara_agua, 0, mapa_anomalia)
-
-        # Criar uma máscara dos pixels de terra para o cálculo do percentil
-        mascara_terra = ~mascara_agua
-
-        # Recalcular o limite de contraste APENAS nos pixels de terra
-        vmax = np.percentile(mapa_anomalia_mascarado[mascara_terra], 98)
-        print(f"Novo limite de contraste (98º percentil na terra): {vmax:.6f}")
-
-        # Normalizar o mapa com o novo limite
-        mapa_anomalia_refinado = np.clip(mapa_anomalia_mascarado, 0, vmax) / vmax
+        fases.iniciar('refinar')
+        mapa_anomalia_refinado = refinar_mapa(mapa_anomalia, mascara_agua)
 
         # --- 3. SALVAR O RESULTADO FINAL ---
         print("Passo 3: Salvando resultado final...")
-        # Solução 1: Especificar vmin e vmax para evitar a barra de cores
-        plt.imsave(caminho_saida_final_png, mapa_anomalia_refinado, cmap='jet', vmin=0, vmax=1)
-        print(f"Sucesso! Mapa final refinado salvo em: '{caminho_saida_final_png}'")
-
+        fases.iniciar('gravar')
+        salvar_mapa_refinado(mapa_anomalia_refinado, caminho_saida_final_png)
+        if opcoes_piramide is not None:
+            fases.iniciar('piramide')
+            piramide.gravar_piramide(mapa_anomalia_refinado, piramide.pasta_piramide(caminho_saida_final_png),
+                                     piramide.colorir_colormap('jet'), **opcoes_piramide)
+
+        fases.concluir()
         return True
 
     except FileNotFoundError:
@@ -80,29 +147,36 @@ def refinar_mapa_anomalia(caminho_hdr_original, caminho_tif_anomalia, caminho_sa
     except Exception as e:
         print(f"Ocorreu um erro inesperado: {e}")
         return False
+    finally:
+        fases.concluir(sucesso=False)
 
 
 def encontrar_hdr_correspondente(nome_base, pasta_analise, pasta_processados):
     """
     Encontra o arquivo .hdr original correspondente ao arquivo de resultados
+    (ou o cubo .h5, quando a cena foi convertida apenas para HDF5)
     """
-    # Procura primeiro na pasta de análise
-    caminho_hdr = os.path.join(pasta_analise, f"{nome_base}.hdr")
-    if os.path.exists(caminho_hdr):
-        return caminho_hdr
+    for extensao in ('.hdr', '.h5'):
+        # Procura primeiro na pasta de análise
+        caminho_hdr = os.path.join(pasta_analise, f"{nome_base}{extensao}")
+        if os.path.exists(caminho_hdr):
+            return caminho_hdr
 
-    # Se não encontrar, procura na pasta de processados
-    caminho_hdr = os.path.join(pasta_processados, f"{nome_base}.hdr")
-    if os.path.exists(caminho_hdr):
-        return caminho_hdr
+        # Se não encontrar, procura na pasta de processados
+        caminho_hdr = os.path.join(pasta_processados, f"{nome_base}{extensao}")
+        if os.path.exists(caminho_hdr):
+            return caminho_hdr
 
     return None
 
 
 def processar_todos_resultados(pasta_resultados, pasta_final, pasta_analise='dados_analise',
-                               pasta_processados='processados'):
+                               pasta_processados='processados', registro=None, cache_mascaras=None,
+                               opcoes_piramide=None):
     """
-    Processa todos os arquivos .tif da pasta resultados e salva na pasta final
+    Processa todos os arquivos .tif da pasta resultados e salva na pasta final.
+    Com um registro persistente, mapas já refinados (e inalterados) são pulados.
+    Retorna os mapas refinados ou pulados; os que falharam ficam de fora.
     """
     print("=== PROCESSANDO TODOS OS ARQUIVOS DE RESULTADOS ===")
 
@@ -114,12 +188,14 @@ def processar_todos_resultados(pasta_resultados, pasta_final, pasta_analise='dad
 
     if not arquivos_tif:
         print(f"Nenhum arquivo .tif encontrado na pasta: {pasta_resultados}")
-        return
+        return []
 
     print(f"Encontrados {len(arquivos_tif)} arquivos para processar")
 
     sucessos = 0
     erros = 0
+    pulados = 0
+    concluidos = []
 
     for caminho_tif in arquivos_tif:
         try:
@@ -127,6 +203,11 @@ def processar_todos_resultados(pasta_resultados, pasta_final, pasta_analise='dad
             nome_arquivo = os.path.basename(caminho_tif)
             nome_base = nome_arquivo.replace('_anomalias.tif', '')
 
+            if registro and registro.ja_processado(ESTAGIO_REFINAMENTO, caminho_tif):
+                pulados += 1
+                concluidos.append(caminho_tif)
+                continue
+
             print(f"\n--- PROCESSANDO: {nome_arquivo} ---")
 
             # Encontra o arquivo .hdr original correspondente
@@ -136,8 +217,7 @@ def processar_todos_resultados(pasta_resultados, pasta_final, pasta_analise='dad
                 print(f"AVISO: Arquivo .hdr original não encontrado para: {nome_base}")
                 print("Tentando encontrar arquivo .hdr genérico...")
                 # Tenta encontrar qualquer arquivo .hdr disponível
-                arquivos_hdr = glob.glob(os.path.join(pasta_analise, "*.hdr")) + glob.glob(
-                    os.path.join(pasta_processados, "*.hdr"))
+                arquivos_hdr = cubo_envi.listar_cubos(pasta_analise) + cubo_envi.listar_cubos(pasta_processados)
                 if arquivos_hdr:
                     caminho_hdr_original = arquivos_hdr[0]
                     print(f"Usando arquivo .hdr genérico: {os.path.basename(caminho_hdr_original)}")
@@ -151,10 +231,12 @@ def processar_todos_resultados(pasta_resultados, pasta_final, pasta_analise='dad
             caminho_saida = os.path.join(pasta_final, nome_saida)
 
             # Processa o arquivo
-            sucesso = refinar_mapa_anomalia(caminho_hdr_original, caminho_tif, caminho_saida)
+            sucesso = refinar_com_registro(caminho_hdr_original, caminho_tif, caminho_saida, registro, cache_mascaras,
+                                       opcoes_piramide)
 
             if sucesso:
                 sucessos += 1
+                concluidos.append(caminho_tif)
             else:
                 erros += 1
 
@@ -165,88 +247,112 @@ def processar_todos_resultados(pasta_resultados, pasta_final, pasta_analise='dad
     print(f"\n=== RESUMO DO PROCESSAMENTO ===")
     print(f"Arquivos processados com sucesso: {sucessos}")
     print(f"Arquivos com erro: {erros}")
+    print(f"Arquivos já refinados anteriormente: {pulados}")
     print(f"Total processado: {sucessos + erros}")
     print(f"Resultados finais salvos em: {pasta_final}")
+    return concluidos
+
+
+def refinar_com_registro(caminho_hdr_original, caminho_tif, caminho_saida, registro=None, cache_mascaras=None,
+                         opcoes_piramide=None):
+    """Executa refinar_mapa_anomalia registrando início e resultado no registro persistente"""
+    if registro:
+        registro.marcar_em_andamento(ESTAGIO_REFINAMENTO, caminho_tif)
+
+    sucesso = refinar_mapa_anomalia(caminho_hdr_original, caminho_tif, caminho_saida, cache_mascaras, opcoes_piramide)
+
+    if registro:
+        if sucesso:
+            registro.marcar_concluido(ESTAGIO_REFINAMENTO, caminho_tif, [caminho_saida])
+        else:
+            registro.marcar_falha(ESTAGIO_REFINAMENTO, caminho_tif)
+    return sucesso
 
 
 def modo_monitoramento_continuo(pasta_resultados, pasta_final, pasta_analise='dados_analise',
-                                pasta_processados='processados', intervalo=30):
+                                pasta_processados='processados', intervalo_varredura=300, registro=None,
+                                cache_mascaras=None, opcoes_piramide=None):
     """
     Monitora continuamente a pasta resultados por novos arquivos
+    (eventos do watchdog, com varredura completa a cada intervalo_varredura segundos)
     """
     print("=== INICIANDO MONITORAMENTO CONTÍNUO ===")
     print(f"Monitorando: {pasta_resultados}")
     print(f"Saída: {pasta_final}")
-    print(f"Verificando a cada {intervalo} segundos...")
     print("Pressione Ctrl+C para parar\n")
 
     # Cria a pasta final se não existir
     os.makedirs(pasta_final, exist_ok=True)
 
-    # Conjunto para rastrear arquivos já processados
-    arquivos_processados = set(glob.glob(os.path.join(pasta_resultados, "*.tif")))
+    # Mapas existentes refinados com sucesso; os que falharem são tentados de novo pela varredura
+    arquivos_processados = []
 
     # Processa arquivos existentes primeiro
-    if arquivos_processados:
+    if glob.glob(os.path.join(pasta_resultados, "*.tif")):
         print("Processando arquivos existentes...")
-        processar_todos_resultados(pasta_resultados, pasta_final, pasta_analise, pasta_processados)
+        arquivos_processados = processar_todos_resultados(pasta_resultados, pasta_final, pasta_analise,
+                                                          pasta_processados, registro, cache_mascaras,
+                                                          opcoes_piramide)
         print("Arquivos existentes processados.\n")
 
+    def nome_base_de(caminho_tif):
+        return os.path.basename(caminho_tif).replace('_anomalias.tif', '')
+
+    def processar(caminho_tif):
+        nome_arquivo = os.path.basename(caminho_tif)
+        nome_base = nome_base_de(caminho_tif)
+
+        print(f"\n--- PROCESSANDO NOVO ARQUIVO: {nome_arquivo} ---")
+
+        # Encontra o arquivo .hdr original correspondente
+        caminho_hdr_original = encontrar_hdr_correspondente(nome_base, pasta_analise, pasta_processados)
+
+        # Define o caminho de saída
+        nome_saida = f"{nome_base}_refinado.png"
+        caminho_saida = os.path.join(pasta_final, nome_saida)
+
+        # Processa o arquivo
+        sucesso = refinar_com_registro(caminho_hdr_original, caminho_tif, caminho_saida, registro, cache_mascaras,
+                                       opcoes_piramide)
+
+        if sucesso:
+            print(f"Arquivo processado com sucesso: {nome_saida}")
+        else:
+            print(f"Falha ao processar: {nome_arquivo}")
+        return sucesso
+
+    monitor = MonitorPasta(
+        pasta_resultados,
+        normalizar=lambda caminho: caminho if caminho.endswith('.tif') else None,
+        listar=lambda: glob.glob(os.path.join(pasta_resultados, "*.tif")),
+        processar=processar,
+        # O mapa só é refinado quando o cubo original (.hdr ou .h5) estiver disponível
+        pronto=lambda caminho_tif: encontrar_hdr_correspondente(nome_base_de(caminho_tif), pasta_analise,
+                                                                pasta_processados) is not None,
+        intervalo_varredura=intervalo_varredura,
+    )
+    monitor.concluidos.update(arquivos_processados)
+
     try:
-        while True:
-            # Verifica por novos arquivos
-            arquivos_atual = set(glob.glob(os.path.join(pasta_resultados, "*.tif")))
-            novos_arquivos = arquivos_atual - arquivos_processados
-
-            if novos_arquivos:
-                print(f"Encontrados {len(novos_arquivos)} novos arquivos")
-                for caminho_tif in novos_arquivos:
-                    try:
-                        nome_arquivo = os.path.basename(caminho_tif)
-                        nome_base = nome_arquivo.replace('_anomalias.tif', '')
-
-                        print(f"\n--- PROCESSANDO NOVO ARQUIVO: {nome_arquivo} ---")
-
-                        # Encontra o arquivo .hdr original correspondente
-                        caminho_hdr_original = encontrar_hdr_correspondente(nome_base, pasta_analise, pasta_processados)
-
-                        if caminho_hdr_original:
-                            # Define o caminho de saída
-                            nome_saida = f"{nome_base}_refinado.png"
-                            caminho_saida = os.path.join(pasta_final, nome_saida)
-
-                            # Processa o arquivo
-                            sucesso = refinar_mapa_anomalia(caminho_hdr_original, caminho_tif, caminho_saida)
-
-                            if sucesso:
-                                arquivos_processados.add(caminho_tif)
-                                print(f"Arquivo processado com sucesso: {nome_saida}")
-                            else:
-                                print(f"Falha ao processar: {nome_arquivo}")
-                        else:
-                            print(f"Arquivo .hdr original não encontrado para: {nome_base}")
-
-                    except Exception as e:
-                        print(f"Erro ao processar novo arquivo {caminho_tif}: {e}")
-
-            # Aguarda antes da próxima verificação
-            time.sleep(intervalo)
-
-    except KeyboardInterrupt:
-        print("\nParando monitoramento...")
+        monitor.executar()
     except Exception as e:
         print(f"Erro no monitoramento: {e}")
 
 
 # --- COMO USAR O SCRIPT ---
 if __name__ == '__main__':
-    import time
-
     # CONFIGURAÇÕES
     PASTA_RESULTADOS = 'resultados'  # Pasta onde estão os .tif gerados pelo deep learning
     PASTA_FINAL = 'final'  # Pasta onde os resultados refinados serão salvos
     PASTA_ANALISE = 'dados_analise'  # Pasta com arquivos originais para análise
     PASTA_PROCESSADOS = 'processados'  # Pasta com arquivos já processados
+    CAMINHO_REGISTRO = 'registro_processamento.sqlite'  # Registro compartilhado pelas etapas do pipeline
+    PASTA_CACHE_MASCARAS = 'cache_mascaras'  # Máscaras de água por cena (None para recalcular sempre)
+    TAMANHO_CACHE_MASCARAS_MB = 256  # Acima deste total as máscaras usadas há mais tempo são removidas
+    QUANTIS_EXATOS = False  # True calcula o contraste com np.percentile (validação do histograma)
+    NIVEL_COMPRESSAO_PNG = 4  # zlib 0-9: 1 grava mais rápido, 9 gera PNGs menores
+    PASTA_METRICAS = 'metricas'  # <script>.jsonl (fases e contadores) e <script>.prom (Prometheus); None desativa
+    OPCOES_PIRAMIDE = None  # Ex: {'tamanho_tile': 256, 'formato': 'png'} para gravar também tiles XYZ
 
     MODO_MONITORAMENTO = True  # True para monitorar continuamente, False para processar uma vez
 
@@ -261,15 +367,29 @@ if __name__ == '__main__':
     print(f"Pasta final: {PASTA_FINAL}")
     print(f"Pasta de análise: {PASTA_ANALISE}")
     print(f"Pasta de processados: {PASTA_PROCESSADOS}")
-    print()
+    dependencias.relatorio_importacoes("Tempo de inicialização")
+    estatisticas.MODO_EXATO = QUANTIS_EXATOS
+    renderizar.NIVEL_COMPRESSAO_PNG = NIVEL_COMPRESSAO_PNG
+    if PASTA_METRICAS:
+        metricas.configurar(PASTA_METRICAS, 'refinar')
+
+    registro = RegistroProcessamento(CAMINHO_REGISTRO)
+    cache_mascaras = CacheMascaras(PASTA_CACHE_MASCARAS, TAMANHO_CACHE_MASCARAS_MB) if PASTA_CACHE_MASCARAS else None
 
     try:
         if MODO_MONITORAMENTO:
             # Modo monitoramento contínuo
-            modo_monitoramento_continuo(PASTA_RESULTADOS, PASTA_FINAL, PASTA_ANALISE, PASTA_PROCESSADOS)
+            modo_monitoramento_continuo(PASTA_RESULTADOS, PASTA_FINAL, PASTA_ANALISE, PASTA_PROCESSADOS,
+                                        registro=registro, cache_mascaras=cache_mascaras,
+                                        opcoes_piramide=OPCOES_PIRAMIDE)
         else:
             # Modo processamento único
-            processar_todos_resultados(PASTA_RESULTADOS, PASTA_FINAL, PASTA_ANALISE, PASTA_PROCESSADOS)
+            processar_todos_resultados(PASTA_RESULTADOS, PASTA_FINAL, PASTA_ANALISE, PASTA_PROCESSADOS, registro,
+                                       cache_mascaras, OPCOES_PIRAMIDE)
 
     except Exception as e:
-        print(f"Erro na execução: {e}")
\ No newline at end of file
+        print(f"Erro na execução: {e}")
+    finally:
+        registro.fechar()
+        metricas.exportar(forcar=True)
+        dependencias.relatorio_importacoes("Custo das importações")
\ No newline at end of file
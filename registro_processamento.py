@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Nomes das etapas do pipeline usados como chave no registro
+ESTAGIO_CONVERSAO = 'conversao'
+ESTAGIO_DETECCAO = 'deteccao'
+ESTAGIO_REFINAMENTO = 'refinamento'
+ESTAGIO_VISUALIZACAO = 'visualizacao'
+
+STATUS_EM_ANDAMENTO = 'em_andamento'
+STATUS_CONCLUIDO = 'concluido'
+STATUS_FALHA = 'falha'
+
+
+def hash_conteudo(caminho, tamanho_bloco=4 * 1024 * 1024):
+    """Calcula o hash (BLAKE2b) do conteúdo de um arquivo lendo-o em blocos"""
+    h = hashlib.blake2b(digest_size=20)
+    with open(caminho, 'rb') as f:
+        while True:
+            bloco = f.read(tamanho_bloco)
+            if not bloco:
+                break
+            h.update(bloco)
+    return h.hexdigest()
+
+
+class RegistroProcessamento:
+    """
+    Registro persistente em SQLite dos arquivos processados por cada etapa do pipeline.
+
+    Cada entrada é identificada por (estágio, caminho de entrada) e guarda tamanho,
+    mtime e hash do conteúdo da entrada, o status e as saídas geradas. A verificação
+    normal é uma busca pela chave primária mais um os.stat; o hash só é recalculado
+    quando o mtime muda, para distinguir um arquivo tocado de um arquivo alterado.
+    Entradas que ficaram "em_andamento" (ex: após uma queda) são reprocessadas.
+    """
+
+    def __init__(self, caminho_banco):
+        self.caminho_banco = caminho_banco
+        pasta = os.path.dirname(caminho_banco)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+
+        self.lock = threading.Lock()
+        # O mesmo banco é compartilhado pelos quatro scripts: WAL permite leitores concorrentes
+        self.conexao = sqlite3.connect(caminho_banco, timeout=30, check_same_thread=False)
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.execute("PRAGMA synchronous=NORMAL")
+        self.conexao.execute("""
+            CREATE TABLE IF NOT EXISTS processamento (
+                estagio TEXT NOT NULL,
+                caminho TEXT NOT NULL,
+                tamanho INTEGER,
+                mtime_ns INTEGER,
+                hash TEXT,
+                status TEXT NOT NULL,
+                saidas TEXT,
+                erro TEXT,
+                atualizado_em REAL,
+                PRIMARY KEY (estagio, caminho)
+            )
+        """)
+        self.conexao.commit()
+
+    def _buscar(self, estagio, caminho):
+        with self.lock:
+            return self.conexao.execute(
+                "SELECT tamanho, mtime_ns, hash, status, saidas FROM processamento "
+                "WHERE estagio = ? AND caminho = ?",
+                (estagio, os.path.abspath(caminho))
+            ).fetchone()
+
+    def _gravar(self, estagio, caminho, status, tamanho=None, mtime_ns=None, hash_arquivo=None,
+                saidas=None, erro=None):
+        with self.lock:
+            self.conexao.execute(
+                "INSERT OR REPLACE INTO processamento "
+                "(estagio, caminho, tamanho, mtime_ns, hash, status, saidas, erro, atualizado_em) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (estagio, os.path.abspath(caminho), tamanho, mtime_ns, hash_arquivo, status,
+                 json.dumps([os.path.abspath(s) for s in saidas or []]), erro, time.time())
+            )
+            self.conexao.commit()
+
+    def ja_processado(self, estagio, caminho):
+        """
+        Retorna True se o arquivo já foi processado com sucesso por esta etapa,
+        não mudou desde então e todas as saídas registradas ainda existem.
+        """
+        linha = self._buscar(estagio, caminho)
+        if linha is None:
+            return False
+
+        tamanho, mtime_ns, hash_registrado, status, saidas = linha
+        if status != STATUS_CONCLUIDO:
+            return False
+
+        try:
+            stat = os.stat(caminho)
+        except FileNotFoundError:
+            return False
+
+        if stat.st_size != tamanho:
+            return False
+
+        if any(not os.path.exists(s) for s in json.loads(saidas or '[]')):
+            return False
+
+        if stat.st_mtime_ns != mtime_ns:
+            # mtime mudou: compara o conteúdo antes de decidir reprocessar
+            if hash_conteudo(caminho) != hash_registrado:
+                return False
+            with self.lock:
+                self.conexao.execute(
+                    "UPDATE processamento SET mtime_ns = ? WHERE estagio = ? AND caminho = ?",
+                    (stat.st_mtime_ns, estagio, os.path.abspath(caminho))
+                )
+                self.conexao.commit()
+
+        return True
+
+    def marcar_em_andamento(self, estagio, caminho):
+        """Registra que o processamento do arquivo começou"""
+        self._gravar(estagio, caminho, STATUS_EM_ANDAMENTO)
+
+    def marcar_concluido(self, estagio, caminho, saidas=None, hash_arquivo=None):
+        """
+        Registra o processamento bem-sucedido junto com a identidade atual do arquivo.
+        hash_arquivo evita reler o arquivo quando quem processou já calculou hash_conteudo.
+        """
+        stat = os.stat(caminho)
+        if hash_arquivo is None:
+            hash_arquivo = hash_conteudo(caminho)
+        self._gravar(estagio, caminho, STATUS_CONCLUIDO, stat.st_size, stat.st_mtime_ns, hash_arquivo, saidas)
+
+    def marcar_falha(self, estagio, caminho, erro=None):
+        """Registra uma falha; o arquivo será tentado novamente na próxima execução"""
+        self._gravar(estagio, caminho, STATUS_FALHA, erro=str(erro) if erro else None)
+
+    def interrompidos(self, estagio):
+        """Lista os arquivos que ficaram em andamento (ex: a execução anterior caiu)"""
+        with self.lock:
+            linhas = self.conexao.execute(
+                "SELECT caminho FROM processamento WHERE estagio = ? AND status = ?",
+                (estagio, STATUS_EM_ANDAMENTO)
+            ).fetchall()
+        return [linha[0] for linha in linhas]
+
+    def fechar(self):
+        with self.lock:
+            self.conexao.close()
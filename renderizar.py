@@ -0,0 +1,94 @@
+import os
+import zlib
+import struct
+import functools
+
+import numpy as np
+
+import dependencias
+
+# Nível de compressão zlib dos PNG (0 = sem compressão, 1 = mais rápido, 9 = menor arquivo)
+NIVEL_COMPRESSAO_PNG = 4
+
+# Pontos de controle (posição, valor) de cada canal dos colormaps embutidos, os mesmos do matplotlib
+COLORMAPS = {
+    'jet': (
+        ((0.0, 0.0), (0.35, 0.0), (0.66, 1.0), (0.89, 1.0), (1.0, 0.5)),
+        ((0.0, 0.0), (0.125, 0.0), (0.375, 1.0), (0.64, 1.0), (0.91, 0.0), (1.0, 0.0)),
+        ((0.0, 0.5), (0.11, 1.0), (0.34, 1.0), (0.65, 0.0), (1.0, 0.0)),
+    ),
+    'gray': (
+        ((0.0, 0.0), (1.0, 1.0)),
+        ((0.0, 0.0), (1.0, 1.0)),
+        ((0.0, 0.0), (1.0, 1.0)),
+    ),
+}
+
+_TIPO_COR_PNG = {1: 0, 2: 4, 3: 2, 4: 6}  # canais -> tipo de cor (cinza, cinza+alfa, RGB, RGBA)
+
+
+@functools.lru_cache(maxsize=None)
+def lut_colormap(nome='jet'):
+    """
+    Tabela (256, 3) uint8 do colormap. Os embutidos são calculados dos pontos de
+    controle; os demais são copiados uma única vez do matplotlib.
+    """
+    if nome in COLORMAPS:
+        posicoes = np.linspace(0, 1, 256)
+        canais = [np.interp(posicoes, *zip(*pontos)) for pontos in COLORMAPS[nome]]
+        lut = np.stack(canais, axis=1)
+    else:
+        lut = dependencias.carregar('matplotlib').colormaps[nome].resampled(256)(np.arange(256))[:, :3]
+    # Mesmo arredondamento do matplotlib (bytes=True)
+    return (lut * 255).astype(np.uint8)
+
+
+def aplicar_colormap(valores, nome='jet', vmin=0.0, vmax=1.0):
+    """Converte um array 2D em RGB uint8 indexando a LUT de 256 cores (NaN vira a primeira cor)"""
+    escala = 256 / (vmax - vmin) if vmax > vmin else 0.0
+    indices = (np.asarray(valores, dtype=np.float32) - vmin) * escala
+    np.nan_to_num(indices, copy=False, nan=0.0)
+    np.clip(indices, 0, 255, out=indices)
+    return lut_colormap(nome)[indices.astype(np.uint8)]
+
+
+def codificar_png(imagem, nivel_compressao=None):
+    """
+    Codifica um array uint8 (altura, largura) ou (altura, largura, 1-4 canais) em PNG.
+    Cada linha usa o filtro Up (diferença para a linha de cima), calculado de uma vez
+    para a imagem toda, o que reduz bem o tamanho de mapas com regiões contínuas.
+    """
+    nivel_compressao = NIVEL_COMPRESSAO_PNG if nivel_compressao is None else nivel_compressao
+    imagem = np.ascontiguousarray(imagem, dtype=np.uint8)
+    altura, largura = imagem.shape[:2]
+    canais = 1 if imagem.ndim == 2 else imagem.shape[2]
+
+    linhas = np.empty((altura, 1 + largura * canais), dtype=np.uint8)
+    linhas[:, 0] = 2  # Filtro Up
+    pixels = imagem.reshape(altura, largura * canais)
+    linhas[0, 1:] = pixels[0]
+    np.subtract(pixels[1:], pixels[:-1], out=linhas[1:, 1:])
+
+    def chunk(tipo, dados):
+        return struct.pack('>I', len(dados)) + tipo + dados + struct.pack('>I', zlib.crc32(tipo + dados))
+
+    cabecalho = struct.pack('>IIBBBBB', largura, altura, 8, _TIPO_COR_PNG[canais], 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', cabecalho)
+            + chunk(b'IDAT', zlib.compress(linhas.tobytes(), nivel_compressao)) + chunk(b'IEND', b''))
+
+
+def salvar_png(imagem, caminho, nivel_compressao=None):
+    """Grava um array uint8 como PNG; o arquivo só aparece no destino depois de completo"""
+    caminho_tmp = f"{caminho}.tmp{os.getpid()}"
+    try:
+        with open(caminho_tmp, 'wb') as f:
+            f.write(codificar_png(imagem, nivel_compressao))
+        os.replace(caminho_tmp, caminho)
+    finally:
+        if os.path.exists(caminho_tmp):
+            os.remove(caminho_tmp)
+
+
+def salvar_colormap_png(valores, caminho, nome='jet', vmin=0.0, vmax=1.0, nivel_compressao=None):
+    """Aplica o colormap e grava o PNG, um pixel da imagem por elemento do array"""
+    salvar_png(aplicar_colormap(valores, nome, vmin, vmax), caminho, nivel_compressao)
@@ -0,0 +1,257 @@
+import os
+import json
+import stat
+import time
+import socket
+import threading
+import socketserver
+
+from registro_processamento import RegistroProcessamento, ESTAGIO_DETECCAO
+from cache_modelos import CacheModelos
+import cubo_envi
+import dependencias
+import deeplearn
+import metricas
+
+# Campos obrigatórios de cada ação
+CAMPOS_PEDIDO = {
+    'ping': (),
+    'detectar': ('caminho_hdr_analise', 'caminho_saida_tif', 'caminho_saida_png'),
+}
+
+
+class ServicoDeteccao:
+    """
+    Serviço residente de detecção de anomalias.
+
+    Treina (ou recupera do cache) o scaler e o modelo uma única vez e os mantém em
+    memória junto com o runtime do TensorFlow. Cada pedido só lê o cubo de análise,
+    pontua e grava o _anomalias.tif/.png. Se os arquivos de treino mudarem, o modelo
+    é refeito no pedido seguinte. Os pedidos são atendidos um de cada vez.
+    """
+
+    def __init__(self, caminho_hdr_treino, opcoes_deteccao=None, registro=None):
+        self.caminho_hdr_treino = caminho_hdr_treino
+        self.opcoes_deteccao = dict(opcoes_deteccao or {})
+        self.registro = registro
+        self.lock = threading.Lock()
+        self.scaler = None
+        self.modelo = None
+        self.identidade_treino = None
+
+    def _identidade_treino(self):
+        identidade = []
+        for caminho in deeplearn.lista_treinos(self.caminho_hdr_treino):
+            for arquivo in sorted({caminho, cubo_envi.arquivo_dados(caminho)}):
+                stat = os.stat(arquivo)
+                identidade.append((os.path.abspath(arquivo), stat.st_size, stat.st_mtime_ns))
+        return tuple(identidade)
+
+    def preparar(self):
+        """Treina ou recarrega o modelo se ainda não houver um ou se o treino mudou"""
+        identidade = self._identidade_treino()
+        if self.modelo is not None and identidade == self.identidade_treino:
+            return
+
+        print(f"Preparando modelo com: {deeplearn.nomes_treino(self.caminho_hdr_treino)}")
+        self.scaler, self.modelo = deeplearn.obter_modelo(
+            self.caminho_hdr_treino,
+            self.opcoes_deteccao.get('cache_modelos'),
+            self.opcoes_deteccao.get('max_pixels_treino'),
+            self.opcoes_deteccao.get('detector'),
+            self.opcoes_deteccao.get('modelo_incremental'),
+        )
+        self.identidade_treino = identidade
+        print(f"Modelo pronto ({self.modelo['metodo']})")
+
+    def detectar(self, caminho_hdr_analise, caminho_saida_tif, caminho_saida_png):
+        """Processa um cubo de análise com o modelo residente; retorna True em caso de sucesso"""
+        with self.lock:
+            caminho_dados = cubo_envi.arquivo_dados(caminho_hdr_analise)
+            if self.registro:
+                self.registro.marcar_em_andamento(ESTAGIO_DETECCAO, caminho_dados)
+
+            try:
+                self.preparar()
+                deeplearn.detectar_e_salvar(self.scaler, self.modelo, caminho_hdr_analise, caminho_saida_tif,
+                                            caminho_saida_png, self.opcoes_deteccao.get('modo_tiles', False),
+                                            self.opcoes_deteccao.get('pixels_por_tile', 65536),
+                                            self.opcoes_deteccao.get('opcoes_piramide'))
+            except Exception as e:
+                print(f"Erro ao processar '{caminho_hdr_analise}': {e}")
+                if self.registro:
+                    self.registro.marcar_falha(ESTAGIO_DETECCAO, caminho_dados, e)
+                raise
+
+            if self.registro:
+                self.registro.marcar_concluido(ESTAGIO_DETECCAO, caminho_dados, [caminho_saida_png])
+            return True
+
+    def atender(self, pedido):
+        """Executa um pedido (dicionário) e retorna a resposta (dicionário)"""
+        acao = pedido.get('acao', 'detectar')
+        inicio = time.perf_counter()
+
+        if acao not in CAMPOS_PEDIDO:
+            return {'sucesso': False, 'erro': f"Ação desconhecida: {acao}"}
+        # Conferidos antes de executar: um KeyError da detecção não é um campo ausente do pedido
+        ausentes = [campo for campo in CAMPOS_PEDIDO[acao] if campo not in pedido]
+        if ausentes:
+            return {'sucesso': False, 'erro': f"Campo obrigatório ausente: {', '.join(ausentes)}"}
+
+        try:
+            if acao == 'ping':
+                metodo = self.modelo['metodo'] if self.modelo else None
+                return {'sucesso': True, 'metodo': metodo}
+
+            if acao == 'detectar':
+                self.detectar(pedido['caminho_hdr_analise'], pedido['caminho_saida_tif'],
+                              pedido['caminho_saida_png'])
+                return {'sucesso': True, 'segundos': time.perf_counter() - inicio}
+
+        except Exception as e:
+            return {'sucesso': False, 'erro': str(e), 'segundos': time.perf_counter() - inicio}
+
+
+class _AtendentePedidos(socketserver.StreamRequestHandler):
+    """Lê pedidos JSON (um por linha) de uma conexão e responde cada um com uma linha JSON"""
+
+    def handle(self):
+        for linha in self.rfile:
+            if not linha.strip():
+                continue
+            try:
+                pedido = json.loads(linha)
+            except ValueError as e:
+                resposta = {'sucesso': False, 'erro': f"Pedido inválido: {e}"}
+            else:
+                if pedido.get('acao') == 'encerrar':
+                    resposta = {'sucesso': True}
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                else:
+                    resposta = self.server.servico.atender(pedido)
+
+            self.wfile.write((json.dumps(resposta) + '\n').encode())
+            self.wfile.flush()
+
+
+class _ServidorUnix(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _liberar_socket(caminho_socket):
+    """
+    Remove um socket deixado por um serviço que caiu. Se outro serviço ainda atende
+    nesse caminho, levanta RuntimeError em vez de tomar o socket dele.
+    """
+    if not os.path.exists(caminho_socket):
+        return
+    if not stat.S_ISSOCK(os.stat(caminho_socket).st_mode):
+        raise RuntimeError(f"O caminho do socket já existe e não é um socket: {caminho_socket}")
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conexao:
+        try:
+            conexao.connect(caminho_socket)
+        except ConnectionRefusedError:
+            # Ninguém escuta: o arquivo é de uma execução anterior
+            print(f"Removendo socket abandonado: {caminho_socket}")
+            os.remove(caminho_socket)
+            return
+
+    raise RuntimeError(f"Já existe um serviço de detecção atendendo em: {caminho_socket}")
+
+
+def iniciar_servico(caminho_socket, servico):
+    """
+    Escuta pedidos no socket Unix até receber a ação 'encerrar' ou Ctrl+C.
+    O modelo é preparado antes de aceitar conexões, para que o primeiro pedido já o encontre pronto.
+    """
+    _liberar_socket(caminho_socket)
+
+    servico.preparar()
+
+    servidor = _ServidorUnix(caminho_socket, _AtendentePedidos)
+    servidor.servico = servico
+    print(f"Serviço de detecção aguardando pedidos em: {caminho_socket}")
+    print("Pressione Ctrl+C para parar\n")
+
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("\nParando serviço de detecção...")
+    finally:
+        servidor.server_close()
+        if os.path.exists(caminho_socket):
+            os.remove(caminho_socket)
+
+
+def enviar_pedido(caminho_socket, pedido, timeout=None):
+    """Envia um pedido ao serviço e aguarda a resposta (para 'detectar', até os arquivos serem gravados)"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conexao:
+        conexao.settimeout(timeout)
+        conexao.connect(caminho_socket)
+        conexao.sendall((json.dumps(pedido) + '\n').encode())
+        with conexao.makefile('rb') as leitor:
+            linha = leitor.readline()
+
+    if not linha:
+        return {'sucesso': False, 'erro': 'Conexão encerrada pelo serviço sem resposta'}
+    return json.loads(linha)
+
+
+def enviar_trabalho(caminho_socket, caminho_hdr_analise, pasta_saida, timeout=None):
+    """
+    Pede ao serviço a detecção de um cubo, com as mesmas saídas de
+    deeplearn.processar_arquivo_analise (<nome>_anomalias.tif/.png em pasta_saida).
+    """
+    os.makedirs(pasta_saida, exist_ok=True)
+    nome_base = os.path.splitext(os.path.basename(caminho_hdr_analise))[0]
+    return enviar_pedido(caminho_socket, {
+        'acao': 'detectar',
+        'caminho_hdr_analise': os.path.abspath(caminho_hdr_analise),
+        'caminho_saida_tif': os.path.abspath(os.path.join(pasta_saida, f"{nome_base}_anomalias.tif")),
+        'caminho_saida_png': os.path.abspath(os.path.join(pasta_saida, f"{nome_base}_anomalias.png")),
+    }, timeout)
+
+
+# --- EXECUÇÃO PRINCIPAL ---
+if __name__ == '__main__':
+    # CONFIGURAÇÕES
+    PASTA_TREINO = 'dados_treino'  # Arquivos para treinar o modelo
+    PASTA_CACHE_MODELOS = 'cache_modelos'  # Modelos treinados reutilizados entre execuções
+    CAMINHO_REGISTRO = 'registro_processamento.sqlite'  # Registro compartilhado pelas etapas do pipeline
+    CAMINHO_SOCKET = 'servico_deteccao.sock'  # Socket Unix onde o serviço recebe os pedidos
+    # Treina com todos os arquivos de PASTA_TREINO (amostrados) em vez do primeiro. O serviço mantém um único
+    # modelo residente para todos os pedidos, então não usa a escolha do treino por cena da biblioteca de
+    # treino: para ela, use deeplearn.py ou pipeline.py com USAR_TODOS_TREINOS = False (o padrão)
+    USAR_TODOS_TREINOS = True
+    PASTA_METRICAS = 'metricas'  # servico.jsonl (fases e contadores) e servico.prom (Prometheus); None desativa
+
+    # Opções de detecção (as mesmas de deeplearn.py)
+    OPCOES_DETECCAO = {
+        'modo_tiles': True,
+        'pixels_por_tile': 65536,
+        'cache_modelos': CacheModelos(PASTA_CACHE_MODELOS, max_entradas=5),
+        'max_pixels_treino': 200000,
+        'detector': None,
+        'opcoes_piramide': None,
+    }
+
+    print("=== SERVIÇO DE DETECÇÃO DE ANOMALIAS ===")
+    dependencias.relatorio_importacoes("Tempo de inicialização")
+    if PASTA_METRICAS:
+        metricas.configurar(PASTA_METRICAS, 'servico')
+
+    caminho_hdr_treino = deeplearn.selecionar_melhor_treino(PASTA_TREINO, USAR_TODOS_TREINOS)
+    if not caminho_hdr_treino:
+        print(f"ERRO: Nenhum arquivo de treino encontrado em: {PASTA_TREINO}")
+    else:
+        registro = RegistroProcessamento(CAMINHO_REGISTRO)
+        try:
+            iniciar_servico(CAMINHO_SOCKET, ServicoDeteccao(caminho_hdr_treino, OPCOES_DETECCAO, registro))
+        except Exception as e:
+            print(f"Erro na execução: {e}")
+        finally:
+            registro.fechar()
+            metricas.exportar(forcar=True)
+            dependencias.relatorio_importacoes("Custo das importações")
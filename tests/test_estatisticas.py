@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import estatisticas
+
+
+@pytest.fixture
+def mapa():
+    # Escores de anomalia com cauda longa, como os mapas de detecção
+    return np.random.default_rng(0).gamma(2, 50, (512, 512)).astype(np.float32)
+
+
+def _erro_relativo(estimado, exato):
+    return np.max(np.abs(np.asarray(estimado) - exato) / np.abs(exato))
+
+
+def test_percentis_sem_outlier(mapa):
+    percentis = (2, 50, 98)
+    estimado = estatisticas.percentil(mapa, percentis, exato=False)
+    assert _erro_relativo(estimado, np.percentile(mapa, percentis)) < 1e-3
+
+
+@pytest.mark.parametrize('outlier', [1e9, 1e12, 1e30, -1e12])
+def test_um_outlier_nao_degrada_os_percentis(mapa, outlier):
+    mapa[0, 0] = outlier
+    percentis = (2, 50, 98)
+    estimado = estatisticas.percentil(mapa, percentis, exato=False)
+    assert _erro_relativo(estimado, np.percentile(mapa, percentis)) < 1e-3
+
+
+def test_cauda_pesada_com_valores_negativos():
+    valores = np.random.default_rng(1).standard_t(1.5, 200000)
+    percentis = (1, 50, 99)
+    estimado = estatisticas.percentil(valores, percentis, exato=False)
+    assert _erro_relativo(estimado, np.percentile(valores, percentis)) < 1e-3
+
+
+def test_blocos_e_mascara(mapa):
+    mascara = np.random.default_rng(2).random(mapa.shape) > 0.5
+    estimador = estatisticas.EstimadorQuantis(exato=False)
+    for inicio in range(0, len(mapa), 64):
+        estimador.adicionar(mapa[inicio:inicio + 64][mascara[inicio:inicio + 64]])
+    assert _erro_relativo(estimador.quantil(98), np.percentile(mapa[mascara], 98)) < 1e-3
+    assert estatisticas.percentil(mapa, 98, mascara=mascara, exato=False) == estimador.quantil(98)
+
+
+def test_valores_constantes_e_extremos():
+    valores = np.array([0.0, 3.0, 3.0, 3.0, 7.5])
+    assert estatisticas.percentil(valores, 0, exato=False) == 0.0
+    assert estatisticas.percentil(valores, 100, exato=False) == 7.5
+    assert estatisticas.percentil(valores, 50, exato=False) == pytest.approx(3.0, rel=1e-3)
+    with pytest.raises(ValueError):
+        estatisticas.EstimadorQuantis(exato=False).quantil(50)
@@ -1,30 +1,87 @@
 import numpy as np
-from spectral import envi
-import matplotlib.pyplot as plt
 import os
-import glob
-import time
 
+from registro_processamento import RegistroProcessamento, ESTAGIO_VISUALIZACAO
+import cubo_envi
+import dependencias
+import estatisticas
+import metricas
+import piramide
+import renderizar
+from monitor_pastas import MonitorPasta, cubo_do_evento, arquivos_do_cubo, par_completo
 
-def encontrar_banda_mais_proxima(wavelengths, target_wavelength):
-    """Encontra o índice da banda cujo comprimento de onda é mais próximo do alvo."""
-    idx = np.argmin(np.abs(np.array(wavelengths) - target_wavelength))
-    return idx
+
+def indices_rgb(metadados):
+    """Índices das bandas Vermelha, Verde e Azul (por comprimento de onda ou padrão do EMIT)"""
+    # TENTAR encontrar as bandas RGB usando comprimentos de onda
+    try:
+        wavelengths = metadados['wavelengths']
+
+        red_target = 650
+        green_target = 550
+        blue_target = 450
+
+        # Tabela pré-calculada no índice do cubo (ver cubo_envi.gravar_indice)
+        red_idx = cubo_envi.banda_mais_proxima(metadados, red_target)
+        green_idx = cubo_envi.banda_mais_proxima(metadados, green_target)
+        blue_idx = cubo_envi.banda_mais_proxima(metadados, blue_target)
+
+        print("--- Seleção de Bandas por Comprimento de Onda ---")
+        print(f"Banda Vermelha (R): Índice {red_idx} @ {wavelengths[red_idx]:.2f} nm")
+        print(f"Banda Verde   (G): Índice {green_idx} @ {wavelengths[green_idx]:.2f} nm")
+        print(f"Banda Azul    (B): Índice {blue_idx} @ {wavelengths[blue_idx]:.2f} nm")
+
+    except KeyError:
+        # SE FALHAR (KeyError: 'wavelength'), usar bandas padrão para EMIT
+        print("\nAVISO: Informação de 'wavelength' não encontrada no arquivo .hdr.")
+        print("Usando índices de banda padrão para o sensor EMIT (285 bandas).")
+
+        # Estas são estimativas seguras para o sensor EMIT
+        red_idx = 40
+        green_idx = 25
+        blue_idx = 15
+
+        print("--- Seleção de Bandas por Índices Padrão ---")
+        print(f"Banda Vermelha (R): Índice {red_idx}")
+        print(f"Banda Verde   (G): Índice {green_idx}")
+        print(f"Banda Azul    (B): Índice {blue_idx}")
+
+    return red_idx, green_idx, blue_idx
+
+
+def compor_rgb(rgb_data, metadados):
+    """Zera o nodata e aplica o realce de contraste 2-98%, retornando a imagem RGB uint8"""
+    nodata_val = metadados['ignore'] if metadados['ignore'] is not None else -9999
+    rgb_data[rgb_data == nodata_val] = 0
+
+    # Aprimoramento de Contraste
+    p2, p98 = estatisticas.percentil(rgb_data, (2, 98))
+    rgb_stretched = np.clip(rgb_data, p2, p98)
+    rgb_normalized = (rgb_stretched - p2) / (p98 - p2)
+    return (rgb_normalized * 255).astype(np.uint8)
 
 
-def converter_raw_para_rgb(caminho_arquivo_hdr, caminho_saida_rgb):
+def salvar_rgb(rgb_final, caminho_saida_rgb):
+    """Grava a imagem RGB como PNG"""
+    renderizar.salvar_png(rgb_final, caminho_saida_rgb)
+    print(f"Sucesso! Imagem RGB visível salva em: '{caminho_saida_rgb}'")
+
+
+def converter_raw_para_rgb(caminho_arquivo_hdr, caminho_saida_rgb, opcoes_piramide=None):
     """
     Lê um arquivo hiperespectral ENVI (.raw + .hdr) e o converte para uma imagem
     RGB visível (.png) com aprimoramento de contraste.
+    Com opcoes_piramide (dicionário), a imagem também é gravada como pirâmide de tiles.
     """
+    fases = metricas.Fases('visualizacao', cena=os.path.basename(caminho_arquivo_hdr))
     try:
         # Verifica se o arquivo .hdr existe
         if not os.path.exists(caminho_arquivo_hdr):
             print(f"Arquivo .hdr não encontrado: {caminho_arquivo_hdr}")
             return False
 
-        # Verifica se o arquivo .raw correspondente existe
-        caminho_raw = caminho_arquivo_hdr.replace('.hdr', '.raw')
+        # Verifica se o arquivo .raw correspondente existe (para cubos .h5 é o próprio arquivo)
+        caminho_raw = cubo_envi.arquivo_dados(caminho_arquivo_hdr)
         if not os.path.exists(caminho_raw):
             print(f"Arquivo .raw não encontrado: {caminho_raw}")
             return False
@@ -32,56 +89,29 @@ def converter_raw_para_rgb(caminho_arquivo_hdr, caminho_saida_rgb):
         print(f"\n--- PROCESSANDO: {os.path.basename(caminho_arquivo_hdr)} ---")
 
         # 1. Ler o cabeçalho para obter metadados
-        hdr = envi.read_envi_header(caminho_arquivo_hdr)
-        img = envi.open(caminho_arquivo_hdr)
-
-        # 2. TENTAR encontrar as bandas RGB usando comprimentos de onda
-        try:
-            wavelengths = [float(w) for w in hdr['wavelength']]
-
-            red_target = 650
-            green_target = 550
-            blue_target = 450
-
-            red_idx = encontrar_banda_mais_proxima(wavelengths, red_target)
-            green_idx = encontrar_banda_mais_proxima(wavelengths, green_target)
-            blue_idx = encontrar_banda_mais_proxima(wavelengths, blue_target)
+        fases.iniciar('metadados')
+        metadados = cubo_envi.ler_metadados(caminho_arquivo_hdr)
 
-            print("--- Seleção de Bandas por Comprimento de Onda ---")
-            print(f"Banda Vermelha (R): Índice {red_idx} @ {wavelengths[red_idx]:.2f} nm")
-            print(f"Banda Verde   (G): Índice {green_idx} @ {wavelengths[green_idx]:.2f} nm")
-            print(f"Banda Azul    (B): Índice {blue_idx} @ {wavelengths[blue_idx]:.2f} nm")
-
-        except KeyError:
-            # SE FALHAR (KeyError: 'wavelength'), usar bandas padrão para EMIT
-            print("\nAVISO: Informação de 'wavelength' não encontrada no arquivo .hdr.")
-            print("Usando índices de banda padrão para o sensor EMIT (285 bandas).")
-
-            # Estas são estimativas seguras para o sensor EMIT
-            red_idx = 40
-            green_idx = 25
-            blue_idx = 15
-
-            print("--- Seleção de Bandas por Índices Padrão ---")
-            print(f"Banda Vermelha (R): Índice {red_idx}")
-            print(f"Banda Verde   (G): Índice {green_idx}")
-            print(f"Banda Azul    (B): Índice {blue_idx}")
+        # 2. Selecionar as bandas RGB
+        fases.iniciar('bandas')
+        red_idx, green_idx, blue_idx = indices_rgb(metadados)
 
         # 3. Ler os dados das bandas RGB selecionadas
-        rgb_data = img.read_bands([red_idx, green_idx, blue_idx])
-
-        nodata_val = float(hdr.get('data ignore value', -9999))
-        rgb_data[rgb_data == nodata_val] = 0
+        # Cubos int16 escalados são decodificados para float32
+        fases.iniciar('ler')
+        rgb_data = cubo_envi.ler_bandas(caminho_arquivo_hdr, [red_idx, green_idx, blue_idx], metadados)
 
         # 4. Aprimoramento de Contraste
-        p2, p98 = np.percentile(rgb_data, (2, 98))
-        rgb_stretched = np.clip(rgb_data, p2, p98)
-        rgb_normalized = (rgb_stretched - p2) / (p98 - p2)
-        rgb_final = (rgb_normalized * 255).astype(np.uint8)
+        fases.iniciar('contraste')
+        rgb_final = compor_rgb(rgb_data, metadados)
 
         # 5. Salvar a imagem RGB final
-        plt.imsave(caminho_saida_rgb, rgb_final)
-        print(f"Sucesso! Imagem RGB visível salva em: '{caminho_saida_rgb}'")
+        fases.iniciar('gravar')
+        salvar_rgb(rgb_final, caminho_saida_rgb)
+        if opcoes_piramide is not None:
+            fases.iniciar('piramide')
+            piramide.gravar_piramide(rgb_final, piramide.pasta_piramide(caminho_saida_rgb), **opcoes_piramide)
+        fases.concluir()
         return True
 
     except FileNotFoundError:
@@ -90,32 +120,61 @@ def converter_raw_para_rgb(caminho_arquivo_hdr, caminho_saida_rgb):
     except Exception as e:
         print(f"Ocorreu um erro inesperado: {e}")
         return False
+    finally:
+        fases.concluir(sucesso=False)
 
 
-def processar_todos_arquivos_raw(pasta_entrada, pasta_saida):
+def converter_com_registro(caminho_hdr, caminho_saida, registro=None, opcoes_piramide=None):
     """
-    Processa todos os arquivos .hdr/.raw da pasta de entrada
+    Executa converter_raw_para_rgb consultando o registro persistente: cenas já
+    convertidas (e inalteradas) são puladas. Retorna (sucesso, pulado).
+    """
+    # A identidade da cena no registro é a do .raw, que contém os dados
+    caminho_raw = cubo_envi.arquivo_dados(caminho_hdr)
+    if registro and registro.ja_processado(ESTAGIO_VISUALIZACAO, caminho_raw):
+        return True, True
+
+    if registro:
+        registro.marcar_em_andamento(ESTAGIO_VISUALIZACAO, caminho_raw)
+
+    sucesso = converter_raw_para_rgb(caminho_hdr, caminho_saida, opcoes_piramide)
+
+    if registro:
+        if sucesso:
+            registro.marcar_concluido(ESTAGIO_VISUALIZACAO, caminho_raw, [caminho_saida])
+        else:
+            registro.marcar_falha(ESTAGIO_VISUALIZACAO, caminho_raw)
+    return sucesso, False
+
+
+def processar_todos_arquivos_raw(pasta_entrada, pasta_saida, registro=None, opcoes_piramide=None):
+    """
+    Processa todos os arquivos .hdr/.raw da pasta de entrada.
+    Com um registro persistente, cenas já convertidas (e inalteradas) são puladas.
+    Retorna os cubos convertidos ou pulados; os que falharam ficam de fora.
     """
     print("=== PROCESSANDO TODOS OS ARQUIVOS RAW PARA RGB ===")
 
     # Cria a pasta de saída se não existir
     os.makedirs(pasta_saida, exist_ok=True)
 
-    # Encontra todos os arquivos .hdr na pasta de entrada
-    arquivos_hdr = glob.glob(os.path.join(pasta_entrada, "*.hdr"))
+    # Encontra todos os arquivos .hdr (e cubos .h5) na pasta de entrada
+    arquivos_hdr = cubo_envi.listar_cubos(pasta_entrada)
 
     if not arquivos_hdr:
         print(f"Nenhum arquivo .hdr encontrado na pasta: {pasta_entrada}")
-        return
+        return []
 
     print(f"Encontrados {len(arquivos_hdr)} arquivos para processar")
 
     sucessos = 0
     erros = 0
+    pulados = 0
+    concluidos = []
 
     for caminho_hdr in arquivos_hdr:
         # Verifica se o arquivo .raw correspondente existe
-        caminho_raw = caminho_hdr.replace('.hdr', '.raw')
+        caminho_raw = cubo_envi.arquivo_dados(caminho_hdr)
         if not os.path.exists(caminho_raw):
             print(f"AVISO: Arquivo .raw não encontrado para: {caminho_hdr}")
             erros += 1
@@ -126,84 +185,78 @@ def processar_todos_arquivos_raw(pasta_entrada, pasta_saida):
         caminho_saida = os.path.join(pasta_saida, f"{nome_base}_rgb.png")
 
         # Processa o arquivo
-        sucesso = converter_raw_para_rgb(caminho_hdr, caminho_saida)
+        sucesso, pulado = converter_com_registro(caminho_hdr, caminho_saida, registro, opcoes_piramide)
 
-        if sucesso:
+        if pulado:
+            pulados += 1
+        elif sucesso:
             sucessos += 1
         else:
             erros += 1
+        if sucesso or pulado:
+            concluidos.append(caminho_hdr)
 
     print(f"\n=== RESUMO DO PROCESSAMENTO ===")
     print(f"Arquivos processados com sucesso: {sucessos}")
     print(f"Arquivos com erro: {erros}")
+    print(f"Arquivos já convertidos anteriormente: {pulados}")
     print(f"Total: {sucessos + erros}")
     print(f"Imagens RGB salvas em: {pasta_saida}")
+    return concluidos
 
 
-def monitorar_pasta_raw(pasta_entrada, pasta_saida, intervalo=10):
+def monitorar_pasta_raw(pasta_entrada, pasta_saida, intervalo_varredura=300, registro=None, opcoes_piramide=None):
     """
     Monitora continuamente a pasta de entrada por novos arquivos .hdr/.raw
+    (eventos do watchdog, com varredura completa a cada intervalo_varredura segundos)
     """
     print("=== INICIANDO MONITORAMENTO DE ARQUIVOS RAW ===")
     print(f"Pasta de entrada: {pasta_entrada}")
     print(f"Pasta de saída: {pasta_saida}")
-    print(f"Verificando novos arquivos a cada {intervalo} segundos...")
     print("Pressione Ctrl+C para parar\n")
 
     # Cria a pasta de saída se não existir
     os.makedirs(pasta_saida, exist_ok=True)
 
     # Processa arquivos existentes primeiro
-    processar_todos_arquivos_raw(pasta_entrada, pasta_saida)
-
-    # Conjunto para rastrear arquivos já processados
-    arquivos_processados = set(glob.glob(os.path.join(pasta_entrada, "*.hdr")))
+    concluidos = processar_todos_arquivos_raw(pasta_entrada, pasta_saida, registro, opcoes_piramide)
 
     print(f"\n=== INICIANDO MONITORAMENTO ===")
     print("Aguardando novos arquivos... (Ctrl+C para parar)")
 
+    def processar(caminho_hdr):
+        print(f"Novo arquivo detectado: {os.path.basename(caminho_hdr)}")
+
+        # Gera nome de saída
+        nome_base = os.path.splitext(os.path.basename(caminho_hdr))[0]
+        caminho_saida = os.path.join(pasta_saida, f"{nome_base}_rgb.png")
+
+        # Processa o arquivo
+        sucesso, _ = converter_com_registro(caminho_hdr, caminho_saida, registro, opcoes_piramide)
+
+        if sucesso:
+            print(f"Arquivo processado com sucesso: {nome_base}_rgb.png")
+        else:
+            print(f"Falha ao processar: {os.path.basename(caminho_hdr)}")
+        return sucesso
+
+    monitor = MonitorPasta(pasta_entrada, cubo_do_evento, lambda: cubo_envi.listar_cubos(pasta_entrada), processar,
+                           pronto=par_completo, arquivos=arquivos_do_cubo, intervalo_varredura=intervalo_varredura)
+    # Só os cubos tratados com sucesso acima ficam de fora da varredura; os que falharam são tentados de novo
+    monitor.concluidos.update(concluidos)
+
     try:
-        while True:
-            # Verifica por novos arquivos
-            arquivos_atual = set(glob.glob(os.path.join(pasta_entrada, "*.hdr")))
-            novos_arquivos = arquivos_atual - arquivos_processados
-
-            for caminho_hdr in novos_arquivos:
-                # Verifica se o arquivo .raw correspondente existe
-                caminho_raw = caminho_hdr.replace('.hdr', '.raw')
-                if os.path.exists(caminho_raw):
-                    print(f"Novo arquivo detectado: {os.path.basename(caminho_hdr)}")
-
-                    # Gera nome de saída
-                    nome_base = os.path.splitext(os.path.basename(caminho_hdr))[0]
-                    caminho_saida = os.path.join(pasta_saida, f"{nome_base}_rgb.png")
-
-                    # Processa o arquivo
-                    sucesso = converter_raw_para_rgb(caminho_hdr, caminho_saida)
-
-                    if sucesso:
-                        arquivos_processados.add(caminho_hdr)
-                        print(f"Arquivo processado com sucesso: {nome_base}_rgb.png")
-                    else:
-                        print(f"Falha ao processar: {os.path.basename(caminho_hdr)}")
-                else:
-                    print(f"Aguardando arquivo .raw correspondente para: {caminho_hdr}")
-
-            # Aguarda antes da próxima verificação
-            time.sleep(intervalo)
-
-    except KeyboardInterrupt:
-        print("\nParando monitoramento...")
+        monitor.executar()
     except Exception as e:
         print(f"Erro no monitoramento: {e}")
 
 
-def modo_processamento_unico(pasta_entrada, pasta_saida):
+def modo_processamento_unico(pasta_entrada, pasta_saida, registro=None, opcoes_piramide=None):
     """
     Modo único: processa todos os arquivos e termina
     """
     print("=== MODO PROCESSAMENTO ÚNICO ===")
-    processar_todos_arquivos_raw(pasta_entrada, pasta_saida)
+    processar_todos_arquivos_raw(pasta_entrada, pasta_saida, registro, opcoes_piramide)
     print("Processamento concluído.")
 
 
@@ -212,6 +265,11 @@ if __name__ == '__main__':
     # CONFIGURAÇÕES
     PASTA_ENTRADA = 'processados'  # Pasta com arquivos .hdr/.raw originais
     PASTA_SAIDA = 'final'  # Pasta onde as imagens RGB serão salvas
+    CAMINHO_REGISTRO = 'registro_processamento.sqlite'  # Registro compartilhado pelas etapas do pipeline
+    QUANTIS_EXATOS = False  # True calcula o contraste com np.percentile (validação do histograma)
+    NIVEL_COMPRESSAO_PNG = 4  # zlib 0-9: 1 grava mais rápido, 9 gera PNGs menores
+    PASTA_METRICAS = 'metricas'  # <script>.jsonl (fases e contadores) e <script>.prom (Prometheus); None desativa
+    OPCOES_PIRAMIDE = None  # Ex: {'tamanho_tile': 256, 'formato': 'png'} para gravar também tiles XYZ
 
     MODO_MONITORAMENTO = True  # True para monitorar continuamente, False para processar uma vez
 
@@ -222,15 +280,26 @@ if __name__ == '__main__':
     print("=== CONVERSOR RAW PARA RGB ===")
     print(f"Pasta de entrada: {PASTA_ENTRADA}")
     print(f"Pasta de saída: {PASTA_SAIDA}")
-    print()
+    dependencias.relatorio_importacoes("Tempo de inicialização")
+    estatisticas.MODO_EXATO = QUANTIS_EXATOS
+    renderizar.NIVEL_COMPRESSAO_PNG = NIVEL_COMPRESSAO_PNG
+    if PASTA_METRICAS:
+        metricas.configurar(PASTA_METRICAS, 'visualizar')
+
+    registro = RegistroProcessamento(CAMINHO_REGISTRO)
 
     try:
         if MODO_MONITORAMENTO:
             # Modo monitoramento contínuo
-            monitorar_pasta_raw(PASTA_ENTRADA, PASTA_SAIDA, intervalo=10)
+            monitorar_pasta_raw(PASTA_ENTRADA, PASTA_SAIDA, intervalo_varredura=300, registro=registro,
+                                opcoes_piramide=OPCOES_PIRAMIDE)
         else:
             # Modo processamento único
-            modo_processamento_unico(PASTA_ENTRADA, PASTA_SAIDA)
+            modo_processamento_unico(PASTA_ENTRADA, PASTA_SAIDA, registro, OPCOES_PIRAMIDE)
 
     except Exception as e:
-        print(f"Erro na execução: {e}")
\ No newline at end of file
+        print(f"Erro na execução: {e}")
+    finally:
+        registro.fechar()
+        metricas.exportar(forcar=True)
+        dependencias.relatorio_importacoes("Custo das importações")
\ No newline at end of file